@@ -0,0 +1,74 @@
+"""
+Compiles programs made of one long chained arithmetic expression (a - 1 - 2 - ...) of growing
+length and reports the code generation time per operator. Subtraction is left associative in the
+grammar, so the chain is one deep left spine of BinaryExpressions. With every expression type
+computed once, the time per operator stays flat as the chain grows.
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/chained_expressions.py [longest_chain]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.decaf_transformer import DecafTransformer  # noqa: E402
+from src.emitter import ListEmitter  # noqa: E402
+from src.parser import build_parser  # noqa: E402
+
+
+class ASTOnlyTransformer(DecafTransformer):
+    def finalize(self, args):
+        return args
+
+
+def chained_program(length: int) -> str:
+    terms = ["a"]
+    for i in range(length):
+        terms.append(f"- {i % 7 + 1}")
+    return f"""
+int main() {{
+    int a;
+    int s;
+    a = 3;
+    s = {" ".join(terms)};
+    Print(s);
+}}
+"""
+
+
+def measure(parser, length: int) -> float:
+    declarations = parser.parse(chained_program(length))
+    start = time.perf_counter()
+    transformer = DecafTransformer(ListEmitter())
+    transformer.finalize(declarations)
+    return time.perf_counter() - start
+
+
+def run(longest_chain: int):
+    # Building the AST of the chain is not part of what we measure.
+    parser = build_parser(transformer=ASTOnlyTransformer())
+    length = 250
+    print(f"{'operators':>10} {'codegen':>10} {'per operator':>14}")
+    while length <= longest_chain:
+        elapsed = measure(parser, length)
+        print(
+            f"{length:>10} {elapsed * 1000:>8.1f}ms {elapsed / length * 1e6:>12.1f}us"
+        )
+        length *= 2
+
+
+def main(argv):
+    longest_chain = int(argv[0]) if argv else 4000
+    # Long chains make deep ASTs and code generation recurses once per operator.
+    sys.setrecursionlimit(max(10000, longest_chain * 20))
+    threading.stack_size(512 * 2 ** 20)
+    thread = threading.Thread(target=run, args=(longest_chain,))
+    thread.start()
+    thread.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,54 @@
+"""
+Compiles programs with one deep chain of classes (C1 extends C0, C2 extends C1, ...) where every class
+adds a field and a method that reads and writes inherited fields, and an object of every class is
+created and used. Reports the compile time for growing hierarchy depths.
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/class_hierarchy.py [deepest_hierarchy]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import compile_source  # noqa: E402
+
+
+def hierarchy_program(depth: int) -> str:
+    classes = [
+        "class C0 {\n    int f0;\n    int m0() {\n        f0 = 0;\n        return f0;\n    }\n}"
+    ]
+    for i in range(1, depth):
+        classes.append(
+            f"""class C{i} extends C{i - 1} {{
+    int f{i};
+    int m{i}() {{
+        f{i} = f0 + f{i - 1};
+        this.f{i // 2} = f{i};
+        return m{i - 1}() + f{i};
+    }}
+}}"""
+        )
+    users = "\n".join(
+        f"int use{i}() {{\n    C{i} o;\n    o = new C{i};\n    return o.m{i}();\n}}"
+        for i in range(depth)
+    )
+    calls = "\n".join(f"    Print(use{i}());" for i in range(depth))
+    return "\n".join(classes) + f"\n{users}\nint main() {{\n{calls}\n}}\n"
+
+
+def main(argv):
+    deepest_hierarchy = int(argv[0]) if argv else 400
+    depth = 25
+    print(f"{'depth':>6} {'compile':>10}")
+    while depth <= deepest_hierarchy:
+        source = hierarchy_program(depth)
+        start = time.perf_counter()
+        compile_source(source, inline_transform=True)
+        print(f"{depth:>6} {(time.perf_counter() - start) * 1000:>8.1f}ms")
+        depth *= 2
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
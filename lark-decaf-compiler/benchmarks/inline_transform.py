@@ -0,0 +1,94 @@
+"""
+Compares building the AST from a materialized Lark parse tree against running DecafTransformer
+inline while the LALR parser reduces, on a large synthetic program. Reports time and peak
+traced memory, both for the front end alone (AST only) and for the whole compilation.
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/inline_transform.py [number_of_functions]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.decaf_transformer import DecafTransformer  # noqa: E402
+from src.parser import build_parser, decaf_parser  # noqa: E402
+
+
+class ASTOnlyTransformer(DecafTransformer):
+    def finalize(self, args):
+        return args
+
+
+def synthetic_program(number_of_functions: int) -> str:
+    functions = []
+    for i in range(number_of_functions):
+        functions.append(
+            f"""
+int f{i}(int a, int b) {{
+    int i;
+    int s;
+    s = a * {i} + b - (a - b) * 3;
+    for (i = 0; i < {i % 17 + 1}; i = i + 1) {{
+        s = s + i * (a + b) / 2 - i % 5;
+        if (s > 1000) s = s - 1000; else s = s + 1;
+    }}
+    Print("f{i}", s, a < b, a == b);
+    return s;
+}}"""
+        )
+    calls = "\n".join(
+        f"    Print(f{i}({i}, {i + 1}));" for i in range(number_of_functions)
+    )
+    return "\n".join(functions) + f"\nint main() {{\n{calls}\n    return 0;\n}}\n"
+
+
+def measure(function):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def report(title: str, tree_mode, inline_mode):
+    tree_time, tree_peak = measure(tree_mode)
+    inline_time, inline_peak = measure(inline_mode)
+    print(title)
+    print(
+        f"  parse tree + transform: {tree_time:7.2f} s  peak {tree_peak / 2 ** 20:8.1f} MiB"
+    )
+    print(
+        f"  inline transformer:     {inline_time:7.2f} s  peak {inline_peak / 2 ** 20:8.1f} MiB"
+    )
+
+
+def main(argv):
+    number_of_functions = int(argv[0]) if argv else 500
+    source = synthetic_program(number_of_functions)
+    print(
+        f"Synthetic program: {number_of_functions} functions, {len(source.splitlines())} lines"
+    )
+    ast_only_parser = build_parser(transformer=ASTOnlyTransformer())
+    full_parser = build_parser(transformer=DecafTransformer())
+    report(
+        "Front end (AST only):",
+        lambda: ASTOnlyTransformer().transform(decaf_parser.parse(source)),
+        lambda: ast_only_parser.parse(source),
+    )
+    report(
+        "Whole compilation:",
+        lambda: DecafTransformer().transform(decaf_parser.parse(source)),
+        lambda: full_parser.parse(source),
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""
+Compiles the test programs at -O1 and -O2 and reports, for every program, the number of IR
+instructions and of MIPS instructions generated for it (the standard library not included).
+Programs that do not compile, like the tests of semantic errors, are skipped.
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/instruction_counts.py [file|directory|glob]...
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import collect_batch_inputs, compile_to_stream  # noqa: E402
+
+DEFAULT_INPUTS = ["tests/*.d", "phase2_tests/*.in"]
+LEVELS = (1, 2)
+
+
+def count_instructions(code: str) -> int:
+    return sum(
+        1
+        for line in code.splitlines()
+        if line.startswith("\t") and not line.lstrip().startswith(".")
+    )
+
+
+def measure(raw_code: str, optimization_level: int):
+    output, ir = io.StringIO(), io.StringIO()
+    compile_to_stream(
+        raw_code,
+        output,
+        optimization_level=optimization_level,
+        ir_stream=ir,
+        runtime=False,
+    )
+    return count_instructions(ir.getvalue()), count_instructions(output.getvalue())
+
+
+def main(argv):
+    inputs = collect_batch_inputs(argv or DEFAULT_INPUTS)
+    header = "".join(f"{f'IR -O{level}':>9}{f'MIPS -O{level}':>11}" for level in LEVELS)
+    print(f"{'program':<32}{header}")
+    totals = [0] * (2 * len(LEVELS))
+    skipped = 0
+    for input_path in inputs:
+        with open(input_path, "r") as input_file:
+            raw_code = input_file.read()
+        try:
+            counts = [
+                count
+                for level in LEVELS
+                for count in measure(raw_code, optimization_level=level)
+            ]
+        except Exception:
+            skipped += 1
+            continue
+        totals = [total + count for total, count in zip(totals, counts)]
+        row = "".join(
+            f"{ir:>9}{mips:>11}" for ir, mips in zip(counts[::2], counts[1::2])
+        )
+        print(f"{input_path:<32}{row}")
+    row = "".join(f"{ir:>9}{mips:>11}" for ir, mips in zip(totals[::2], totals[1::2]))
+    print(f"{'total':<32}{row}")
+    if skipped:
+        print(f"{skipped} programs did not compile.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,47 @@
+"""
+Compares the time it takes to import src.parser with a cold parser cache (LALR tables are built
+from the grammar) against a warm one (tables are loaded from the cache file).
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/parser_startup.py [runs]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+COMPILER_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(cache_directory: str) -> float:
+    environment = dict(os.environ, DECAF_CACHE_DIR=cache_directory)
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import src.parser"],
+        cwd=COMPILER_ROOT,
+        env=environment,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main(argv):
+    runs = int(argv[0]) if argv else 5
+    cold_times, warm_times = [], []
+    for _ in range(runs):
+        cache_directory = tempfile.mkdtemp(prefix="decaf-parser-cache-")
+        try:
+            cold_times.append(time_import(cache_directory))
+            warm_times.append(time_import(cache_directory))
+        finally:
+            shutil.rmtree(cache_directory)
+    cold, warm = min(cold_times), min(warm_times)
+    print(f"cold import of src.parser: {cold * 1000:8.1f} ms (best of {runs})")
+    print(f"warm import of src.parser: {warm * 1000:8.1f} ms (best of {runs})")
+    print(f"speedup: {cold / warm:.2f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
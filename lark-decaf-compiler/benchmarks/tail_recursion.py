@@ -0,0 +1,107 @@
+"""
+Stress test of tail calls: functions and a method that recurse a million levels deep, once by
+themselves and once through each other. Compiled at -O1 and -O2, tail calls reuse the frame, so the
+programs run in constant stack. Without that they need tens of megabytes of stack and SPIM fails.
+Reports the compile time and, if spim is installed, the run time and whether the output is right.
+
+Run from the lark-decaf-compiler folder:
+    python benchmarks/tail_recursion.py [depth]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import compile_source  # noqa: E402
+
+LEVELS = (1, 2)
+MODULUS = 9973
+
+
+def recursive_program(depth: int) -> str:
+    return f"""
+int sum(int n, int acc) {{
+    if (n == 0)
+        return acc;
+    return sum(n - 1, (acc + n) % {MODULUS});
+}}
+bool even(int n) {{
+    if (n == 0)
+        return true;
+    return odd(n - 1);
+}}
+bool odd(int n) {{
+    if (n == 0)
+        return false;
+    return even(n - 1);
+}}
+class Counter {{
+    int steps;
+    int down(int n) {{
+        if (n == 0)
+            return steps;
+        steps = steps + 1;
+        return down(n - 1);
+    }}
+}}
+int main() {{
+    Counter counter;
+    counter = new Counter;
+    Print(sum({depth}, 0));
+    Print(even({depth}), odd({depth}));
+    Print(counter.down({depth}));
+    return 0;
+}}
+"""
+
+
+def expected_output(depth: int) -> str:
+    even = "true" if depth % 2 == 0 else "false"
+    odd = "false" if depth % 2 == 0 else "true"
+    total = sum(range(depth + 1)) % MODULUS
+    return f"{total}\n{even}{odd}\n{depth}\n"
+
+
+def run_spim(assembly_path: str) -> str:
+    result = subprocess.run(
+        ["spim", "-a", "-f", assembly_path], capture_output=True, text=True
+    )
+    # spim prints where it loaded the exception handler from before the program runs.
+    lines = result.stdout.splitlines(keepends=True)
+    if lines and lines[0].startswith("Loaded:"):
+        lines = lines[1:]
+    return "".join(lines)
+
+
+def main(argv):
+    depth = int(argv[0]) if argv else 1000000
+    source = recursive_program(depth)
+    expected = expected_output(depth)
+    has_spim = shutil.which("spim") is not None
+    if not has_spim:
+        print("spim not found, only compiling.")
+    print(f"Recursion depth {depth}")
+    for level in LEVELS:
+        start = time.perf_counter()
+        code = compile_source(source, optimization_level=level)
+        compile_time = time.perf_counter() - start
+        line = f"  -O{level}: compile {compile_time * 1000:7.1f}ms"
+        if has_spim:
+            with tempfile.TemporaryDirectory() as directory:
+                assembly_path = os.path.join(directory, "tail_recursion.s")
+                with open(assembly_path, "w") as assembly_file:
+                    assembly_file.write(code)
+                start = time.perf_counter()
+                output = run_spim(assembly_path)
+                run_time = time.perf_counter() - start
+            status = "ok" if output == expected else f"wrong output {output!r}"
+            line += f"  run {run_time:7.2f}s  {status}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
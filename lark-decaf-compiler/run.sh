@@ -10,6 +10,16 @@ REPORT_DIRECTORY="report/"
 NUMBER_OF_PASSED=0
 NUMBER_OF_FAILED=0
 cd ../
+# Compile every test in a single interpreter. Stale assembly is removed so failures are noticed.
+# Arguments, like -O2, are passed on to the compiler.
+for filelist in ${dirlist[*]}; do
+  rm -f "$OUTPUT_DIRECTORY$(echo $filelist | cut -d'.' -f1).s"
+done
+if command -v python3; then
+  python3 -m src.main --batch "$@" --outdir "$OUTPUT_DIRECTORY" ${dirlist[*]/#/$TEST_DIRECTORY}
+else
+  python -m src.main --batch "$@" --outdir "$OUTPUT_DIRECTORY" ${dirlist[*]/#/$TEST_DIRECTORY}
+fi
 for filelist in ${dirlist[*]}; do
   filename=$(echo $filelist | cut -d'.' -f1)
   output_filename="$filename.out"
@@ -18,12 +28,7 @@ for filelist in ${dirlist[*]}; do
   program_input="$filename.in"
   report_filename="$filename.report.txt"
   echo "Running Test $filename -------------------------------------"
-  if command -v python3; then
-    python3 -m src.main -i $filelist -o $code_output_filename
-  else
-    python -m src.main -i $filelist -o $code_output_filename
-  fi
-  if [ $? -eq 0 ]; then
+  if [ -f "$OUTPUT_DIRECTORY$code_output_filename" ]; then
     echo "Code Compiled Successfuly!"
     spim -a -f "$OUTPUT_DIRECTORY$output_asm" <"$TEST_DIRECTORY$program_input" >"$OUTPUT_DIRECTORY$output_filename"
     if [ $? -eq 0 ]; then
@@ -1 +1,7 @@
-from .parser import decaf_parser
+def __getattr__(name):
+    # Lazy, so light entry points like the compile client do not pay for loading the parser.
+    if name == "decaf_parser":
+        from .parser import decaf_parser
+
+        return decaf_parser
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
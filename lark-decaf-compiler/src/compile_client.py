@@ -0,0 +1,106 @@
+"""
+Thin client for the compile server, taking the same -i/-o flags as src.main.
+Falls back to compiling in process when no server of the user is running.
+
+Run from the lark-decaf-compiler folder:
+    python -m src.compile_client -i <inputfile> -o <outputfile> [--socket <path>]
+"""
+import getopt
+import os
+import socket
+import sys
+from typing import Dict
+
+from .compile_protocol import (
+    DEFAULT_SOCKET_PATH,
+    HEADER,
+    belongs_to_user,
+    decode_length,
+    decode_payload,
+    encode_message,
+)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Compile server closed the connection.")
+        data += chunk
+    return bytes(data)
+
+
+def request_compilation(source: str, socket_path: str = DEFAULT_SOCKET_PATH) -> Dict:
+    if not belongs_to_user(socket_path):
+        raise PermissionError(f"{socket_path} belongs to another user.")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(encode_message({"source": source}))
+        length = decode_length(receive_exactly(connection, HEADER.size))
+        return decode_payload(receive_exactly(connection, length))
+
+
+def format_error(error: Dict) -> str:
+    if error.get("line") is not None:
+        return f"{error['type']} at line {error['line']}, column {error['column']}: {error['message']}"
+    return f"{error['type']}: {error['message']}"
+
+
+def compile_in_process(raw_code: str) -> Dict:
+    from .main import compile_source
+
+    try:
+        return {"ok": True, "assembly": compile_source(raw_code)}
+    except BaseException as e:
+        print(e)
+        sys.exit(1)
+
+
+def print_usage():
+    print("compile_client.py -i <inputfile> -o <outputfile> [--socket <path>]")
+
+
+def main(argv):
+    inputfile = ""
+    outputfile = ""
+    socket_path = DEFAULT_SOCKET_PATH
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:s:", ["ifile=", "ofile=", "socket="])
+    except getopt.GetoptError:
+        print_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print_usage()
+            sys.exit()
+        elif opt in ("-i", "--ifile"):
+            inputfile = arg
+        elif opt in ("-o", "--ofile"):
+            outputfile = arg
+        elif opt in ("-s", "--socket"):
+            socket_path = arg
+    with open(os.path.join("tests", inputfile), "r") as input_file:
+        raw_code = input_file.read()
+
+    try:
+        response = request_compilation(raw_code, socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(
+            f"No compile server on {socket_path}, compiling in process.",
+            file=sys.stderr,
+        )
+        response = compile_in_process(raw_code)
+    except PermissionError as e:
+        print(f"{e} Compiling in process.", file=sys.stderr)
+        response = compile_in_process(raw_code)
+    if not response["ok"]:
+        print(format_error(response["error"]))
+        sys.exit(1)
+
+    with open(os.path.join("out", outputfile), "w") as output_file:
+        output_file.write(response["assembly"])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
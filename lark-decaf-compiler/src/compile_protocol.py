@@ -0,0 +1,78 @@
+"""
+Wire format shared by the compile server and its client.
+Every message is a 4 byte big endian length followed by that many bytes of UTF-8 JSON.
+
+Request:  {"source": "<decaf code>"}
+Response: {"ok": true, "assembly": "<mips code>"}
+          {"ok": false, "error": {"type": "...", "message": "...", "line": 1, "column": 1}}
+"""
+import json
+import os
+import struct
+import tempfile
+from typing import Dict, Optional
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# The client sends its source to whoever listens on the socket and writes out the assembly it gets
+# back, so the socket lives in a directory of the user's own and must belong to the user.
+SOCKET_DIRECTORY = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+    tempfile.gettempdir(), f"decaf-compiler-{os.getuid()}"
+)
+DEFAULT_SOCKET_PATH = os.environ.get(
+    "DECAF_SERVER_SOCKET", os.path.join(SOCKET_DIRECTORY, "decaf-compiler.sock")
+)
+
+
+def belongs_to_user(path: str) -> bool:
+    return os.stat(path).st_uid == os.getuid()
+
+
+def make_socket_directory(directory: str = SOCKET_DIRECTORY):
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not belongs_to_user(directory):
+        raise RuntimeError(f"{directory} belongs to another user.")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_message(message: Dict) -> bytes:
+    payload = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_length(header: bytes) -> int:
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message of {length} bytes is too large.")
+    return length
+
+
+def decode_payload(payload: bytes) -> Dict:
+    try:
+        message = json.loads(payload.decode("utf-8"))
+    except ValueError as e:
+        raise ProtocolError(f"Malformed message: {e}")
+    if not isinstance(message, dict):
+        raise ProtocolError("Message must be a JSON object.")
+    return message
+
+
+def error_response(
+    error_type: str,
+    message: str,
+    line: Optional[int] = None,
+    column: Optional[int] = None,
+) -> Dict:
+    return {
+        "ok": False,
+        "error": {
+            "type": error_type,
+            "message": message,
+            "line": line,
+            "column": column,
+        },
+    }
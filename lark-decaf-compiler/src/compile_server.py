@@ -0,0 +1,176 @@
+"""
+Long lived compile server. Keeps the parser and the standard library declarations loaded and
+compiles sources sent over a Unix socket, so callers do not pay for interpreter start up and
+grammar loading on every compilation.
+
+Run from the lark-decaf-compiler folder:
+    python -m src.compile_server [--socket <path>] [--jobs <N>]
+"""
+import asyncio
+import getopt
+import io
+import logging
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict
+
+from lark.exceptions import UnexpectedInput, VisitError
+
+from .compile_protocol import (
+    DEFAULT_SOCKET_PATH,
+    HEADER,
+    SOCKET_DIRECTORY,
+    ProtocolError,
+    decode_length,
+    decode_payload,
+    encode_message,
+    error_response,
+    make_socket_directory,
+)
+from .main import compile_source
+
+
+def compile_request(source: str) -> Dict:
+    # Semantic errors are printed by the compiler, which then fails on whatever it stumbles over
+    # next. What it printed is the error the client needs. Compilations never run concurrently
+    # within a process, so they can take over its stdout.
+    diagnostics = io.StringIO()
+    try:
+        with redirect_stdout(diagnostics):
+            return {"ok": True, "assembly": compile_source(source)}
+    except UnexpectedInput as e:
+        return error_response(
+            type(e).__name__,
+            str(e),
+            getattr(e, "line", None),
+            getattr(e, "column", None),
+        )
+    except Exception as e:
+        # The same error is often printed more than once.
+        messages = dict.fromkeys(diagnostics.getvalue().split("\n"))
+        messages.pop("", None)
+        if messages:
+            return error_response("SemanticError", "\n".join(messages))
+        if isinstance(e, VisitError):
+            # Errors inside the transformer (i.e. code generation) are wrapped by lark.
+            return error_response(type(e.orig_exc).__name__, str(e.orig_exc) or str(e))
+        return error_response(type(e).__name__, str(e))
+
+
+class CompileServer:
+    def __init__(self, socket_path: str, executor: Executor):
+        self.socket_path = socket_path
+        self.executor = executor
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        # A client may send several requests over the same connection.
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    request = decode_payload(
+                        await reader.readexactly(decode_length(header))
+                    )
+                    source = request.get("source")
+                    if not isinstance(source, str):
+                        raise ProtocolError("Request has no 'source' string.")
+                except ProtocolError as e:
+                    writer.write(
+                        encode_message(error_response("ProtocolError", str(e)))
+                    )
+                    await writer.drain()
+                    break
+                response = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, compile_request, source
+                )
+                writer.write(encode_message(response))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.dirname(self.socket_path) == SOCKET_DIRECTORY:
+            make_socket_directory()
+        remove_stale_socket(self.socket_path)
+        # Only the user can connect to the socket.
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(
+                self.handle_client, path=self.socket_path
+            )
+        finally:
+            os.umask(umask)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+        logging.info(f"Decaf compile server listening on {self.socket_path}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path: str):
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        # Nobody is listening. Left over from a server that did not shut down cleanly.
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Another compile server is already listening on {socket_path}.")
+
+
+def print_usage():
+    print("compile_server.py [--socket <path>] [--jobs <N>]")
+
+
+def main(argv):
+    socket_path = DEFAULT_SOCKET_PATH
+    jobs = 1
+    try:
+        opts, args = getopt.getopt(argv, "hs:j:", ["socket=", "jobs="])
+    except getopt.GetoptError:
+        print_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print_usage()
+            sys.exit()
+        elif opt in ("-s", "--socket"):
+            socket_path = arg
+        elif opt in ("-j", "--jobs"):
+            if not arg.isdigit():
+                print_usage()
+                sys.exit(2)
+            jobs = int(arg) or os.cpu_count() or 1
+    # A single thread keeps the event loop free while compilations run one at a time.
+    # With more jobs, compilations of concurrent clients run in parallel worker processes.
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)
+    with executor:
+        asyncio.run(CompileServer(socket_path, executor).serve())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,355 @@
+"""
+Folds constant subexpressions and applies algebraic identities to the expressions of every function,
+after names are resolved and before code is generated. Integer arithmetic wraps around at 32 bits and
+divides the way MIPS div does, so a folded expression has the value the generated code would compute.
+"""
+import math
+from dataclasses import fields
+from typing import Optional, Union
+
+from .models.Declaration import ClassDeclaration, Declaration, FunctionDeclaration
+from .models.Expression import (
+    BinaryExpression,
+    Constant,
+    Expression,
+    Operator,
+    UnaryExpression,
+)
+from .models.Node import Node
+from .models.Statement import Statement
+from .models.Type import PrimitiveTypes, Type
+
+ConstantValue = Union[int, float, bool]
+
+INT_MIN = -(2 ** 31)
+COMPARISONS = {
+    Operator.LT: lambda a, b: a < b,
+    Operator.LTE: lambda a, b: a <= b,
+    Operator.GT: lambda a, b: a > b,
+    Operator.GTE: lambda a, b: a >= b,
+    Operator.EQUALS: lambda a, b: a == b,
+    Operator.NOT_EQUALS: lambda a, b: a != b,
+}
+# !(a < b) is a >= b and so on. Only used for ints, a comparison with NaN is false both ways.
+NEGATED_COMPARISONS = {
+    Operator.LT: Operator.GTE,
+    Operator.LTE: Operator.GT,
+    Operator.GT: Operator.LTE,
+    Operator.GTE: Operator.LT,
+    Operator.EQUALS: Operator.NOT_EQUALS,
+    Operator.NOT_EQUALS: Operator.EQUALS,
+}
+
+
+def wrap(value: int) -> int:
+    """
+    The 32 bit two's complement value of an int.
+    """
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def int_division(dividend: int, divisor: int) -> int:
+    # MIPS rounds the quotient toward zero.
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
+
+
+def int_modulo(dividend: int, divisor: int) -> int:
+    # The remainder has the sign of the dividend.
+    return dividend - int_division(dividend, divisor) * divisor
+
+
+def constant_value(expression: Expression) -> Optional[ConstantValue]:
+    """
+    Value of an int, double or bool constant. None for anything else.
+    """
+    if not isinstance(expression, Constant):
+        return None
+    value = str(expression.value)
+    if expression.constant_type == PrimitiveTypes.INT:
+        if value.lower().startswith("0x"):
+            return wrap(int(value, 16))
+        return wrap(int(value))
+    if expression.constant_type == PrimitiveTypes.DOUBLE:
+        return float(value)
+    if expression.constant_type == PrimitiveTypes.BOOL:
+        return value == "true"
+    return None
+
+
+def format_double(value: float) -> str:
+    """
+    Text of a finite double that the assembler reads back as the same value.
+    """
+    text = repr(value)
+    if "e" in text and "." not in text:
+        text = text.replace("e", ".0e")
+    return text
+
+
+def make_constant(value: ConstantValue) -> Optional[Constant]:
+    if isinstance(value, bool):
+        constant = Constant(
+            Type(PrimitiveTypes.BOOL.value), "true" if value else "false"
+        )
+    elif isinstance(value, int):
+        constant = Constant(Type(PrimitiveTypes.INT.value), str(value))
+    else:
+        if not math.isfinite(value):
+            return None
+        constant = Constant(Type(PrimitiveTypes.DOUBLE.value), format_double(value))
+    constant.expression_type = constant.constant_type
+    return constant
+
+
+def make_binary(
+    operator: Operator, left: Expression, right: Expression, expression_type: Type
+) -> BinaryExpression:
+    expression = BinaryExpression(operator, left, right)
+    expression.expression_type = expression_type
+    return expression
+
+
+def make_unary(
+    operator: Operator, operand: Expression, expression_type: Type
+) -> UnaryExpression:
+    expression = UnaryExpression(operator, operand)
+    expression.expression_type = expression_type
+    return expression
+
+
+def evaluate_binary(
+    operator: Operator, left: ConstantValue, right: ConstantValue
+) -> Optional[ConstantValue]:
+    if operator in COMPARISONS:
+        return COMPARISONS[operator](left, right)
+    if operator == Operator.AND:
+        return left and right
+    if operator == Operator.OR:
+        return left or right
+    if isinstance(left, bool):
+        return None
+    if isinstance(left, float):
+        if operator == Operator.DIVISION and right == 0:
+            return None
+        return {
+            Operator.ADDITION: lambda: left + right,
+            Operator.MINUS: lambda: left - right,
+            Operator.MULTIPLICATION: lambda: left * right,
+            Operator.DIVISION: lambda: left / right,
+        }.get(operator, lambda: None)()
+    if operator in (Operator.DIVISION, Operator.MODULO):
+        # Division by zero and the overflowing INT_MIN / -1 are left to run time.
+        if right == 0 or (left == INT_MIN and right == -1):
+            return None
+        if operator == Operator.DIVISION:
+            return int_division(left, right)
+        return int_modulo(left, right)
+    return wrap(
+        {
+            Operator.ADDITION: lambda: left + right,
+            Operator.MINUS: lambda: left - right,
+            Operator.MULTIPLICATION: lambda: left * right,
+        }[operator]()
+    )
+
+
+def constant_offset(expression: Expression) -> Optional[int]:
+    """
+    k if the expression is x + k or x - -k for an int constant k.
+    """
+    if (
+        not isinstance(expression, BinaryExpression)
+        or expression.expression_type != PrimitiveTypes.INT
+    ):
+        return None
+    value = constant_value(expression.right_expression)
+    if value is None:
+        return None
+    if expression.operator == Operator.ADDITION:
+        return value
+    if expression.operator == Operator.MINUS:
+        return wrap(-value)
+    return None
+
+
+def add_offset(expression: Expression, offset: int) -> Expression:
+    """
+    expression + offset, written as a subtraction for negative offsets.
+    """
+    if offset == 0:
+        return expression
+    if offset < 0 and offset != INT_MIN:
+        return make_binary(
+            Operator.MINUS,
+            expression,
+            make_constant(-offset),
+            expression.expression_type,
+        )
+    return make_binary(
+        Operator.ADDITION, expression, make_constant(offset), expression.expression_type
+    )
+
+
+def simplify_binary(expression: BinaryExpression) -> Expression:
+    operator = expression.operator
+    left, right = expression.left_expression, expression.right_expression
+    left_value, right_value = constant_value(left), constant_value(right)
+    if left_value is not None and right_value is not None:
+        folded = evaluate_binary(operator, left_value, right_value)
+        if folded is not None:
+            constant = make_constant(folded)
+            if constant is not None:
+                return constant
+    operand_type = left.expression_type
+    if operand_type == PrimitiveTypes.INT:
+        return simplify_int(expression, left_value, right_value)
+    if operand_type == PrimitiveTypes.BOOL:
+        return simplify_bool(expression, left_value, right_value)
+    if operand_type == PrimitiveTypes.DOUBLE:
+        # x + 0.0 is not x for x = -0.0, and x * 0.0 is not 0.0 for infinities.
+        if (
+            operator in (Operator.MULTIPLICATION, Operator.DIVISION)
+            and right_value == 1
+        ):
+            return left
+        if operator == Operator.MULTIPLICATION and left_value == 1:
+            return right
+        if operator == Operator.MINUS and right_value == 0:
+            return left
+    return expression
+
+
+def simplify_int(
+    expression: BinaryExpression, left_value: Optional[int], right_value: Optional[int]
+) -> Expression:
+    operator = expression.operator
+    left, right = expression.left_expression, expression.right_expression
+    if operator == Operator.ADDITION and left_value is not None:
+        # Constants go to the right, so chains like 1 + x + 2 fold below.
+        left, right, left_value, right_value = right, left, right_value, left_value
+        expression = make_binary(operator, left, right, expression.expression_type)
+    offset = constant_offset(expression)
+    if offset is not None:
+        inner_offset = constant_offset(left)
+        if inner_offset is not None:
+            return add_offset(left.left_expression, wrap(inner_offset + offset))
+        return add_offset(left, offset)
+    if operator == Operator.MINUS and left_value == 0:
+        return make_unary(Operator.MINUS, right, expression.expression_type)
+    if operator == Operator.MULTIPLICATION:
+        for value, other in ((right_value, left), (left_value, right)):
+            if value == 1:
+                return other
+            if value == -1:
+                return make_unary(Operator.MINUS, other, expression.expression_type)
+            if value == 0 and not other.has_side_effects():
+                return make_constant(0)
+    if operator == Operator.DIVISION:
+        if right_value == 1:
+            return left
+        if right_value == -1:
+            return make_unary(Operator.MINUS, left, expression.expression_type)
+    if (
+        operator == Operator.MODULO
+        and right_value in (1, -1)
+        and not left.has_side_effects()
+    ):
+        return make_constant(0)
+    return expression
+
+
+def simplify_bool(
+    expression: BinaryExpression,
+    left_value: Optional[bool],
+    right_value: Optional[bool],
+) -> Expression:
+    operator = expression.operator
+    left, right = expression.left_expression, expression.right_expression
+    if operator in (Operator.AND, Operator.OR):
+        # The right operand of && and || is only evaluated if the left one does not decide the value.
+        identity = operator == Operator.AND
+        if left_value is not None:
+            return right if left_value == identity else left
+        if right_value == identity:
+            return left
+        if right_value is not None and not left.has_side_effects():
+            return right
+    if operator in (Operator.EQUALS, Operator.NOT_EQUALS):
+        for value, other in ((right_value, left), (left_value, right)):
+            if value is None:
+                continue
+            if value == (operator == Operator.EQUALS):
+                return other
+            return simplify_unary(
+                make_unary(Operator.NOT, other, expression.expression_type)
+            )
+    return expression
+
+
+def simplify_unary(expression: UnaryExpression) -> Expression:
+    operand = expression.expression
+    value = constant_value(operand)
+    if value is not None:
+        if expression.operator == Operator.NOT:
+            constant = make_constant(not value)
+        elif isinstance(value, float):
+            constant = make_constant(-value)
+        else:
+            constant = make_constant(wrap(-value))
+        if constant is not None:
+            return constant
+    if isinstance(operand, UnaryExpression) and operand.operator == expression.operator:
+        # -(-x) is x, also for the wrapped around -INT_MIN.
+        return operand.expression
+    if (
+        expression.operator == Operator.NOT
+        and isinstance(operand, BinaryExpression)
+        and operand.operator in NEGATED_COMPARISONS
+        and operand.left_expression.expression_type != PrimitiveTypes.DOUBLE
+    ):
+        return make_binary(
+            NEGATED_COMPARISONS[operand.operator],
+            operand.left_expression,
+            operand.right_expression,
+            expression.expression_type,
+        )
+    return expression
+
+
+def fold_expression(expression: Expression) -> Expression:
+    fold_children(expression)
+    if isinstance(expression, BinaryExpression):
+        return simplify_binary(expression)
+    if isinstance(expression, UnaryExpression):
+        return simplify_unary(expression)
+    return expression
+
+
+def fold_children(node: Node):
+    for field in fields(node):
+        value = getattr(node, field.name)
+        if isinstance(value, list):
+            setattr(node, field.name, [fold_node(child) for child in value])
+        else:
+            setattr(node, field.name, fold_node(value))
+
+
+def fold_node(node):
+    if isinstance(node, Expression):
+        return fold_expression(node)
+    if isinstance(node, Statement):
+        fold_children(node)
+    return node
+
+
+def fold_constants(declaration: Declaration):
+    """
+    Simplifies the expressions in the bodies of a global function or of the methods of a class.
+    Expressions must already be annotated with their types.
+    """
+    if isinstance(declaration, FunctionDeclaration):
+        fold_children(declaration.body)
+    elif isinstance(declaration, ClassDeclaration):
+        for method in declaration.methods:
+            fold_children(method.body)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional, TextIO
 
 from lark import Transformer
 
@@ -11,6 +11,7 @@ from .models.Declaration import (
     VariableDeclaration,
     ClassDeclaration,
     Declaration,
+    InterfaceDeclaration,
 )
 from .models.Expression import (
     ReadInteger,
@@ -41,14 +42,34 @@ from .models.Statement import (
     OptionalExpressionStatement,
     Statement,
 )
+from .constant_folding import fold_constants
+from .emitter import Emitter, ListEmitter
+from .ir.lowering import lower_program
+from .ir.mips_backend import generate_program
+from .ir.optimizations import optimize_program
 from .models.SymbolTable import SymbolTable
 from .models.Type import Type, ArrayType, NamedType, PrimitiveTypes
 from .utils import calc_variable_size
 
 
 class DecafTransformer(Transformer):
-    def __init__(self):
+    def __init__(
+        self,
+        emitter: Optional[Emitter] = None,
+        optimization_level: int = 0,
+        ir_stream: Optional[TextIO] = None,
+    ):
+        """
+        With an emitter, generated code is written to it as it is produced and finalize returns None.
+        Otherwise finalize returns the generated lines.
+        At optimization level 0 code is generated from the AST, from level 1 on it goes through the
+        three-address IR, which from level 2 on is optimized in SSA form. With an ir_stream, the IR
+        of the program is written to it.
+        """
         super().__init__()
+        self.emitter = emitter
+        self.optimization_level = optimization_level
+        self.ir_stream = ir_stream
 
     def pass_up(self, args):
         return args
@@ -153,6 +174,7 @@ class DecafTransformer(Transformer):
         class_declaration = ClassDeclaration(
             class_identifier,
             extend_identifier,
+            implement_identifiers,
             variable_declarations,
             method_declarations,
         )
@@ -164,6 +186,39 @@ class DecafTransformer(Transformer):
         class_identifier.new = True
         return class_declaration
 
+    def new_interface(self, args):
+        interface_identifier, *prototypes = args
+        interface_declaration = InterfaceDeclaration(interface_identifier, prototypes)
+        interface_identifier.declaration = interface_declaration
+        interface_identifier.new = True
+        return interface_declaration
+
+    def new_prototype(self, args):
+        return_type, prototype_identifier, prototype_parameters = args
+        prototype = FunctionDeclaration(
+            prototype_identifier,
+            prototype_parameters,
+            return_type,
+            None,
+            is_method=True,
+        )
+        prototype_identifier.declaration = prototype
+        prototype_identifier.new = True
+        return prototype
+
+    def new_void_prototype(self, args):
+        prototype_identifier, prototype_parameters = args
+        prototype = FunctionDeclaration(
+            prototype_identifier,
+            prototype_parameters,
+            Type("void"),
+            None,
+            is_method=True,
+        )
+        prototype_identifier.declaration = prototype
+        prototype_identifier.new = True
+        return prototype
+
     def statement_block(self, args):
         variable_declarations, statements = [], []
         for arg in args:
@@ -339,13 +394,36 @@ class DecafTransformer(Transformer):
                 arg.global_offset = variable_global_offset
                 variable_type = arg.variable_type
                 variable_global_offset += calc_variable_size(variable_type)
+            elif isinstance(arg, InterfaceDeclaration):
+                for prototype in arg.prototypes:
+                    symbol_table.add_interface_method(prototype)
         # Second Pass
-        # Generate code
-        code = [".globl main", ".text"]
+        # Bind every identifier to its declaration
         for arg in args:
-            code_part = arg.generate_code(symbol_table)
-            code += code_part
-        return code
+            arg.resolve_names(symbol_table)
+        symbol_table.set_current_scope(symbol_table.get_global_scope())
+        # Third Pass
+        # Fold constant expressions
+        for arg in args:
+            fold_constants(arg)
+        # Fourth Pass
+        # Generate code
+        emitter = self.emitter if self.emitter is not None else ListEmitter()
+        emitter.emit_lines([".globl main", ".text"])
+        if self.optimization_level == 0:
+            for arg in args:
+                arg.generate_code(symbol_table, emitter)
+        if self.optimization_level > 0 or self.ir_stream is not None:
+            # At level 0 the IR is only lowered to be written out.
+            program = lower_program(args, symbol_table)
+            if self.optimization_level >= 2:
+                optimize_program(program)
+            if self.ir_stream is not None:
+                self.ir_stream.write(program.format())
+            if self.optimization_level > 0:
+                generate_program(program, symbol_table, emitter)
+        if isinstance(emitter, ListEmitter):
+            return emitter.lines
         # Write on file
         # with open("out.asm", "w") as f:
         #     print("\n".join(code), file=f)
@@ -0,0 +1,65 @@
+import re
+from typing import Iterable, List, Set, TextIO
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z_0-9]*")
+
+
+class Emitter:
+    """
+    Sink for generated assembly. Code generation writes every line here exactly once, in order,
+    instead of building and concatenating lists of lines.
+    """
+
+    def emit(self, line: str):
+        raise NotImplementedError
+
+    def emit_lines(self, lines: Iterable[str]):
+        for line in lines:
+            self.emit(line)
+
+    def flush(self):
+        """Called once code generation is done."""
+
+
+class ListEmitter(Emitter):
+    """Keeps the lines in memory."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def emit(self, line: str):
+        self.lines.append(line)
+
+    def emit_lines(self, lines: Iterable[str]):
+        self.lines.extend(lines)
+
+
+class StreamEmitter(Emitter):
+    """Writes every line straight to a (buffered) text stream, e.g. the output file."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def emit(self, line: str):
+        self.stream.write(line)
+        self.stream.write("\n")
+
+
+class ReferenceEmitter(Emitter):
+    """
+    Passes the lines on to target and records which of symbols they refer to, outside comments.
+    """
+
+    def __init__(self, target: Emitter, symbols: Set[str]):
+        self.target = target
+        self.symbols = symbols
+        self.referenced: Set[str] = set()
+
+    def emit(self, line: str):
+        self.target.emit(line)
+        for word in IDENTIFIER.findall(line.split("#", 1)[0]):
+            if word in self.symbols:
+                self.referenced.add(word)
+
+    def flush(self):
+        self.target.flush()
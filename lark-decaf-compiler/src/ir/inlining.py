@@ -0,0 +1,265 @@
+"""
+Inlining of calls to small functions and methods. Calls of methods are inlined when the method is
+known from the class of the object, so that no subclass can override it. The body of the callee is
+copied into the caller with new temporaries, its parameters become copies of the arguments, and its
+returns jump to the rest of the calling block. Calls of a function by itself right before it returns
+become jumps back to its start instead.
+"""
+import copy
+from typing import Dict, List, Optional, Set
+
+from .instructions import (
+    BasicBlock,
+    Branch,
+    Call,
+    Function,
+    IndirectCall,
+    Instruction,
+    Jump,
+    Move,
+    Program,
+    Return,
+    Temporary,
+    Value,
+)
+
+# Callees of up to this many instructions are inlined at every call. A call with its arguments and
+# its result costs about as much.
+INLINE_SIZE = 12
+# Callees called from one place only are inlined up to this size, since the copy replaces the
+# original in effect.
+SINGLE_CALL_INLINE_SIZE = 60
+# Inlining stops making a caller bigger than this.
+MAXIMUM_CALLER_SIZE = 1000
+
+
+def function_size(function: Function) -> int:
+    return sum(len(block.instructions) + 1 for block in function.blocks)
+
+
+def callee_label(instruction: Instruction) -> Optional[str]:
+    """
+    Label of the function the instruction calls, if it is known.
+    """
+    if isinstance(instruction, Call) and instruction.passes_this:
+        return instruction.function
+    if isinstance(instruction, IndirectCall):
+        return instruction.method
+    return None
+
+
+def call_graph(program: Program) -> Dict[str, List[str]]:
+    functions = {function.label for function in program.functions}
+    return {
+        function.label: [
+            label
+            for block in function.blocks
+            for instruction in block.instructions
+            for label in [callee_label(instruction)]
+            if label in functions
+        ]
+        for function in program.functions
+    }
+
+
+def recursive_functions(graph: Dict[str, List[str]]) -> Set[str]:
+    """
+    Functions that can call themselves, through other functions or not. These are the strongly
+    connected components of the call graph with a cycle, found with Tarjan's algorithm.
+    """
+    index: Dict[str, int] = dict()
+    lowest: Dict[str, int] = dict()
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    recursive: Set[str] = set()
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowest[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # Iterative depth first search. Every entry is a function and its callees not visited yet.
+        pending = [(root, iter(graph[root]))]
+        while pending:
+            label, callees = pending[-1]
+            callee = next(callees, None)
+            if callee is None:
+                pending.pop()
+                if pending:
+                    caller = pending[-1][0]
+                    lowest[caller] = min(lowest[caller], lowest[label])
+                if lowest[label] == index[label]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == label:
+                            break
+                    if len(component) > 1 or label in graph[label]:
+                        recursive.update(component)
+            elif callee not in index:
+                index[callee] = lowest[callee] = len(index)
+                stack.append(callee)
+                on_stack.add(callee)
+                pending.append((callee, iter(graph[callee])))
+            elif callee in on_stack:
+                lowest[label] = min(lowest[label], index[callee])
+    return recursive
+
+
+def callees_first(graph: Dict[str, List[str]]) -> List[str]:
+    """
+    Functions in postorder of the call graph, so a function comes after the functions it calls,
+    except along the cycles of recursive functions.
+    """
+    order = []
+    visited = set()
+    for root in graph:
+        if root in visited:
+            continue
+        visited.add(root)
+        pending = [(root, iter(graph[root]))]
+        while pending:
+            label, callees = pending[-1]
+            callee = next(callees, None)
+            if callee is None:
+                pending.pop()
+                order.append(label)
+            elif callee not in visited:
+                visited.add(callee)
+                pending.append((callee, iter(graph[callee])))
+    return order
+
+
+def inline_call(
+    caller: Function, block: BasicBlock, index: int, callee: Function
+) -> BasicBlock:
+    """
+    Replaces the call at block.instructions[index] by a copy of the body of callee. Returns the
+    block with the instructions after the call.
+    """
+    call = block.instructions[index]
+    rest = BasicBlock(
+        caller.new_label(), block.instructions[index + 1 :], block.terminator
+    )
+    temporaries: Dict[Temporary, Temporary] = dict()
+
+    def rename(value: Value) -> Value:
+        if not isinstance(value, Temporary):
+            return value
+        if value not in temporaries:
+            temporaries[value] = caller.new_temporary(value.type, value.name)
+        return temporaries[value]
+
+    incoming = []
+    if callee.this is not None:
+        incoming.append(Move(rename(callee.this), call.this))
+    for parameter, argument in zip(callee.parameters, call.arguments):
+        incoming.append(Move(rename(parameter), argument))
+    copies = {original: BasicBlock(caller.new_label()) for original in callee.blocks}
+    for original, block_copy in copies.items():
+        for instruction in original.instructions:
+            instruction = copy.copy(instruction)
+            instruction.replace_operands(rename)
+            if instruction.definition() is not None:
+                instruction.destination = rename(instruction.destination)
+            block_copy.instructions.append(instruction)
+        terminator = original.terminator
+        if isinstance(terminator, Return):
+            if call.destination is not None and terminator.value is not None:
+                block_copy.instructions.append(
+                    Move(call.destination, rename(terminator.value))
+                )
+            block_copy.terminator = Jump(rest)
+        elif isinstance(terminator, Jump):
+            block_copy.terminator = Jump(copies[terminator.target])
+        else:
+            assert isinstance(terminator, Branch)
+            block_copy.terminator = Branch(
+                terminator.operator,
+                rename(terminator.left),
+                rename(terminator.right),
+                copies[terminator.true_target],
+                copies[terminator.false_target],
+            )
+    block.instructions = block.instructions[:index] + incoming
+    block.terminator = Jump(copies[callee.entry])
+    position = caller.blocks.index(block) + 1
+    caller.blocks[position:position] = list(copies.values()) + [rest]
+    return rest
+
+
+def eliminate_tail_recursion(function: Function):
+    """
+    A block that calls the function itself and returns what the call returns copies the arguments
+    to the parameters and jumps to the entry instead, so the recursion becomes a loop. Variables
+    read before they are assigned are set to zero at the entry, like in a new call.
+    """
+    for block in function.blocks:
+        if not block.instructions or not isinstance(block.terminator, Return):
+            continue
+        call = block.instructions[-1]
+        returned = block.terminator.value
+        if callee_label(call) != function.label or (
+            returned is not None and returned != call.destination
+        ):
+            continue
+        incoming = list(function.parameters)
+        arguments = list(call.arguments)
+        if function.this is not None:
+            incoming.append(function.this)
+            arguments.append(call.this)
+        # Arguments can read the parameters they replace.
+        values = [function.new_temporary(argument.type) for argument in arguments]
+        block.instructions = (
+            block.instructions[:-1]
+            + [Move(value, argument) for value, argument in zip(values, arguments)]
+            + [Move(temporary, value) for temporary, value in zip(incoming, values)]
+        )
+        block.terminator = Jump(function.entry)
+
+
+def inline_calls(program: Program):
+    """
+    Inlines the calls whose callee is small enough and not recursive. Callees are inlined into
+    before their callers, so what is copied is already inlined itself. Functions that are no longer
+    called are removed, methods are kept for their vtables.
+    """
+    functions = {function.label: function for function in program.functions}
+    graph = call_graph(program)
+    recursive = recursive_functions(graph)
+    call_counts: Dict[str, int] = dict()
+    for callees in graph.values():
+        for label in callees:
+            call_counts[label] = call_counts.get(label, 0) + 1
+
+    def should_inline(callee: Function, caller: Function) -> bool:
+        if callee.label in recursive:
+            return False
+        size = function_size(callee)
+        limit = INLINE_SIZE
+        if call_counts[callee.label] == 1 and callee.name != "main":
+            limit = SINGLE_CALL_INLINE_SIZE
+        return size <= limit and function_size(caller) + size <= MAXIMUM_CALLER_SIZE
+
+    for label in callees_first(graph):
+        caller = functions[label]
+        pending = list(caller.blocks)
+        while pending:
+            block = pending.pop()
+            for index, instruction in enumerate(block.instructions):
+                callee = functions.get(callee_label(instruction))
+                if callee is not None and should_inline(callee, caller):
+                    pending.append(inline_call(caller, block, index, callee))
+                    break
+        caller.thread_jumps()
+
+    called = {label for callees in call_graph(program).values() for label in callees}
+    program.functions = [
+        function
+        for function in program.functions
+        if function.this is not None
+        or function.name == "main"
+        or function.label in called
+    ]
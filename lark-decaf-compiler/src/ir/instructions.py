@@ -0,0 +1,514 @@
+"""
+Typed three-address intermediate representation. A function is a control flow graph of basic blocks.
+Every instruction names its operands explicitly, as temporaries or immediates, and every block ends
+with exactly one terminator: a jump, a conditional branch or a return.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from ..models.Declaration import ClassDeclaration
+
+
+class IRType(Enum):
+    # Ints, bools, strings, arrays and objects. Everything that fits in 4 bytes.
+    WORD = "word"
+    DOUBLE = "double"
+
+
+@dataclass(frozen=True)
+class Temporary:
+    number: int
+    type: IRType
+    # Variable the temporary holds, if any. Only used when printing the IR.
+    name: str = field(default="", compare=False)
+
+    def __str__(self):
+        text = f"%{self.name}.{self.number}" if self.name else f"%{self.number}"
+        if self.type == IRType.DOUBLE:
+            return text + ":d"
+        return text
+
+
+@dataclass(frozen=True)
+class Immediate:
+    value: Union[int, float]
+    type: IRType = IRType.WORD
+
+    def __str__(self):
+        return str(self.value)
+
+
+class MemoryRegion(Enum):
+    """
+    What a load or store accesses. Accesses of different regions never overlap.
+    """
+
+    GLOBAL = "global"
+    FIELD = "field"
+    ELEMENT = "element"
+    # The length of an array and the vtable of an object are only stored when they are created.
+    LENGTH = "length"
+    VTABLE = "vtable"
+    # Entries of vtables are never stored.
+    METHOD = "method"
+
+
+IMMUTABLE_REGIONS = {MemoryRegion.LENGTH, MemoryRegion.VTABLE, MemoryRegion.METHOD}
+
+Value = Union[Temporary, Immediate]
+# Operators of BinaryOperation and Branch. Comparisons produce a word, 1 or 0.
+ARITHMETIC_OPERATORS = {"add", "sub", "mul", "div", "rem", "shl"}
+COMPARISON_OPERATORS = {"lt", "le", "gt", "ge", "eq", "ne"}
+
+
+class Instruction:
+    # Fields that hold the values the instruction reads. A field can also hold a list of values.
+    operand_fields: ClassVar[Tuple[str, ...]] = ()
+
+    def definition(self) -> Optional[Temporary]:
+        """
+        Temporary the instruction writes, if any.
+        """
+        return getattr(self, "destination", None)
+
+    def operands(self) -> List[Value]:
+        values = []
+        for name in self.operand_fields:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                values += value
+            elif value is not None:
+                values.append(value)
+        return values
+
+    def uses(self) -> List[Temporary]:
+        return [value for value in self.operands() if isinstance(value, Temporary)]
+
+    def may_trap(self) -> bool:
+        """
+        Whether the instruction can stop the program with an error.
+        """
+        return False
+
+    def replace_operands(self, replace: Callable[[Value], Value]):
+        """
+        Replaces every value the instruction reads by replace(value).
+        """
+        for name in self.operand_fields:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                setattr(self, name, [replace(v) for v in value])
+            elif value is not None:
+                setattr(self, name, replace(value))
+
+
+@dataclass(frozen=True)
+class Address:
+    """
+    Memory a load or store accesses.
+    """
+
+    region: MemoryRegion
+    base: Optional[Value]
+    offset: int
+    type: IRType
+
+    def size(self) -> int:
+        return 8 if self.type == IRType.DOUBLE else 4
+
+    def may_overlap(self, other: Address) -> bool:
+        if self.region != other.region:
+            return False
+        if self.region in (MemoryRegion.GLOBAL, MemoryRegion.FIELD):
+            # Fields are at the same offsets in every object, so only fields at overlapping
+            # offsets can be the same memory.
+            return (
+                self.offset < other.offset + other.size()
+                and other.offset < self.offset + self.size()
+            )
+        return True
+
+
+def format_address(region: MemoryRegion, base: Optional[Value], offset: int) -> str:
+    if base is None:
+        return f"{region.value} [{offset}]"
+    return f"{region.value} [{base} + {offset}]"
+
+
+def format_definition(destination: Optional[Temporary]) -> str:
+    return "" if destination is None else f"{destination} = "
+
+
+@dataclass(eq=False)
+class Move(Instruction):
+    destination: Temporary
+    source: Value
+    operand_fields = ("source",)
+
+    def __str__(self):
+        return f"{self.destination} = {self.source}"
+
+
+@dataclass(eq=False)
+class BinaryOperation(Instruction):
+    operator: str
+    destination: Temporary
+    left: Value
+    right: Value
+    operand_fields = ("left", "right")
+
+    def may_trap(self) -> bool:
+        # Integer division by zero.
+        return (
+            self.operator in ("div", "rem")
+            and self.left.type == IRType.WORD
+            and not (isinstance(self.right, Immediate) and self.right.value != 0)
+        )
+
+    def __str__(self):
+        return f"{self.destination} = {self.operator} {self.left}, {self.right}"
+
+
+@dataclass(eq=False)
+class UnaryOperation(Instruction):
+    # neg, not, or one of the conversions of the standard library: itod, dtoi and itob.
+    operator: str
+    destination: Temporary
+    operand: Value
+    operand_fields = ("operand",)
+
+    def __str__(self):
+        return f"{self.destination} = {self.operator} {self.operand}"
+
+
+@dataclass(eq=False)
+class Load(Instruction):
+    """
+    Reads the word or double at base + offset. Without a base, the offset is relative to the globals.
+    """
+
+    destination: Temporary
+    base: Optional[Value]
+    offset: int
+    region: MemoryRegion
+    operand_fields = ("base",)
+
+    def address(self) -> Address:
+        return Address(self.region, self.base, self.offset, self.destination.type)
+
+    def __str__(self):
+        address = format_address(self.region, self.base, self.offset)
+        return f"{self.destination} = load {address}"
+
+
+@dataclass(eq=False)
+class Store(Instruction):
+    source: Value
+    base: Optional[Value]
+    offset: int
+    region: MemoryRegion
+    operand_fields = ("source", "base")
+
+    def address(self) -> Address:
+        return Address(self.region, self.base, self.offset, self.source.type)
+
+    def __str__(self):
+        address = format_address(self.region, self.base, self.offset)
+        return f"store {address}, {self.source}"
+
+
+@dataclass(eq=False)
+class LoadAddress(Instruction):
+    """
+    Address of a label: a string literal or a vtable.
+    """
+
+    destination: Temporary
+    label: str
+
+    def __str__(self):
+        return f"{self.destination} = address {self.label}"
+
+
+@dataclass(eq=False)
+class Allocate(Instruction):
+    """
+    Allocates size bytes on the heap.
+    """
+
+    destination: Temporary
+    size: Value
+    operand_fields = ("size",)
+
+    def __str__(self):
+        return f"{self.destination} = allocate {self.size}"
+
+
+@dataclass(eq=False)
+class Call(Instruction):
+    """
+    Calls a function by its label. Decaf functions get a slot for 'this' that they do not use,
+    the routines of the standard library do not.
+    """
+
+    destination: Optional[Temporary]
+    function: str
+    arguments: List[Value]
+    passes_this: bool = True
+    operand_fields = ("arguments",)
+
+    def __str__(self):
+        arguments = ", ".join(str(argument) for argument in self.arguments)
+        return f"{format_definition(self.destination)}call {self.function}({arguments})"
+
+
+@dataclass(eq=False)
+class IndirectCall(Instruction):
+    """
+    Calls the method whose address is in target, with this as the object.
+    """
+
+    destination: Optional[Temporary]
+    target: Value
+    this: Value
+    arguments: List[Value]
+    # Label of the method when no class the object can have overrides it, None otherwise.
+    method: Optional[str] = None
+    operand_fields = ("target", "this", "arguments")
+
+    def __str__(self):
+        arguments = ", ".join(
+            str(argument) for argument in [self.this] + self.arguments
+        )
+        return f"{format_definition(self.destination)}call [{self.target}]({arguments})"
+
+
+CALLS = (Call, IndirectCall)
+# Routines of the standard library the backend expands to their syscall instead of calling them.
+# They keep every register but $v0, $a0 and $f12, and do not touch the memory of the program.
+INLINE_ROUTINES = {
+    "_PrintInt",
+    "_PrintString",
+    "_PrintBool",
+    "_SimplePrintDouble",
+    "_PrintNewLine",
+}
+
+
+def is_call(instruction: Instruction) -> bool:
+    """
+    Whether the instruction calls a function, other than the routines expanded inline.
+    """
+    if isinstance(instruction, Call):
+        return instruction.function not in INLINE_ROUTINES
+    return isinstance(instruction, IndirectCall)
+
+
+@dataclass(eq=False)
+class Phi(Instruction):
+    """
+    Only exists in SSA form, at the start of a block. Takes the value of arguments[predecessor]
+    for the predecessor control came from.
+    """
+
+    destination: Temporary
+    arguments: Dict[BasicBlock, Value]
+
+    def operands(self) -> List[Value]:
+        return list(self.arguments.values())
+
+    def replace_operands(self, replace: Callable[[Value], Value]):
+        self.arguments = {
+            block: replace(value) for block, value in self.arguments.items()
+        }
+
+    def __str__(self):
+        arguments = ", ".join(
+            f"{block.label}: {value}" for block, value in self.arguments.items()
+        )
+        return f"{self.destination} = phi [{arguments}]"
+
+
+class Terminator(Instruction):
+    def successors(self) -> List[BasicBlock]:
+        return []
+
+
+@dataclass(eq=False)
+class Jump(Terminator):
+    target: BasicBlock
+
+    def successors(self) -> List[BasicBlock]:
+        return [self.target]
+
+    def __str__(self):
+        return f"jump {self.target.label}"
+
+
+@dataclass(eq=False)
+class Branch(Terminator):
+    """
+    Goes to true_target if left operator right holds, to false_target otherwise.
+    """
+
+    operator: str
+    left: Value
+    right: Value
+    true_target: BasicBlock
+    false_target: BasicBlock
+    operand_fields = ("left", "right")
+
+    def successors(self) -> List[BasicBlock]:
+        return [self.true_target, self.false_target]
+
+    def __str__(self):
+        return f"branch {self.operator} {self.left}, {self.right}, {self.true_target.label}, {self.false_target.label}"
+
+
+@dataclass(eq=False)
+class Return(Terminator):
+    value: Optional[Value] = None
+    operand_fields = ("value",)
+
+    def __str__(self):
+        return "return" if self.value is None else f"return {self.value}"
+
+
+@dataclass(eq=False)
+class BasicBlock:
+    label: str
+    instructions: List[Instruction] = field(default_factory=list)
+    terminator: Optional[Terminator] = None
+
+    def successors(self) -> List[BasicBlock]:
+        if self.terminator is None:
+            return []
+        return self.terminator.successors()
+
+    def all_instructions(self) -> List[Instruction]:
+        if self.terminator is None:
+            return list(self.instructions)
+        return self.instructions + [self.terminator]
+
+    def format(self) -> List[str]:
+        return [f"{self.label}:"] + [
+            f"\t{instruction}" for instruction in self.all_instructions()
+        ]
+
+
+@dataclass(eq=False)
+class Function:
+    # Name in the source, like Class.method.
+    name: str
+    label: str
+    parameters: List[Temporary]
+    # The object of a method, None for global functions.
+    this: Optional[Temporary]
+    # None for void functions.
+    return_type: Optional[IRType]
+    # In layout order. The first block is the entry.
+    blocks: List[BasicBlock] = field(default_factory=list)
+    temporary_count: int = 0
+    label_count: int = 0
+
+    @property
+    def entry(self) -> BasicBlock:
+        return self.blocks[0]
+
+    def new_temporary(self, temporary_type: IRType, name: str = "") -> Temporary:
+        self.temporary_count += 1
+        return Temporary(self.temporary_count, temporary_type, name)
+
+    def new_label(self) -> str:
+        # Decaf identifiers start with a letter, so these never clash with the label of a function.
+        self.label_count += 1
+        return f"__{self.label}_{self.label_count}"
+
+    def predecessors(self) -> Dict[BasicBlock, List[BasicBlock]]:
+        predecessors = {block: [] for block in self.blocks}
+        for block in self.blocks:
+            for successor in block.successors():
+                predecessors[successor].append(block)
+        return predecessors
+
+    def reachable_blocks(self) -> Set[BasicBlock]:
+        reached = {self.entry}
+        pending = [self.entry]
+        while pending:
+            for successor in pending.pop().successors():
+                if successor not in reached:
+                    reached.add(successor)
+                    pending.append(successor)
+        return reached
+
+    def remove_unreachable_blocks(self):
+        reachable = self.reachable_blocks()
+        self.blocks = [block for block in self.blocks if block in reachable]
+
+    def thread_jumps(self):
+        """
+        Jumps and branches to a block that does nothing but jump go to the target of that jump
+        instead. Blocks no longer reached are removed.
+        """
+
+        def final_target(block: BasicBlock) -> BasicBlock:
+            visited = set()
+            while (
+                not block.instructions
+                and isinstance(block.terminator, Jump)
+                and block not in visited
+            ):
+                visited.add(block)
+                block = block.terminator.target
+            return block
+
+        for block in self.blocks:
+            terminator = block.terminator
+            if isinstance(terminator, Jump):
+                terminator.target = final_target(terminator.target)
+            elif isinstance(terminator, Branch):
+                terminator.true_target = final_target(terminator.true_target)
+                terminator.false_target = final_target(terminator.false_target)
+        self.remove_unreachable_blocks()
+
+    def format(self) -> str:
+        parameters = ([self.this] if self.this is not None else []) + self.parameters
+        return_type = "void" if self.return_type is None else self.return_type.value
+        lines = [
+            f"function {self.name}({', '.join(str(p) for p in parameters)}) -> {return_type}"
+        ]
+        for block in self.blocks:
+            lines += block.format()
+        return "\n".join(lines)
+
+
+@dataclass
+class Program:
+    functions: List[Function] = field(default_factory=list)
+    # Classes, for their vtables.
+    classes: List[ClassDeclaration] = field(default_factory=list)
+    # String literals by label.
+    strings: Dict[str, str] = field(default_factory=dict)
+
+    def format(self) -> str:
+        sections = [function.format() for function in self.functions]
+        if self.strings:
+            strings = [
+                f"{label} = {literal}" for label, literal in self.strings.items()
+            ]
+            sections.insert(0, "\n".join(strings))
+        return "\n\n".join(sections) + "\n"
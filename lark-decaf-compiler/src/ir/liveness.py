@@ -0,0 +1,46 @@
+"""
+Live temporaries at the boundaries of basic blocks, by backward data flow analysis.
+"""
+from typing import Dict, Set, Tuple
+
+from .instructions import BasicBlock, Function, Temporary
+
+LiveSets = Dict[BasicBlock, Set[Temporary]]
+
+
+def block_uses_and_definitions(
+    block: BasicBlock,
+) -> Tuple[Set[Temporary], Set[Temporary]]:
+    """
+    Temporaries the block reads before writing them, and temporaries it writes.
+    """
+    uses, definitions = set(), set()
+    for instruction in block.all_instructions():
+        uses.update(t for t in instruction.uses() if t not in definitions)
+        definition = instruction.definition()
+        if definition is not None:
+            definitions.add(definition)
+    return uses, definitions
+
+
+def live_temporaries(function: Function) -> Tuple[LiveSets, LiveSets]:
+    """
+    Temporaries live at the start and at the end of every block of the function.
+    """
+    summaries = {block: block_uses_and_definitions(block) for block in function.blocks}
+    live_in: LiveSets = {block: set() for block in function.blocks}
+    live_out: LiveSets = {block: set() for block in function.blocks}
+    changed = True
+    while changed:
+        changed = False
+        # Blocks are mostly laid out in execution order, so going backwards converges quickly.
+        for block in reversed(function.blocks):
+            out = set()
+            for successor in block.successors():
+                out |= live_in[successor]
+            uses, definitions = summaries[block]
+            new_in = uses | (out - definitions)
+            if out != live_out[block] or new_in != live_in[block]:
+                live_out[block], live_in[block] = out, new_in
+                changed = True
+    return live_in, live_out
@@ -0,0 +1,201 @@
+"""
+Loops of the control flow graph and loop invariant code motion. Loops are found as natural loops:
+a back edge goes to a block that dominates its source, and the loop is that block with every block
+that reaches the source without passing through it. While and for statements lower to such loops.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from .instructions import (
+    IMMUTABLE_REGIONS,
+    Allocate,
+    BasicBlock,
+    BinaryOperation,
+    Branch,
+    Function,
+    Instruction,
+    Jump,
+    Load,
+    LoadAddress,
+    MemoryRegion,
+    Move,
+    Phi,
+    Store,
+    Temporary,
+    UnaryOperation,
+    is_call,
+)
+from .ssa import immediate_dominators, phis
+
+Dominators = Dict[BasicBlock, Optional[BasicBlock]]
+
+
+@dataclass(eq=False)
+class Loop:
+    header: BasicBlock
+    # Including the header and the blocks of inner loops.
+    blocks: Set[BasicBlock]
+
+
+def dominates(dominators: Dominators, first: BasicBlock, second: BasicBlock) -> bool:
+    while second is not None:
+        if second is first:
+            return True
+        second = dominators[second]
+    return False
+
+
+def natural_loops(function: Function, dominators: Dominators) -> List[Loop]:
+    """
+    Loops with the same header are merged. Inner loops come before the loops containing them.
+    """
+    predecessors = function.predecessors()
+    loops: Dict[BasicBlock, Loop] = dict()
+    for block in function.blocks:
+        for successor in block.successors():
+            if not dominates(dominators, successor, block):
+                continue
+            loop = loops.setdefault(successor, Loop(successor, {successor}))
+            pending = [block]
+            while pending:
+                member = pending.pop()
+                if member not in loop.blocks:
+                    loop.blocks.add(member)
+                    pending += predecessors[member]
+    return sorted(loops.values(), key=lambda loop: len(loop.blocks))
+
+
+def insert_preheader(
+    function: Function, loop: Loop, dominators: Dominators
+) -> BasicBlock:
+    """
+    Returns a block that only jumps to the header and that every entry to the loop passes through,
+    and creates one if there is none. Works on SSA form and keeps dominators up to date.
+    """
+    header = loop.header
+    outside = [
+        predecessor
+        for predecessor in function.predecessors()[header]
+        if predecessor not in loop.blocks
+    ]
+    if len(outside) == 1 and isinstance(outside[0].terminator, Jump):
+        return outside[0]
+    preheader = BasicBlock(function.new_label(), [], Jump(header))
+    for predecessor in outside:
+        terminator = predecessor.terminator
+        if isinstance(terminator, Jump):
+            terminator.target = preheader
+        elif isinstance(terminator, Branch):
+            if terminator.true_target is header:
+                terminator.true_target = preheader
+            if terminator.false_target is header:
+                terminator.false_target = preheader
+    for phi in phis(header):
+        arguments = {
+            predecessor: phi.arguments.pop(predecessor) for predecessor in outside
+        }
+        if len(outside) == 1:
+            phi.arguments[preheader] = arguments[outside[0]]
+        else:
+            destination = function.new_temporary(
+                phi.destination.type, phi.destination.name
+            )
+            preheader.instructions.append(Phi(destination, arguments))
+            phi.arguments[preheader] = destination
+    function.blocks.insert(function.blocks.index(header), preheader)
+    dominators[preheader] = dominators[header]
+    dominators[header] = preheader
+    return preheader
+
+
+def accessed_addresses(block: BasicBlock, dominators: Dominators) -> Set[Tuple]:
+    """
+    Bases and offsets of the loads and stores in the block and the blocks dominating it. These were
+    accessed without an error on every path to the end of the block.
+    """
+    addresses = set()
+    while block is not None:
+        for instruction in block.instructions:
+            if isinstance(instruction, (Load, Store)):
+                addresses.add((instruction.base, instruction.offset))
+        block = dominators[block]
+    return addresses
+
+
+def hoist_loop_invariants(function: Function):
+    """
+    Moves the instructions whose result is the same in every iteration of a loop to its preheader,
+    innermost loops first, so they can leave the loops around them too. Only instructions without
+    side effects that cannot stop the program are moved, since the loop may run no iteration at all.
+    A load is moved only if nothing in the loop may store to its address, and its base is known to
+    be a valid object. An array element is only known to be in bounds if the same element was
+    accessed before the loop.
+    """
+    dominators = immediate_dominators(function)
+    loops = natural_loops(function, dominators)
+    for index, loop in enumerate(loops):
+        preheader = insert_preheader(function, loop, dominators)
+        for outer in loops[index + 1 :]:
+            if loop.header in outer.blocks:
+                outer.blocks.add(preheader)
+        blocks = [block for block in function.blocks if block in loop.blocks]
+        instructions = [
+            instruction for block in blocks for instruction in block.instructions
+        ]
+        defined: Set[Temporary] = {
+            instruction.definition()
+            for instruction in instructions
+            if instruction.definition() is not None
+        }
+        stores = [
+            instruction.address()
+            for instruction in instructions
+            if isinstance(instruction, Store)
+        ]
+        has_calls = any(is_call(instruction) for instruction in instructions)
+        allocated = {
+            instruction.destination
+            for block in function.blocks
+            for instruction in block.instructions
+            if isinstance(instruction, Allocate)
+        }
+        accessed = accessed_addresses(preheader, dominators)
+        bases = {base for base, _ in accessed} | allocated
+        if function.this is not None:
+            bases.add(function.this)
+
+        def can_hoist(instruction: Instruction) -> bool:
+            if any(operand in defined for operand in instruction.uses()):
+                return False
+            if isinstance(instruction, (Move, UnaryOperation, LoadAddress)):
+                return True
+            if isinstance(instruction, BinaryOperation):
+                return not instruction.may_trap()
+            if not isinstance(instruction, Load):
+                return False
+            address = instruction.address()
+            if address.region not in IMMUTABLE_REGIONS and (
+                has_calls or any(store.may_overlap(address) for store in stores)
+            ):
+                return False
+            if address.region == MemoryRegion.ELEMENT:
+                return (address.base, address.offset) in accessed
+            return (
+                address.base is None
+                or address.base in bases
+                or address.region == MemoryRegion.METHOD
+            )
+
+        hoisted = True
+        while hoisted:
+            hoisted = False
+            for block in blocks:
+                kept = []
+                for instruction in block.instructions:
+                    if not isinstance(instruction, Phi) and can_hoist(instruction):
+                        preheader.instructions.append(instruction)
+                        defined.discard(instruction.definition())
+                        hoisted = True
+                    else:
+                        kept.append(instruction)
+                block.instructions = kept
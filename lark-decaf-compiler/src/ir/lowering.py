@@ -0,0 +1,656 @@
+"""
+Lowers the bodies of functions and methods to the three-address IR. Local variables and parameters
+become temporaries, globals, class members and array elements are loaded and stored. Expressions are
+evaluated in the same order as by the code generated from the AST.
+"""
+import math
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ..constant_folding import constant_value
+from ..models.Declaration import (
+    ClassDeclaration,
+    Declaration,
+    FunctionDeclaration,
+    VariableDeclaration,
+)
+from ..models.Expression import (
+    ArrayAccessLValue,
+    Assignment,
+    BinaryExpression,
+    Constant,
+    Expression,
+    FunctionCall,
+    IdentifierLValue,
+    InitiateArray,
+    InitiateClass,
+    LValue,
+    MethodCall,
+    OFFSET_TO_FIRST_GLOBAL,
+    Operator,
+    ReadInteger,
+    ReadLine,
+    ThisExpression,
+    UnaryExpression,
+)
+from ..models.Statement import (
+    BreakStatement,
+    ForStatement,
+    IfStatement,
+    OptionalExpressionStatement,
+    PrintStatement,
+    ReturnStatement,
+    Statement,
+    StatementBlock,
+    WhileStatement,
+)
+from ..models.SymbolTable import SymbolTable
+from ..models.Type import PrimitiveTypes, Type
+from ..standard_library_functions import STANDARD_LIBRARY_FUNCTIONS
+from ..utils import ARRAY_LENGTH_SIZE, calc_variable_size
+from .instructions import (
+    Allocate,
+    BasicBlock,
+    BinaryOperation,
+    Branch,
+    Call,
+    Function,
+    Immediate,
+    IndirectCall,
+    Instruction,
+    IRType,
+    Jump,
+    Load,
+    LoadAddress,
+    MemoryRegion,
+    Move,
+    Program,
+    Return,
+    Store,
+    Temporary,
+    Terminator,
+    UnaryOperation,
+    Value,
+)
+from .liveness import live_temporaries
+
+OPERATORS = {
+    Operator.ADDITION: "add",
+    Operator.MINUS: "sub",
+    Operator.MULTIPLICATION: "mul",
+    Operator.DIVISION: "div",
+    Operator.MODULO: "rem",
+    Operator.LT: "lt",
+    Operator.LTE: "le",
+    Operator.GT: "gt",
+    Operator.GTE: "ge",
+    Operator.EQUALS: "eq",
+    Operator.NOT_EQUALS: "ne",
+}
+COMPARISONS = {
+    Operator.LT,
+    Operator.LTE,
+    Operator.GT,
+    Operator.GTE,
+    Operator.EQUALS,
+    Operator.NOT_EQUALS,
+}
+# Conversions of the standard library, by label, as unary operators. btoi is a copy.
+CONVERSIONS = {"_ITOD": "itod", "_DTOI": "dtoi", "_ITOB": "itob"}
+PRINT_ROUTINES = {
+    PrimitiveTypes.INT.value: "_PrintInt",
+    PrimitiveTypes.STRING.value: "_PrintString",
+    PrimitiveTypes.BOOL.value: "_PrintBool",
+    PrimitiveTypes.DOUBLE.value: "_SimplePrintDouble",
+}
+
+
+def ir_type(variable_type: Type) -> IRType:
+    if variable_type == PrimitiveTypes.DOUBLE:
+        return IRType.DOUBLE
+    return IRType.WORD
+
+
+def zero(value_type: IRType) -> Immediate:
+    return Immediate(0.0 if value_type == IRType.DOUBLE else 0, value_type)
+
+
+class FunctionLowering:
+    def __init__(
+        self,
+        program: Program,
+        function_decl: FunctionDeclaration,
+        symbol_table: SymbolTable,
+        overridden_methods: Set[str] = frozenset(),
+    ):
+        self.program = program
+        self.overridden_methods = overridden_methods
+        self.symbol_table = symbol_table
+        self.function_decl = function_decl
+        name = function_decl.identifier.name
+        if function_decl.owner_class is not None:
+            name = f"{function_decl.owner_class.identifier.name}.{name}"
+        self.function = Function(
+            name, function_decl.label, [], None, self.return_type(function_decl)
+        )
+        if function_decl.is_method:
+            self.function.this = self.function.new_temporary(IRType.WORD, "this")
+        # Temporaries of local variables and parameters, by id of their declaration.
+        self.variables: Dict[int, Temporary] = dict()
+        for param in function_decl.formal_parameters:
+            self.function.parameters.append(self.declare(param))
+        self.loop_exits: List[BasicBlock] = []
+        self.block: Optional[BasicBlock] = None
+        self.start_block(self.new_block())
+
+    def lower(self) -> Function:
+        self.lower_statement(self.function_decl.body)
+        # Falling off the end of the function.
+        self.terminate(Return())
+        self.function.thread_jumps()
+        self.initialize_variables()
+        return self.function
+
+    def initialize_variables(self):
+        """
+        Variables that may be read before they are assigned start as zero.
+        """
+        live_in, _ = live_temporaries(self.function)
+        defined_at_entry = set(self.function.parameters)
+        initializations = [
+            Move(temporary, zero(temporary.type))
+            for temporary in sorted(
+                live_in[self.function.entry], key=lambda t: t.number
+            )
+            if temporary not in defined_at_entry and temporary != self.function.this
+        ]
+        self.function.entry.instructions[:0] = initializations
+
+    def declare(self, var_decl: VariableDeclaration) -> Temporary:
+        temporary = self.function.new_temporary(
+            ir_type(var_decl.variable_type), var_decl.identifier.name
+        )
+        self.variables[id(var_decl)] = temporary
+        return temporary
+
+    def new_temporary(self, value_type: IRType) -> Temporary:
+        return self.function.new_temporary(value_type)
+
+    def new_block(self) -> BasicBlock:
+        return BasicBlock(self.function.new_label())
+
+    def start_block(self, block: BasicBlock):
+        """
+        Continues in block. Blocks are laid out in the order they are started.
+        """
+        if self.block is not None:
+            # Fall through from the previous block.
+            self.terminate(Jump(block))
+        self.function.blocks.append(block)
+        self.block = block
+
+    def emit(self, instruction: Instruction):
+        if self.block is None:
+            # Code after a return or break is unreachable. It still gets a block, removed later.
+            self.start_block(self.new_block())
+        self.block.instructions.append(instruction)
+
+    def terminate(self, terminator: Terminator):
+        if self.block is None:
+            self.start_block(self.new_block())
+        self.block.terminator = terminator
+        self.block = None
+
+    def lower_statement(self, statement: Statement):
+        if isinstance(statement, StatementBlock):
+            # The parser puts the statements of a block after its variable declarations in
+            # variable_declarations too.
+            for node in statement.variable_declarations + statement.statements:
+                if isinstance(node, VariableDeclaration):
+                    self.declare(node)
+                else:
+                    self.lower_statement(node)
+        elif isinstance(statement, OptionalExpressionStatement):
+            if statement.expression is not None:
+                self.lower_value(statement.expression)
+        elif isinstance(statement, IfStatement):
+            self.lower_if(statement)
+        elif isinstance(statement, WhileStatement):
+            self.lower_loop(
+                statement.condition_expression,
+                lambda: self.lower_statement(statement.body_statement),
+            )
+        elif isinstance(statement, ForStatement):
+            if statement.initialization_expression is not None:
+                self.lower_value(statement.initialization_expression)
+            self.lower_loop(
+                statement.condition_expression, lambda: self.lower_for_body(statement)
+            )
+        elif isinstance(statement, ReturnStatement):
+            value = None
+            if statement.return_expression is not None:
+                value = self.lower_value(statement.return_expression)
+            self.terminate(Return(value))
+        elif isinstance(statement, PrintStatement):
+            for argument in statement.args:
+                value = self.lower_value(argument)
+                routine = PRINT_ROUTINES[argument.expression_type.name]
+                self.emit(Call(None, routine, [value], passes_this=False))
+            self.emit(Call(None, "_PrintNewLine", [], passes_this=False))
+        elif isinstance(statement, BreakStatement):
+            self.terminate(Jump(self.loop_exits[-1]))
+
+    def lower_if(self, statement: IfStatement):
+        body = self.new_block()
+        end = self.new_block()
+        else_body = end if statement.else_body_statement is None else self.new_block()
+        self.lower_branch(statement.condition_expression, body, else_body)
+        self.start_block(body)
+        self.lower_statement(statement.body_statement)
+        if statement.else_body_statement is not None:
+            self.terminate(Jump(end))
+            self.start_block(else_body)
+            self.lower_statement(statement.else_body_statement)
+        self.start_block(end)
+
+    def lower_loop(self, condition: Expression, lower_body: Callable[[], None]):
+        """
+        Loops are rotated like in the code generated from the AST: the condition is tested before
+        the loop and again at the end of every iteration.
+        """
+        body = self.new_block()
+        end = self.new_block()
+        self.lower_branch(condition, body, end)
+        self.start_block(body)
+        self.loop_exits.append(end)
+        lower_body()
+        self.loop_exits.pop()
+        self.lower_branch(condition, body, end)
+        self.start_block(end)
+
+    def lower_for_body(self, statement: ForStatement):
+        self.lower_statement(statement.body_statement)
+        if statement.update_expression is not None:
+            self.lower_value(statement.update_expression)
+
+    def lower_branch(
+        self, expression: Expression, true_target: BasicBlock, false_target: BasicBlock
+    ):
+        """
+        Ends the current block with a branch to true_target if the condition holds and to
+        false_target otherwise. && and || only evaluate their right operand when needed.
+        """
+        if isinstance(expression, BinaryExpression) and expression.operator in (
+            Operator.AND,
+            Operator.OR,
+        ):
+            middle = self.new_block()
+            if expression.operator == Operator.AND:
+                self.lower_branch(expression.left_expression, middle, false_target)
+            else:
+                self.lower_branch(expression.left_expression, true_target, middle)
+            self.start_block(middle)
+            self.lower_branch(expression.right_expression, true_target, false_target)
+        elif (
+            isinstance(expression, UnaryExpression)
+            and expression.operator == Operator.NOT
+        ):
+            self.lower_branch(expression.expression, false_target, true_target)
+        elif (
+            isinstance(expression, Constant)
+            and expression.constant_type == PrimitiveTypes.BOOL
+        ):
+            self.terminate(
+                Jump(true_target if constant_value(expression) else false_target)
+            )
+        elif (
+            isinstance(expression, BinaryExpression)
+            and expression.operator in COMPARISONS
+        ):
+            left, right = self.lower_operands(
+                expression.left_expression, expression.right_expression
+            )
+            self.terminate(
+                Branch(
+                    OPERATORS[expression.operator],
+                    left,
+                    right,
+                    true_target,
+                    false_target,
+                )
+            )
+        else:
+            value = self.lower_value(expression)
+            self.terminate(Branch("ne", value, Immediate(0), true_target, false_target))
+
+    def lower_operands(self, *expressions: Expression) -> List[Value]:
+        """
+        Evaluates the expressions in order. A variable may be assigned by the expressions that come
+        after it, so its value is copied first in that case.
+        """
+        values = []
+        for index, expression in enumerate(expressions):
+            value = self.lower_value(expression)
+            if isinstance(value, Temporary) and any(
+                later.has_side_effects() for later in expressions[index + 1 :]
+            ):
+                value = self.hold(value)
+            values.append(value)
+        return values
+
+    def hold(self, value: Temporary) -> Temporary:
+        if value not in self.variables.values():
+            return value
+        copy = self.new_temporary(value.type)
+        self.emit(Move(copy, value))
+        return copy
+
+    def lower_value(self, expression: Expression) -> Optional[Value]:
+        """
+        Emits the instructions that compute the expression and returns its value.
+        None for calls of void functions.
+        """
+        if isinstance(expression, Constant):
+            return self.lower_constant(expression)
+        if isinstance(expression, ThisExpression):
+            return self.function.this
+        if isinstance(expression, ReadInteger):
+            return self.call("_ReadInteger", [], IRType.WORD)
+        if isinstance(expression, ReadLine):
+            return self.call("_ReadLine", [], IRType.WORD)
+        if isinstance(expression, LValue):
+            variable = self.variable_temporary(expression)
+            if variable is not None:
+                return variable
+            base, offset, region = self.lower_address(expression)
+            value = self.new_temporary(ir_type(expression.expression_type))
+            self.emit(Load(value, base, offset, region))
+            return value
+        if isinstance(expression, Assignment):
+            return self.lower_assignment(expression)
+        if isinstance(expression, BinaryExpression):
+            return self.lower_binary(expression)
+        if isinstance(expression, UnaryExpression):
+            operand = self.lower_value(expression.expression)
+            value = self.new_temporary(operand.type)
+            operator = "not" if expression.operator == Operator.NOT else "neg"
+            self.emit(UnaryOperation(operator, value, operand))
+            return value
+        if isinstance(expression, FunctionCall):
+            return self.lower_function_call(expression)
+        if isinstance(expression, MethodCall):
+            return self.lower_method_call(expression)
+        if isinstance(expression, InitiateClass):
+            class_decl = expression.class_identifier.declaration
+            assert isinstance(class_decl, ClassDeclaration)
+            value = self.new_temporary(IRType.WORD)
+            vtable = self.new_temporary(IRType.WORD)
+            self.emit(
+                Allocate(value, Immediate(class_decl.calculate_size(self.symbol_table)))
+            )
+            self.emit(LoadAddress(vtable, class_decl.vtable_label))
+            self.emit(Store(vtable, value, 0, MemoryRegion.VTABLE))
+            return value
+        if isinstance(expression, InitiateArray):
+            return self.lower_new_array(expression)
+        raise NotImplementedError(f"Can not lower {type(expression).__name__}.")
+
+    def lower_constant(self, constant: Constant) -> Value:
+        if constant.constant_type == PrimitiveTypes.STRING:
+            label = f"str_{self.symbol_table.get_string_cost_count()}"
+            self.program.strings[label] = constant.value
+            value = self.new_temporary(IRType.WORD)
+            self.emit(LoadAddress(value, label))
+            return value
+        if constant.constant_type == PrimitiveTypes.DOUBLE:
+            return Immediate(constant_value(constant), IRType.DOUBLE)
+        if constant.constant_type == PrimitiveTypes.NULL:
+            return Immediate(0)
+        return Immediate(int(constant_value(constant)))
+
+    def variable_temporary(self, l_value: LValue) -> Optional[Temporary]:
+        if isinstance(l_value, IdentifierLValue):
+            return self.variables.get(id(l_value.identifier.declaration))
+        return None
+
+    def lower_address(
+        self, l_value: LValue
+    ) -> Tuple[Optional[Value], int, MemoryRegion]:
+        """
+        Base, offset and region of an l-value in memory. No base means relative to the globals.
+        """
+        if isinstance(l_value, ArrayAccessLValue):
+            array, index = self.lower_operands(
+                l_value.array_expression, l_value.index_expression
+            )
+            element_size = calc_variable_size(l_value.expression_type)
+            if isinstance(index, Immediate):
+                return (
+                    array,
+                    ARRAY_LENGTH_SIZE + index.value * element_size,
+                    MemoryRegion.ELEMENT,
+                )
+            offset = self.new_temporary(IRType.WORD)
+            address = self.new_temporary(IRType.WORD)
+            self.emit(
+                BinaryOperation(
+                    "shl", offset, index, Immediate(int(math.log2(element_size)))
+                )
+            )
+            self.emit(BinaryOperation("add", address, array, offset))
+            return address, ARRAY_LENGTH_SIZE, MemoryRegion.ELEMENT
+        var_decl = l_value.identifier.declaration
+        assert isinstance(var_decl, VariableDeclaration)
+        if var_decl.is_class_member:
+            return self.function.this, var_decl.class_member_offset, MemoryRegion.FIELD
+        # Offsets of globals point to their last 4 bytes. A double starts 4 bytes lower.
+        double_offset = 4 if var_decl.variable_type == PrimitiveTypes.DOUBLE else 0
+        return (
+            None,
+            OFFSET_TO_FIRST_GLOBAL - var_decl.global_offset - double_offset,
+            MemoryRegion.GLOBAL,
+        )
+
+    def lower_assignment(self, assignment: Assignment) -> Value:
+        value = self.lower_value(assignment.expression)
+        variable = self.variable_temporary(assignment.l_value)
+        if variable is not None:
+            last = (
+                self.block.instructions[-1]
+                if self.block and self.block.instructions
+                else None
+            )
+            if (
+                last is not None
+                and last.definition() == value
+                and value not in self.variables.values()
+            ):
+                # Computes the value right into the variable.
+                last.destination = variable
+            else:
+                self.emit(Move(variable, value))
+            return variable
+        if isinstance(value, Temporary) and assignment.l_value.has_side_effects():
+            value = self.hold(value)
+        base, offset, region = self.lower_address(assignment.l_value)
+        self.emit(Store(value, base, offset, region))
+        return value
+
+    def lower_binary(self, expression: BinaryExpression) -> Value:
+        if expression.operator in (Operator.AND, Operator.OR):
+            # Only needed for the value of a condition, like b = x && y.
+            value = self.new_temporary(IRType.WORD)
+            true_block, false_block, end = (
+                self.new_block(),
+                self.new_block(),
+                self.new_block(),
+            )
+            self.lower_branch(expression, true_block, false_block)
+            for block, result in ((true_block, 1), (false_block, 0)):
+                self.start_block(block)
+                self.emit(Move(value, Immediate(result)))
+                self.terminate(Jump(end))
+            self.start_block(end)
+            return value
+        left, right = self.lower_operands(
+            expression.left_expression, expression.right_expression
+        )
+        value = self.new_temporary(ir_type(expression.expression_type))
+        self.emit(BinaryOperation(OPERATORS[expression.operator], value, left, right))
+        return value
+
+    def lower_new_array(self, expression: InitiateArray) -> Value:
+        length = self.lower_value(expression.length_expression)
+        element_size = calc_variable_size(expression.element_type)
+        if isinstance(length, Immediate):
+            size = Immediate(length.value * element_size + ARRAY_LENGTH_SIZE)
+        else:
+            elements_size = self.new_temporary(IRType.WORD)
+            size = self.new_temporary(IRType.WORD)
+            self.emit(
+                BinaryOperation(
+                    "shl",
+                    elements_size,
+                    length,
+                    Immediate(int(math.log2(element_size))),
+                )
+            )
+            self.emit(
+                BinaryOperation(
+                    "add", size, elements_size, Immediate(ARRAY_LENGTH_SIZE)
+                )
+            )
+        array = self.new_temporary(IRType.WORD)
+        self.emit(Allocate(array, size))
+        self.emit(Store(length, array, 0, MemoryRegion.LENGTH))
+        return array
+
+    def call(
+        self,
+        function: str,
+        arguments: List[Value],
+        return_type: Optional[IRType],
+        passes_this: bool = False,
+    ) -> Optional[Temporary]:
+        value = None if return_type is None else self.new_temporary(return_type)
+        self.emit(Call(value, function, arguments, passes_this))
+        return value
+
+    def lower_arguments(
+        self, arguments: List[Expression], receiver: Optional[Expression] = None
+    ) -> Tuple[List[Value], Optional[Value]]:
+        """
+        Arguments are evaluated from the last to the first, and the object of a method call after
+        them, like they are pushed by the code generated from the AST.
+        """
+        expressions = list(reversed(arguments))
+        if receiver is not None:
+            expressions.append(receiver)
+        values = self.lower_operands(*expressions)
+        receiver_value = values.pop() if receiver is not None else None
+        return list(reversed(values)), receiver_value
+
+    def lower_function_call(self, expression: FunctionCall) -> Optional[Value]:
+        function_decl = expression.function_identifier.declaration
+        assert isinstance(function_decl, FunctionDeclaration)
+        arguments, _ = self.lower_arguments(expression.actual_parameters)
+        if function_decl.is_method:
+            # A method of the class called without this.
+            return self.dispatch(function_decl, self.function.this, arguments)
+        if function_decl in STANDARD_LIBRARY_FUNCTIONS:
+            value = self.new_temporary(self.return_type(function_decl))
+            if function_decl.label in CONVERSIONS:
+                operator = CONVERSIONS[function_decl.label]
+                self.emit(UnaryOperation(operator, value, arguments[0]))
+            else:
+                self.emit(Move(value, arguments[0]))
+            return value
+        return self.call(
+            function_decl.label, arguments, self.return_type(function_decl), True
+        )
+
+    def lower_method_call(self, expression: MethodCall) -> Optional[Value]:
+        if expression.class_expression.expression_type.is_array():
+            array = self.lower_value(expression.class_expression)
+            length = self.new_temporary(IRType.WORD)
+            self.emit(Load(length, array, 0, MemoryRegion.LENGTH))
+            return length
+        method_decl = expression.method_identifier.declaration
+        assert isinstance(method_decl, FunctionDeclaration)
+        arguments, receiver = self.lower_arguments(
+            expression.actual_parameters, expression.class_expression
+        )
+        return self.dispatch(method_decl, receiver, arguments)
+
+    def dispatch(
+        self, method_decl: FunctionDeclaration, receiver: Value, arguments: List[Value]
+    ) -> Optional[Value]:
+        """
+        Calls the method through the vtable of the object.
+        """
+        vtable = self.new_temporary(IRType.WORD)
+        method = self.new_temporary(IRType.WORD)
+        self.emit(Load(vtable, receiver, 0, MemoryRegion.VTABLE))
+        self.emit(Load(method, vtable, method_decl.vtable_offset, MemoryRegion.METHOD))
+        return_type = self.return_type(method_decl)
+        value = None if return_type is None else self.new_temporary(return_type)
+        known_method = None
+        if (
+            method_decl.owner_class is not None
+            and method_decl.label not in self.overridden_methods
+        ):
+            known_method = method_decl.label
+        self.emit(IndirectCall(value, method, receiver, arguments, known_method))
+        return value
+
+    @staticmethod
+    def return_type(function_decl: FunctionDeclaration) -> Optional[IRType]:
+        if function_decl.return_type == "void":
+            return None
+        return ir_type(function_decl.return_type)
+
+
+def lower_program(
+    declarations: List[Declaration], symbol_table: SymbolTable
+) -> Program:
+    """
+    IR of the functions and methods of the program, after names are resolved.
+    """
+    program = Program()
+    program.classes = [
+        declaration
+        for declaration in declarations
+        if isinstance(declaration, ClassDeclaration)
+    ]
+    overridden = overridden_methods(program.classes, symbol_table)
+    for declaration in declarations:
+        if isinstance(declaration, FunctionDeclaration):
+            program.functions.append(
+                FunctionLowering(program, declaration, symbol_table, overridden).lower()
+            )
+        elif isinstance(declaration, ClassDeclaration):
+            for method in declaration.methods:
+                program.functions.append(
+                    FunctionLowering(program, method, symbol_table, overridden).lower()
+                )
+    return program
+
+
+def overridden_methods(
+    classes: List[ClassDeclaration], symbol_table: SymbolTable
+) -> Set[str]:
+    """
+    Labels of the methods some subclass overrides. A call of any other method through the vtable
+    always reaches that method.
+    """
+    overridden = set()
+    for class_decl in classes:
+        if class_decl.extends is None:
+            continue
+        parent_decl = class_decl.extends.find_declaration(symbol_table)
+        inherited = parent_decl.get_layout(symbol_table).methods
+        for method, own_method in zip(
+            inherited, class_decl.get_layout(symbol_table).methods
+        ):
+            if own_method is not method:
+                overridden.add(method.label)
+    return overridden
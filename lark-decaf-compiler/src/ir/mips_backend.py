@@ -0,0 +1,843 @@
+"""
+Generates MIPS code from the IR. Temporaries get registers by linear scan over live intervals, which
+span from the first to the last position a temporary is live at in block layout order. Temporaries
+live across a call only get saved registers ($s), and the ones that do not get a register are kept in
+the stack frame. Stack frames and the calling convention are the same as for the code generated from
+the AST, so the standard library works unchanged. Only leaf functions, which call nothing, save
+neither $ra nor $fp and address their frame, if they need one, from $sp.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..constant_folding import format_double
+from ..emitter import Emitter
+from ..models.SymbolTable import SymbolTable
+from ..register_allocation import (
+    LOCAL_REGISTER_COST,
+    LOOP_WEIGHT,
+    PARAMETER_REGISTER_COST,
+)
+from ..registers import DOUBLE_REGISTERS
+from ..utils import DOUBLE_RETURN_REGISTER, RETURN_REGISTER
+from .instructions import (
+    Allocate,
+    BasicBlock,
+    BinaryOperation,
+    Branch,
+    Call,
+    Function,
+    Immediate,
+    IndirectCall,
+    Instruction,
+    IRType,
+    Jump,
+    Load,
+    LoadAddress,
+    Move,
+    Program,
+    Return,
+    Store,
+    Temporary,
+    UnaryOperation,
+    Value,
+    is_call,
+)
+from .liveness import live_temporaries
+
+CALLER_SAVED_REGISTERS = [f"$t{number}" for number in range(8)]
+CALLEE_SAVED_REGISTERS = [f"$s{number}" for number in range(8)]
+# Never allocated. They hold immediates and the values of temporaries that live in the stack frame.
+SCRATCH_REGISTERS = ["$t8", "$t9"]
+DOUBLE_SCRATCH_REGISTERS = ["$f16", "$f18"]
+# $f12 holds the double a print routine expanded inline prints.
+PRINT_DOUBLE_REGISTER = "$f12"
+# No register survives a call of the standard library, so doubles live across calls are always spilled.
+ALLOCATABLE_DOUBLE_REGISTERS = [
+    register
+    for register in DOUBLE_REGISTERS
+    if register not in DOUBLE_SCRATCH_REGISTERS + [PRINT_DOUBLE_REGISTER]
+]
+# Print routines expanded inline: syscall code and where the syscall takes the value.
+PRINT_SYSCALLS = {
+    "_PrintInt": (1, "$a0"),
+    "_PrintString": (4, "$a0"),
+    "_SimplePrintDouble": (3, PRINT_DOUBLE_REGISTER),
+}
+
+WORD_INSTRUCTIONS = {
+    "add": "addu",
+    "sub": "subu",
+    "mul": "mul",
+    "div": "div",
+    "shl": "sllv",
+    "lt": "slt",
+    "le": "sle",
+    "gt": "sgt",
+    "ge": "sge",
+    "eq": "seq",
+    "ne": "sne",
+}
+# Instructions that take a 16 bit immediate as their last operand.
+WORD_IMMEDIATE_INSTRUCTIONS = {
+    "mul": "mul",
+    "shl": "sll",
+    "lt": "slti",
+    "le": "sle",
+    "gt": "sgt",
+    "ge": "sge",
+    "eq": "seq",
+    "ne": "sne",
+}
+COMMUTATIVE_OPERATORS = {"add", "mul", "eq", "ne"}
+DOUBLE_INSTRUCTIONS = {"add": "add.d", "sub": "sub.d", "mul": "mul.d", "div": "div.d"}
+# Compare instruction, whether the operands are compared in reverse order and whether the
+# comparison holds when the condition flag is set.
+DOUBLE_COMPARISONS = {
+    "lt": ("c.lt.d", False, True),
+    "le": ("c.le.d", False, True),
+    "gt": ("c.lt.d", True, True),
+    "ge": ("c.le.d", True, True),
+    "eq": ("c.eq.d", False, True),
+    "ne": ("c.eq.d", False, False),
+}
+BRANCHES = {
+    "lt": "blt",
+    "le": "ble",
+    "gt": "bgt",
+    "ge": "bge",
+    "eq": "beq",
+    "ne": "bne",
+}
+ZERO_BRANCHES = {
+    "lt": "bltz",
+    "le": "blez",
+    "gt": "bgtz",
+    "ge": "bgez",
+    "eq": "beqz",
+    "ne": "bnez",
+}
+NEGATED_COMPARISONS = {
+    "lt": "ge",
+    "le": "gt",
+    "gt": "le",
+    "ge": "lt",
+    "eq": "ne",
+    "ne": "eq",
+}
+SWAPPED_COMPARISONS = {
+    "lt": "gt",
+    "le": "ge",
+    "gt": "lt",
+    "ge": "le",
+    "eq": "eq",
+    "ne": "ne",
+}
+# The old $fp is at 0($fp), the return address at -4($fp) and 'this' at 4($fp).
+OFFSET_TO_FIRST_PARAM = 8
+THIS_OFFSET = 4
+SAVED_RETURN_ADDRESS_SIZE = 4
+
+
+@dataclass
+class Interval:
+    temporary: Temporary
+    start: int
+    end: int
+    # Reads and writes of the temporary, weighted by the depth of the loops they are in.
+    weight: int = 0
+    is_parameter: bool = False
+    crosses_call: bool = False
+    register: Optional[str] = None
+
+    def candidate_registers(self) -> List[str]:
+        if self.temporary.type == IRType.DOUBLE:
+            return [] if self.crosses_call else ALLOCATABLE_DOUBLE_REGISTERS
+        if self.crosses_call:
+            # A saved register has to be saved and restored, which only pays off for busy temporaries.
+            cost = PARAMETER_REGISTER_COST if self.is_parameter else LOCAL_REGISTER_COST
+            return CALLEE_SAVED_REGISTERS if self.weight > cost else []
+        return CALLER_SAVED_REGISTERS + CALLEE_SAVED_REGISTERS
+
+
+def loop_depths(function: Function) -> Dict[BasicBlock, int]:
+    """
+    Loops are laid out contiguously, ending with the branch back to their start. So a block is in
+    as many loops as there are backward edges around it.
+    """
+    index = {block: number for number, block in enumerate(function.blocks)}
+    back_edges = [
+        (index[successor], index[block])
+        for block in function.blocks
+        for successor in block.successors()
+        if index[successor] <= index[block]
+    ]
+    return {
+        block: sum(start <= index[block] <= end for start, end in back_edges)
+        for block in function.blocks
+    }
+
+
+def temporary_number(temporary: Temporary) -> int:
+    return temporary.number
+
+
+def build_intervals(function: Function) -> List[Interval]:
+    """
+    Every instruction gets an even position. A temporary live out of a block lives one position past
+    its terminator, so it never ends where a temporary of the next block starts.
+    Intervals are in the order of their temporaries, so the generated code does not depend on how
+    sets of temporaries happen to be ordered.
+    """
+    live_in, live_out = live_temporaries(function)
+    depths = loop_depths(function)
+    intervals: Dict[Temporary, Interval] = dict()
+    call_positions = []
+
+    def extend(temporary: Temporary, position: int, weight: int = 0):
+        interval = intervals.get(temporary)
+        if interval is None:
+            interval = intervals[temporary] = Interval(temporary, position, position)
+        else:
+            interval.start = min(interval.start, position)
+            interval.end = max(interval.end, position)
+        interval.weight += weight
+
+    position = 0
+    for block in function.blocks:
+        weight = LOOP_WEIGHT ** depths[block]
+        for temporary in sorted(live_in[block], key=temporary_number):
+            extend(temporary, position)
+        for instruction in block.all_instructions():
+            for temporary in instruction.uses():
+                extend(temporary, position, weight)
+            definition = instruction.definition()
+            if definition is not None:
+                extend(definition, position, weight)
+            if is_call(instruction):
+                call_positions.append(position)
+            position += 2
+        for temporary in sorted(live_out[block], key=temporary_number):
+            extend(temporary, position - 1)
+    # Parameters and 'this' are loaded before the first instruction.
+    for temporary in [function.this] + function.parameters:
+        if temporary in intervals:
+            intervals[temporary].start = -1
+            intervals[temporary].is_parameter = True
+    for interval in intervals.values():
+        next_call = bisect_right(call_positions, interval.start)
+        interval.crosses_call = (
+            next_call < len(call_positions) and call_positions[next_call] < interval.end
+        )
+    return sorted(intervals.values(), key=lambda interval: interval.temporary.number)
+
+
+def linear_scan(intervals: List[Interval]):
+    """
+    Poletto and Sarkar's linear scan. When registers run out, the interval with the lowest weight
+    is spilled, like for the variables of the code generated from the AST. An interval that ends
+    where another starts can share its register: instructions read their operands before they write
+    their result.
+    """
+    free_registers = set(CALLER_SAVED_REGISTERS + CALLEE_SAVED_REGISTERS)
+    free_registers.update(ALLOCATABLE_DOUBLE_REGISTERS)
+    active: List[Interval] = []
+    for interval in sorted(intervals, key=lambda i: (i.start, i.temporary.number)):
+        for expired in [a for a in active if a.end <= interval.start]:
+            active.remove(expired)
+            free_registers.add(expired.register)
+        candidates = interval.candidate_registers()
+        register = next((r for r in candidates if r in free_registers), None)
+        if register is not None:
+            free_registers.remove(register)
+        else:
+            holders = [a for a in active if a.register in candidates]
+            victim = min(holders, key=lambda a: a.weight, default=None)
+            if victim is None or victim.weight >= interval.weight:
+                continue
+            register = victim.register
+            victim.register = None
+            active.remove(victim)
+        interval.register = register
+        active.append(interval)
+
+
+def value_bytes(value: Value) -> int:
+    return 8 if value.type == IRType.DOUBLE else 4
+
+
+def argument_bytes(arguments: List[Value]) -> int:
+    return sum(value_bytes(argument) for argument in arguments)
+
+
+def is_register(location: str) -> bool:
+    return location.startswith("$")
+
+
+class FunctionGenerator:
+    def __init__(self, function: Function, emitter: Emitter):
+        self.function = function
+        self.emitter = emitter
+        # Functions that call nothing keep $ra in place and need no $fp.
+        self.is_leaf = not any(
+            is_call(instruction)
+            for block in function.blocks
+            for instruction in block.instructions
+        )
+        # Register or stack slot of every temporary.
+        self.locations: Dict[Temporary, str] = dict()
+        # Bytes of the frame below $fp, the saved return address included if there is one.
+        self.frame_size = 0 if self.is_leaf else SAVED_RETURN_ADDRESS_SIZE
+        self.return_label = f"__{function.label}_return"
+        self.returns_jump = False
+        intervals = build_intervals(function)
+        linear_scan(intervals)
+        used_registers = {i.register for i in intervals if i.register is not None}
+        saved_register_offsets = [
+            (register, self.allocate_slot(4))
+            for register in CALLEE_SAVED_REGISTERS
+            if register in used_registers
+        ]
+        incoming_offsets = self.incoming_offsets()
+        slot_offsets: Dict[Temporary, int] = dict()
+        self.parameter_loads = []
+        # Parameters that stay where the caller put them, with their offsets.
+        self.incoming_slots: Dict[Temporary, int] = dict()
+        for interval in intervals:
+            temporary = interval.temporary
+            if interval.register is not None:
+                self.locations[temporary] = interval.register
+                if temporary in incoming_offsets:
+                    self.parameter_loads.append(temporary)
+            elif temporary in incoming_offsets:
+                # A parameter that did not get a register stays where the caller put it.
+                slot_offsets[temporary] = incoming_offsets[temporary]
+                self.incoming_slots[temporary] = incoming_offsets[temporary]
+            else:
+                size = 8 if temporary.type == IRType.DOUBLE else 4
+                slot_offsets[temporary] = self.allocate_slot(size)
+        # Room for the arguments of a tail call that are copied before the arguments are replaced.
+        staging_bytes = max(
+            (
+                sum(value_bytes(value) for value, _ in self.staged_arguments(tail_call))
+                for tail_call in map(self.tail_call, function.blocks)
+                if tail_call is not None
+            ),
+            default=0,
+        )
+        self.staging_offset = self.allocate_slot(staging_bytes)
+        # The size of the frame is known now.
+        self.saved_registers = [
+            (register, self.frame_address(offset))
+            for register, offset in saved_register_offsets
+        ]
+        for temporary, offset in slot_offsets.items():
+            self.locations[temporary] = self.frame_address(offset)
+
+    def incoming_offsets(self) -> Dict[Temporary, int]:
+        offsets = dict()
+        if self.function.this is not None:
+            offsets[self.function.this] = THIS_OFFSET
+        offset = OFFSET_TO_FIRST_PARAM
+        for parameter in self.function.parameters:
+            offsets[parameter] = offset
+            offset += 8 if parameter.type == IRType.DOUBLE else 4
+        return offsets
+
+    def allocate_slot(self, size: int) -> int:
+        self.frame_size += size
+        return -self.frame_size
+
+    def frame_address(self, offset: int) -> str:
+        """
+        Address of offset relative to where $fp points, which is $sp at the call. Leaf functions do
+        not set up $fp, their frame is addressed from $sp.
+        """
+        if self.is_leaf:
+            return f"{offset + self.frame_size}($sp)"
+        return f"{offset}($fp)"
+
+    def emit(self, line: str):
+        self.emitter.emit(line)
+
+    def generate(self):
+        function = self.function
+        self.emit(f"{function.label}:")
+        if self.is_leaf:
+            if self.frame_size:
+                self.emit(
+                    f"\tsubu $sp, $sp, {self.frame_size}\t# make space for the frame"
+                )
+        else:
+            self.emitter.emit_lines(
+                [
+                    "\tsubu $sp, $sp, 8\t# decrement sp to make space to save ra, fp",
+                    "\tsw $fp, 8($sp)\t# save fp",
+                    "\tsw $ra, 4($sp)\t# save ra",
+                    "\taddiu $fp, $sp, 8\t# set up new fp",
+                ]
+            )
+            # Every stack slot is addressed 4 bytes above $sp.
+            frame_bytes = self.frame_size - SAVED_RETURN_ADDRESS_SIZE
+            if frame_bytes:
+                self.emit(f"\tsubu $sp, $sp, {frame_bytes}\t# make space for the frame")
+        for register, slot in self.saved_registers:
+            self.emit(f"\tsw {register}, {slot}\t# save {register}")
+        incoming_offsets = self.incoming_offsets()
+        for temporary in self.parameter_loads:
+            address = self.frame_address(incoming_offsets[temporary])
+            self.load_into(self.locations[temporary], address)
+        predecessors = function.predecessors()
+        for index, block in enumerate(function.blocks):
+            previous_block = function.blocks[index - 1] if index else None
+            if any(
+                predecessor is not previous_block
+                or predecessor.successors() == [block, block]
+                for predecessor in predecessors[block]
+            ):
+                # Reached by a jump or a branch, not only by falling through.
+                self.emit(f"{block.label}:")
+            tail_call = self.tail_call(block)
+            for instruction in block.instructions:
+                if instruction is tail_call:
+                    self.generate_tail_call(tail_call)
+                else:
+                    self.generate_instruction(instruction)
+            if tail_call is not None:
+                continue
+            next_block = None
+            if index + 1 < len(function.blocks):
+                next_block = function.blocks[index + 1]
+            self.generate_terminator(block, next_block)
+        if self.returns_jump:
+            self.emit(f"{self.return_label}:")
+        self.pop_frame()
+        self.emit("\tjr $ra\t\t# return from function")
+
+    def pop_frame(self):
+        """
+        Restores the saved registers, $sp, $fp and $ra to what they were at the call.
+        """
+        for register, slot in self.saved_registers:
+            self.emit(f"\tlw {register}, {slot}\t# restore {register}")
+        if self.is_leaf:
+            if self.frame_size:
+                self.emit(f"\taddiu $sp, $sp, {self.frame_size}\t# pop the frame")
+            return
+        self.emitter.emit_lines(
+            [
+                "\tmove $sp, $fp\t\t# pop callee frame off stack",
+                "\tlw $ra, -4($fp)\t# restore saved ra",
+                "\tlw $fp, 0($fp)\t# restore saved fp",
+            ]
+        )
+
+    def scratch(self, value_type: IRType, index: int) -> str:
+        if value_type == IRType.DOUBLE:
+            return DOUBLE_SCRATCH_REGISTERS[index]
+        return SCRATCH_REGISTERS[index]
+
+    def load_into(self, register: str, source):
+        """
+        Copies a value, or the word or double at a stack slot, to register.
+        """
+        is_double = register.startswith("$f")
+        if isinstance(source, Immediate):
+            if is_double:
+                self.emit(f"\tli.d {register}, {format_double(source.value)}")
+            else:
+                self.emit(f"\tli {register}, {source.value}")
+            return
+        location = source if isinstance(source, str) else self.locations[source]
+        if location == register:
+            return
+        if is_register(location):
+            self.emit(f"\t{'mov.d' if is_double else 'move'} {register}, {location}")
+        else:
+            self.emit(f"\t{'l.d' if is_double else 'lw'} {register}, {location}")
+
+    def read(self, value: Value, index: int = 0) -> str:
+        """
+        Register that holds the value. Immediates and spilled temporaries are loaded to a scratch register.
+        """
+        if isinstance(value, Temporary) and is_register(self.locations[value]):
+            return self.locations[value]
+        register = self.scratch(value.type, index)
+        self.load_into(register, value)
+        return register
+
+    def target(self, temporary: Temporary) -> str:
+        """
+        Register to compute the value of the temporary in. Pass it to write afterwards.
+        """
+        location = self.locations[temporary]
+        if is_register(location):
+            return location
+        return self.scratch(temporary.type, 0)
+
+    def write(self, temporary: Temporary, register: str):
+        location = self.locations[temporary]
+        if location == register:
+            return
+        is_double = temporary.type == IRType.DOUBLE
+        if is_register(location):
+            self.emit(f"\t{'mov.d' if is_double else 'move'} {location}, {register}")
+        else:
+            self.emit(f"\t{'s.d' if is_double else 'sw'} {register}, {location}")
+
+    def generate_instruction(self, instruction: Instruction):
+        if isinstance(instruction, Move):
+            destination = instruction.destination
+            if isinstance(instruction.source, Immediate) and is_register(
+                self.locations[destination]
+            ):
+                self.load_into(self.locations[destination], instruction.source)
+            else:
+                self.write(destination, self.read(instruction.source))
+        elif isinstance(instruction, BinaryOperation):
+            if instruction.left.type == IRType.DOUBLE:
+                self.generate_double_operation(instruction)
+            else:
+                self.generate_word_operation(instruction)
+        elif isinstance(instruction, UnaryOperation):
+            operand = self.read(instruction.operand)
+            register = self.target(instruction.destination)
+            if instruction.operator == "not":
+                self.emit(f"\txori {register}, {operand}, 1")
+            elif instruction.operator == "itod":
+                self.emit(f"\tmtc1 {operand}, {register}")
+                self.emit(f"\tcvt.d.w {register}, {register}")
+            elif instruction.operator == "dtoi":
+                # Rounds like _DTOI.
+                scratch = DOUBLE_SCRATCH_REGISTERS[1]
+                self.emit(f"\tli.d {scratch}, 0.5")
+                self.emit(f"\tadd.d {scratch}, {operand}, {scratch}")
+                self.emit(f"\tcvt.w.d {scratch}, {scratch}")
+                self.emit(f"\tmfc1 {register}, {scratch}")
+            elif instruction.operator == "itob":
+                self.emit(f"\tsne {register}, {operand}, 0")
+            elif instruction.operand.type == IRType.DOUBLE:
+                self.emit(f"\tneg.d {register}, {operand}")
+            else:
+                self.emit(f"\tnegu {register}, {operand}")
+            self.write(instruction.destination, register)
+        elif isinstance(instruction, Load):
+            base = "$gp" if instruction.base is None else self.read(instruction.base, 1)
+            register = self.target(instruction.destination)
+            opcode = "l.d" if instruction.destination.type == IRType.DOUBLE else "lw"
+            self.emit(f"\t{opcode} {register}, {instruction.offset}({base})")
+            self.write(instruction.destination, register)
+        elif isinstance(instruction, Store):
+            source = self.read(instruction.source, 0)
+            base = "$gp" if instruction.base is None else self.read(instruction.base, 1)
+            opcode = "s.d" if instruction.source.type == IRType.DOUBLE else "sw"
+            self.emit(f"\t{opcode} {source}, {instruction.offset}({base})")
+        elif isinstance(instruction, LoadAddress):
+            register = self.target(instruction.destination)
+            self.emit(f"\tla {register}, {instruction.label}")
+            self.write(instruction.destination, register)
+        elif isinstance(instruction, Allocate):
+            self.load_into("$a0", instruction.size)
+            register = self.target(instruction.destination)
+            self.emitter.emit_lines(["\tli $v0, 9\t# sbrk", "\tsyscall"])
+            self.emit(f"\tmove {register}, $v0")
+            self.write(instruction.destination, register)
+        elif is_call(instruction):
+            self.generate_call(instruction)
+        elif isinstance(instruction, Call):
+            self.generate_print(instruction)
+
+    def generate_print(self, instruction: Call):
+        """
+        Print routines of the standard library, expanded to their syscall.
+        """
+        routine = instruction.function
+        if routine in PRINT_SYSCALLS:
+            code, register = PRINT_SYSCALLS[routine]
+            self.load_into(register, instruction.arguments[0])
+        elif routine == "_PrintBool":
+            code = 4
+            value = self.read(instruction.arguments[0])
+            label = self.function.new_label()
+            self.emit("\tla $a0, FALSE")
+            self.emit(f"\tblez {value}, {label}")
+            self.emit("\tla $a0, TRUE")
+            self.emit(f"{label}:")
+        else:
+            assert routine == "_PrintNewLine"
+            code = 4
+            self.emit("\tla $a0, NEWLINE")
+        self.emit(f"\tli $v0, {code}\t# {routine}")
+        self.emit("\tsyscall")
+
+    def generate_word_operation(self, instruction: BinaryOperation):
+        operator, left, right = (
+            instruction.operator,
+            instruction.left,
+            instruction.right,
+        )
+        if (
+            operator in COMMUTATIVE_OPERATORS
+            and isinstance(left, Immediate)
+            and isinstance(right, Temporary)
+        ):
+            left, right = right, left
+        left_register = self.read(left, 0)
+        register = self.target(instruction.destination)
+        immediate = right.value if isinstance(right, Immediate) else None
+        if operator == "rem":
+            right_register = self.read(right, 1)
+            self.emit(f"\tdiv {register}, {left_register}, {right_register}")
+            self.emit(f"\tmfhi {register}")
+        elif operator in ("add", "sub") and immediate is not None:
+            if operator == "sub":
+                immediate = -immediate
+            if -0x8000 <= immediate <= 0x7FFF:
+                self.emit(f"\taddiu {register}, {left_register}, {immediate}")
+            else:
+                self.emit(
+                    f"\t{WORD_INSTRUCTIONS[operator]} {register}, {left_register}, {self.read(right, 1)}"
+                )
+        elif (
+            operator in WORD_IMMEDIATE_INSTRUCTIONS
+            and immediate is not None
+            and -0x8000 <= immediate <= 0x7FFF
+        ):
+            self.emit(
+                f"\t{WORD_IMMEDIATE_INSTRUCTIONS[operator]} {register}, {left_register}, {immediate}"
+            )
+        else:
+            right_register = self.read(right, 1)
+            self.emit(
+                f"\t{WORD_INSTRUCTIONS[operator]} {register}, {left_register}, {right_register}"
+            )
+        self.write(instruction.destination, register)
+
+    def generate_double_operation(self, instruction: BinaryOperation):
+        left = self.read(instruction.left, 0)
+        right = self.read(instruction.right, 1)
+        register = self.target(instruction.destination)
+        if instruction.operator in DOUBLE_INSTRUCTIONS:
+            self.emit(
+                f"\t{DOUBLE_INSTRUCTIONS[instruction.operator]} {register}, {left}, {right}"
+            )
+        else:
+            compare, swapped, holds_if_set = DOUBLE_COMPARISONS[instruction.operator]
+            if swapped:
+                left, right = right, left
+            label = self.function.new_label()
+            self.emitter.emit_lines(
+                [
+                    f"\tli {register}, 1",
+                    f"\t{compare} {left}, {right}",
+                    f"\t{'bc1t' if holds_if_set else 'bc1f'} {label}",
+                    f"\tli {register}, 0",
+                    f"{label}:",
+                ]
+            )
+        self.write(instruction.destination, register)
+
+    def push_arguments(self, instruction: Instruction) -> int:
+        """
+        Arguments go to the stack, the first one lowest. Decaf functions also get the 'this' slot
+        below them. Returns the bytes pushed.
+        """
+        passes_this = isinstance(instruction, IndirectCall) or instruction.passes_this
+        stack_bytes = argument_bytes(instruction.arguments) + (4 if passes_this else 0)
+        if stack_bytes:
+            self.emit(
+                f"\tsubu $sp, $sp, {stack_bytes}\t# Make space for the parameters"
+            )
+        offset = 8 if passes_this else 4
+        for argument in instruction.arguments:
+            opcode = "s.d" if argument.type == IRType.DOUBLE else "sw"
+            self.emit(f"\t{opcode} {self.read(argument)}, {offset}($sp)")
+            offset += 8 if argument.type == IRType.DOUBLE else 4
+        if isinstance(instruction, IndirectCall):
+            self.emit(f"\tsw {self.read(instruction.this)}, 4($sp)\t# Pass 'this'")
+        return stack_bytes
+
+    def generate_call(self, instruction: Instruction):
+        stack_bytes = self.push_arguments(instruction)
+        if isinstance(instruction, IndirectCall):
+            self.emit(f"\tjalr {self.read(instruction.target, 1)}")
+        else:
+            self.emit(f"\tjal {instruction.function}")
+        if stack_bytes:
+            self.emit(
+                f"\taddiu $sp, $sp, {stack_bytes}\t# Cleanse stack of function parameters."
+            )
+        destination = instruction.destination
+        if destination is not None:
+            if destination.type == IRType.DOUBLE:
+                self.write(destination, DOUBLE_RETURN_REGISTER)
+            else:
+                self.write(destination, RETURN_REGISTER)
+
+    def tail_call(self, block: BasicBlock) -> Optional[Instruction]:
+        """
+        The call the block ends with if the function returns what it returns, and its arguments
+        fit where the arguments of the function are. main is called without a 'this' slot.
+        """
+        if not block.instructions or not isinstance(block.terminator, Return):
+            return None
+        call = block.instructions[-1]
+        if not (
+            isinstance(call, IndirectCall)
+            or isinstance(call, Call)
+            and call.passes_this
+        ):
+            return None
+        returned = block.terminator.value
+        if returned is not None and returned != call.destination:
+            return None
+        if self.function.label == "main":
+            return None
+        if argument_bytes(call.arguments) > argument_bytes(self.function.parameters):
+            return None
+        return call
+
+    def tail_call_arguments(self, instruction: Instruction) -> List[Tuple[Value, int]]:
+        """
+        The values a tail call passes and the offsets of the incoming slots they replace, in the
+        order they are stored.
+        """
+        arguments = []
+        offset = OFFSET_TO_FIRST_PARAM
+        for argument in instruction.arguments:
+            arguments.append((argument, offset))
+            offset += value_bytes(argument)
+        if isinstance(instruction, IndirectCall):
+            arguments.append((instruction.this, THIS_OFFSET))
+        return arguments
+
+    def staged_arguments(self, instruction: Instruction) -> Set[Tuple[Value, int]]:
+        """
+        Arguments of a tail call read from an incoming slot that an earlier argument is stored to.
+        """
+        staged = set()
+        written: List[Tuple[int, int]] = []
+        for value, offset in self.tail_call_arguments(instruction):
+            source = self.incoming_slots.get(value)
+            if source is not None and any(
+                start < source + value_bytes(value) and source < end
+                for start, end in written
+            ):
+                staged.add((value, offset))
+            written.append((offset, offset + value_bytes(value)))
+        return staged
+
+    def generate_tail_call(self, instruction: Instruction):
+        """
+        The arguments are stored right over the arguments of the function, except the ones already
+        there. Arguments whose slot is overwritten before they are read are copied aside first.
+        The frame is popped and the callee returns straight to the caller of the function, so tail
+        recursion runs in constant stack.
+        """
+        target = None
+        if isinstance(instruction, IndirectCall):
+            # Saved registers are restored before the jump.
+            target = SCRATCH_REGISTERS[1]
+            self.load_into(target, instruction.target)
+        arguments = self.tail_call_arguments(instruction)
+        staged = self.staged_arguments(instruction)
+        staging_slots = dict()
+        staging_offset = self.staging_offset
+        for argument in arguments:
+            if argument in staged:
+                value = argument[0]
+                register = self.read(value)
+                staging_slots[argument] = self.frame_address(staging_offset)
+                opcode = "s.d" if value.type == IRType.DOUBLE else "sw"
+                self.emit(f"\t{opcode} {register}, {staging_slots[argument]}")
+                staging_offset += value_bytes(value)
+        for argument in arguments:
+            value, offset = argument
+            if argument in staged:
+                register = self.scratch(value.type, 0)
+                self.load_into(register, staging_slots[argument])
+            elif self.incoming_slots.get(value) == offset:
+                continue
+            else:
+                register = self.read(value)
+            opcode = "s.d" if value.type == IRType.DOUBLE else "sw"
+            address = self.frame_address(offset)
+            self.emit(f"\t{opcode} {register}, {address}\t# Replace the argument")
+        self.pop_frame()
+        if target is None:
+            self.emit(f"\tj {instruction.function}\t# Tail call")
+        else:
+            self.emit(f"\tjr {target}\t# Tail call")
+
+    def generate_terminator(self, block: BasicBlock, next_block: Optional[BasicBlock]):
+        terminator = block.terminator
+        if isinstance(terminator, Jump):
+            if terminator.target is not next_block:
+                self.emit(f"\tj {terminator.target.label}")
+        elif isinstance(terminator, Branch):
+            if terminator.false_target is next_block:
+                self.generate_branch(terminator, True, terminator.true_target)
+            elif terminator.true_target is next_block:
+                self.generate_branch(terminator, False, terminator.false_target)
+            else:
+                self.generate_branch(terminator, True, terminator.true_target)
+                self.emit(f"\tj {terminator.false_target.label}")
+        elif isinstance(terminator, Return):
+            if terminator.value is not None:
+                if terminator.value.type == IRType.DOUBLE:
+                    self.load_into(DOUBLE_RETURN_REGISTER, terminator.value)
+                else:
+                    self.load_into(RETURN_REGISTER, terminator.value)
+            if next_block is not None:
+                if self.is_leaf and not self.frame_size:
+                    # Nothing to undo before returning.
+                    self.emit("\tjr $ra\t\t# return from function")
+                else:
+                    self.returns_jump = True
+                    self.emit(f"\tj {self.return_label}")
+
+    def generate_branch(self, branch: Branch, holds: bool, target: BasicBlock):
+        """
+        Jumps to target if the comparison of the branch holds (or does not hold).
+        """
+        left, right = branch.left, branch.right
+        if left.type == IRType.DOUBLE:
+            compare, swapped, holds_if_set = DOUBLE_COMPARISONS[branch.operator]
+            left_register, right_register = self.read(left, 0), self.read(right, 1)
+            if swapped:
+                left_register, right_register = right_register, left_register
+            self.emit(f"\t{compare} {left_register}, {right_register}")
+            # A comparison with NaN is false, so only the flag can be negated.
+            branch_opcode = "bc1t" if holds_if_set == holds else "bc1f"
+            self.emit(f"\t{branch_opcode} {target.label}")
+            return
+        operator = branch.operator if holds else NEGATED_COMPARISONS[branch.operator]
+        if isinstance(left, Immediate) and isinstance(right, Temporary):
+            left, right = right, left
+            operator = SWAPPED_COMPARISONS[operator]
+        left_register = self.read(left, 0)
+        if isinstance(right, Immediate):
+            if right.value == 0:
+                self.emit(
+                    f"\t{ZERO_BRANCHES[operator]} {left_register}, {target.label}"
+                )
+            else:
+                self.emit(
+                    f"\t{BRANCHES[operator]} {left_register}, {right.value}, {target.label}"
+                )
+        else:
+            self.emit(
+                f"\t{BRANCHES[operator]} {left_register}, {self.read(right, 1)}, {target.label}"
+            )
+
+
+def generate_program(program: Program, symbol_table: SymbolTable, emitter: Emitter):
+    if program.strings:
+        emitter.emit("\t.data")
+        for label, literal in program.strings.items():
+            emitter.emit_lines([f"{label}:", f"\t.asciiz {literal}"])
+        emitter.emit(".text")
+    for class_decl in program.classes:
+        class_decl.generate_vtable(symbol_table, emitter)
+    for function in program.functions:
+        FunctionGenerator(function, emitter).generate()
@@ -0,0 +1,459 @@
+"""
+Optimizations of the IR in SSA form: sparse conditional constant propagation, copy propagation,
+global value numbering and dead code elimination. Constants are folded the same way as by
+constant_folding, so the optimized program computes the same values as the unoptimized one, and
+divisions that may trap are never removed.
+"""
+import math
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from ..constant_folding import evaluate_binary, wrap
+from .instructions import (
+    CALLS,
+    IMMUTABLE_REGIONS,
+    Address,
+    BasicBlock,
+    BinaryOperation,
+    Branch,
+    Function,
+    Immediate,
+    Instruction,
+    IRType,
+    Jump,
+    Load,
+    LoadAddress,
+    Move,
+    Phi,
+    Program,
+    Store,
+    Temporary,
+    Terminator,
+    UnaryOperation,
+    Value,
+    is_call,
+)
+from .inlining import eliminate_tail_recursion, inline_calls
+from .loops import hoist_loop_invariants
+from .lowering import OPERATORS
+from .ssa import (
+    construct_ssa,
+    destruct_ssa,
+    dominator_tree,
+    immediate_dominators,
+    phis,
+)
+
+# IR operators as the operators of the AST, for evaluate_binary.
+AST_OPERATORS = {name: operator for operator, name in OPERATORS.items()}
+COMMUTATIVE_OPERATORS = {"add", "mul", "eq", "ne"}
+# Lattice of constant propagation. A temporary without a value yet is not in the table, a temporary
+# that can have more than one value is VARYING.
+VARYING = "varying"
+
+
+def same_constant(first, second) -> bool:
+    # 0.0 == -0.0, but they are different doubles.
+    return (
+        isinstance(first, Immediate)
+        and isinstance(second, Immediate)
+        and first == second
+        and repr(first.value) == repr(second.value)
+    )
+
+
+def evaluate(operator: str, left: Immediate, right: Immediate) -> Optional[Immediate]:
+    """
+    Value of left operator right as computed by the generated code, if it can be known.
+    """
+    if operator == "shl":
+        return Immediate(wrap(left.value << (right.value & 31)))
+    result = evaluate_binary(AST_OPERATORS[operator], left.value, right.value)
+    if result is None:
+        return None
+    if isinstance(result, bool):
+        return Immediate(int(result))
+    if left.type == IRType.DOUBLE:
+        return Immediate(result, IRType.DOUBLE) if math.isfinite(result) else None
+    return Immediate(result)
+
+
+def evaluate_unary(operator: str, operand: Immediate) -> Optional[Immediate]:
+    """
+    None for dtoi, whose rounding is left to the machine.
+    """
+    if operator == "not":
+        return Immediate(operand.value ^ 1)
+    if operator == "itod":
+        return Immediate(float(operand.value), IRType.DOUBLE)
+    if operator == "itob":
+        return Immediate(int(operand.value != 0))
+    if operator == "dtoi":
+        return None
+    if operand.type == IRType.DOUBLE:
+        return Immediate(-operand.value, IRType.DOUBLE)
+    return Immediate(wrap(-operand.value))
+
+
+def has_side_effects(instruction: Instruction) -> bool:
+    if isinstance(instruction, (Store, Terminator) + CALLS):
+        return True
+    if isinstance(instruction, BinaryOperation) and instruction.operator in (
+        "div",
+        "rem",
+    ):
+        # Division by zero stops the program.
+        divisor = instruction.right
+        return instruction.left.type == IRType.WORD and not (
+            isinstance(divisor, Immediate) and divisor.value != 0
+        )
+    return False
+
+
+def incoming_temporaries(function: Function) -> List[Temporary]:
+    if function.this is None:
+        return list(function.parameters)
+    return [function.this] + function.parameters
+
+
+def propagate_constants(function: Function):
+    """
+    Wegman and Zadeck's sparse conditional constant propagation. Only blocks reachable with the
+    values found so far are evaluated, so constants also flow through branches that are never taken.
+    Uses of constants are replaced by immediates, branches that always go the same way by jumps and
+    blocks that are never reached are removed.
+    """
+    values: Dict[Temporary, Union[Immediate, str]] = {
+        temporary: VARYING for temporary in incoming_temporaries(function)
+    }
+    uses: Dict[Temporary, List[Tuple[Instruction, BasicBlock]]] = dict()
+    for block in function.blocks:
+        for instruction in block.all_instructions():
+            for temporary in instruction.uses():
+                uses.setdefault(temporary, []).append((instruction, block))
+    executable_blocks: Set[BasicBlock] = set()
+    executable_edges: Set[Tuple[Optional[BasicBlock], BasicBlock]] = set()
+    flow_work: List[Tuple[Optional[BasicBlock], BasicBlock]] = [(None, function.entry)]
+    value_work: List[Tuple[Instruction, BasicBlock]] = []
+
+    def value_of(value: Value):
+        if isinstance(value, Immediate):
+            return value
+        return values.get(value)
+
+    def update(temporary: Temporary, value):
+        old = values.get(temporary)
+        if old is VARYING or value is None or same_constant(old, value):
+            return
+        values[temporary] = value if old is None else VARYING
+        value_work.extend(uses.get(temporary, []))
+
+    def operation_value(*operands: Value):
+        """
+        The constant operands, None while one of them has no value yet or VARYING.
+        """
+        operand_values = [value_of(operand) for operand in operands]
+        if any(value is None for value in operand_values):
+            return None
+        if any(value is VARYING for value in operand_values):
+            return VARYING
+        return operand_values
+
+    def visit(instruction: Instruction, block: BasicBlock):
+        if isinstance(instruction, Phi):
+            value = None
+            for predecessor, argument in instruction.arguments.items():
+                if (predecessor, block) not in executable_edges:
+                    continue
+                argument_value = value_of(argument)
+                if argument_value is None:
+                    continue
+                if value is None:
+                    value = argument_value
+                elif not same_constant(value, argument_value):
+                    value = VARYING
+            update(instruction.destination, value)
+        elif isinstance(instruction, Move):
+            update(instruction.destination, value_of(instruction.source))
+        elif isinstance(instruction, (BinaryOperation, UnaryOperation)):
+            operands = operation_value(*instruction.operands())
+            if isinstance(operands, list):
+                if isinstance(instruction, BinaryOperation):
+                    operands = evaluate(instruction.operator, *operands) or VARYING
+                else:
+                    operands = (
+                        evaluate_unary(instruction.operator, *operands) or VARYING
+                    )
+            update(instruction.destination, operands)
+        elif isinstance(instruction, Jump):
+            flow_work.append((block, instruction.target))
+        elif isinstance(instruction, Branch):
+            operands = operation_value(instruction.left, instruction.right)
+            if operands is VARYING:
+                flow_work.append((block, instruction.true_target))
+                flow_work.append((block, instruction.false_target))
+            elif operands is not None:
+                holds = evaluate(instruction.operator, *operands).value
+                target = instruction.true_target if holds else instruction.false_target
+                flow_work.append((block, target))
+        elif instruction.definition() is not None:
+            update(instruction.definition(), VARYING)
+
+    while flow_work or value_work:
+        while flow_work:
+            edge = flow_work.pop()
+            if edge in executable_edges:
+                continue
+            executable_edges.add(edge)
+            block = edge[1]
+            if block in executable_blocks:
+                # Only the phis depend on the edge a block is entered by.
+                for phi in phis(block):
+                    visit(phi, block)
+                continue
+            executable_blocks.add(block)
+            for instruction in block.all_instructions():
+                visit(instruction, block)
+        while value_work:
+            instruction, block = value_work.pop()
+            if block in executable_blocks:
+                visit(instruction, block)
+
+    def replace(value: Value) -> Value:
+        known = value_of(value)
+        return known if isinstance(known, Immediate) else value
+
+    function.blocks = [block for block in function.blocks if block in executable_blocks]
+    for block in function.blocks:
+        for phi in phis(block):
+            phi.arguments = {
+                predecessor: argument
+                for predecessor, argument in phi.arguments.items()
+                if (predecessor, block) in executable_edges
+            }
+        for instruction in block.all_instructions():
+            instruction.replace_operands(replace)
+        terminator = block.terminator
+        if isinstance(terminator, Branch):
+            taken = [
+                target
+                for target in terminator.successors()
+                if (block, target) in executable_edges
+            ]
+            if len(taken) == 1:
+                block.terminator = Jump(taken[0])
+
+
+def propagate_copies(function: Function):
+    """
+    Uses of the destination of a copy read the source instead, and a phi whose arguments are all the
+    same value is that value.
+    """
+    replacements: Dict[Temporary, Value] = dict()
+
+    def resolve(value: Value) -> Value:
+        while isinstance(value, Temporary) and value in replacements:
+            value = replacements[value]
+        return value
+
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks:
+            for instruction in block.instructions:
+                destination = instruction.definition()
+                if destination in replacements:
+                    continue
+                if isinstance(instruction, Move):
+                    replacements[destination] = instruction.source
+                    changed = True
+                elif isinstance(instruction, Phi):
+                    arguments = {
+                        value_key(resolve(argument)): resolve(argument)
+                        for argument in instruction.arguments.values()
+                        if resolve(argument) != destination
+                    }
+                    if len(arguments) == 1:
+                        replacements[destination] = arguments.popitem()[1]
+                        changed = True
+
+    for block in function.blocks:
+        block.instructions = [
+            instruction
+            for instruction in block.instructions
+            if instruction.definition() not in replacements
+        ]
+        for instruction in block.all_instructions():
+            instruction.replace_operands(resolve)
+
+
+def value_key(value: Optional[Value]):
+    if isinstance(value, Immediate):
+        return value.type, repr(value.value)
+    return value
+
+
+def expression_key(instruction: Instruction):
+    """
+    Instructions with the same key compute the same value. None for instructions that do not only
+    depend on their operands.
+    """
+    if isinstance(instruction, BinaryOperation):
+        operands = [value_key(instruction.left), value_key(instruction.right)]
+        if instruction.operator in COMMUTATIVE_OPERATORS:
+            operands.sort(key=repr)
+        return (instruction.operator,) + tuple(operands)
+    if isinstance(instruction, UnaryOperation):
+        return instruction.operator, value_key(instruction.operand)
+    if isinstance(instruction, LoadAddress):
+        return "address", instruction.label
+    return None
+
+
+def number_values(function: Function):
+    """
+    Dominator based value numbering. An instruction that computes the same value as one that
+    dominates it is removed, and its uses read the earlier value. Lengths of arrays and vtables never
+    change, so loading them again is redundant too. Other loads are only removed when nothing that
+    may write the address comes in between, within a block and the blocks only it leads to. Stores
+    overwritten before anything can read them are removed as well.
+    """
+    dominators = immediate_dominators(function)
+    children = dominator_tree(function, dominators)
+    predecessors = function.predecessors()
+    replacements: Dict[Temporary, Value] = dict()
+
+    def resolve(value: Value) -> Value:
+        return replacements.get(value, value) if isinstance(value, Temporary) else value
+
+    available: Dict[tuple, Value] = dict()
+    # Values known to be in memory at the end of every block.
+    memories: Dict[BasicBlock, Dict[Address, Value]] = dict()
+    # Walks the dominator tree like the renaming of SSA construction.
+    pending: List[Optional[BasicBlock]] = [function.entry]
+    added: List[List[tuple]] = []
+    while pending:
+        block = pending.pop()
+        if block is None:
+            for key in added.pop():
+                del available[key]
+            continue
+        block_keys = []
+
+        def make_available(key: tuple, value: Value):
+            available[key] = value
+            block_keys.append(key)
+
+        memory: Dict[Address, Value] = dict()
+        if len(predecessors[block]) == 1 and predecessors[block][0] in memories:
+            memory = dict(memories[predecessors[block][0]])
+        # Stores nothing has read yet.
+        stores: Dict[Address, Store] = dict()
+        dead_stores: Set[Store] = set()
+        kept = []
+        for instruction in block.instructions:
+            instruction.replace_operands(resolve)
+            key = expression_key(instruction)
+            if isinstance(instruction, Phi):
+                key = ("phi", id(block)) + tuple(
+                    (predecessor.label, value_key(argument))
+                    for predecessor, argument in instruction.arguments.items()
+                )
+            if isinstance(instruction, Load):
+                address = instruction.address()
+                if address.region in IMMUTABLE_REGIONS:
+                    key = "load", address
+                elif address in memory:
+                    replacements[instruction.destination] = memory[address]
+                    continue
+                else:
+                    memory[address] = instruction.destination
+                    stores = {
+                        other: store
+                        for other, store in stores.items()
+                        if not other.may_overlap(address)
+                    }
+            elif isinstance(instruction, Store):
+                address = instruction.address()
+                if address in stores:
+                    dead_stores.add(stores[address])
+                if address.region in IMMUTABLE_REGIONS:
+                    # The object was just created.
+                    make_available(("load", address), instruction.source)
+                memory = {
+                    other: value
+                    for other, value in memory.items()
+                    if not other.may_overlap(address)
+                }
+                memory[address] = instruction.source
+                stores[address] = instruction
+            elif is_call(instruction):
+                memory.clear()
+                stores.clear()
+            if key is not None:
+                if key in available:
+                    replacements[instruction.destination] = available[key]
+                    continue
+                make_available(key, instruction.destination)
+            kept.append(instruction)
+        block.instructions = [
+            instruction for instruction in kept if instruction not in dead_stores
+        ]
+        memories[block] = memory
+        added.append(block_keys)
+        pending.append(None)
+        pending += reversed(children[block])
+
+    # Arguments of phis can come from blocks visited after them.
+    for block in function.blocks:
+        for instruction in block.all_instructions():
+            instruction.replace_operands(resolve)
+
+
+def eliminate_dead_code(function: Function):
+    """
+    Removes the instructions whose values are never used by an instruction with side effects.
+    """
+    definitions: Dict[Temporary, Instruction] = dict()
+    for block in function.blocks:
+        for instruction in block.instructions:
+            if instruction.definition() is not None:
+                definitions[instruction.definition()] = instruction
+    live: Set[Instruction] = set()
+    pending = [
+        instruction
+        for block in function.blocks
+        for instruction in block.all_instructions()
+        if has_side_effects(instruction)
+    ]
+    while pending:
+        instruction = pending.pop()
+        if instruction in live:
+            continue
+        live.add(instruction)
+        for temporary in instruction.uses():
+            if temporary in definitions:
+                pending.append(definitions[temporary])
+    for block in function.blocks:
+        block.instructions = [
+            instruction for instruction in block.instructions if instruction in live
+        ]
+
+
+def optimize_function(function: Function):
+    construct_ssa(function)
+    propagate_constants(function)
+    propagate_copies(function)
+    number_values(function)
+    hoist_loop_invariants(function)
+    number_values(function)
+    eliminate_dead_code(function)
+    destruct_ssa(function)
+    function.thread_jumps()
+
+
+def optimize_program(program: Program):
+    for function in program.functions:
+        eliminate_tail_recursion(function)
+    inline_calls(program)
+    for function in program.functions:
+        optimize_function(function)
@@ -0,0 +1,467 @@
+"""
+Static single assignment form. Construction places phis at the iterated dominance frontiers of the
+definitions of a temporary, only where the temporary is live (pruned SSA), and renames over the
+dominator tree. Destruction coalesces the arguments of every phi with its destination unless their
+live ranges interfere, and turns the remaining arguments into copies at the end of the predecessors.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+from .instructions import (
+    BasicBlock,
+    Branch,
+    Function,
+    Immediate,
+    Instruction,
+    Jump,
+    Move,
+    Phi,
+    Temporary,
+    Value,
+)
+from .liveness import LiveSets, live_temporaries
+
+
+def reverse_postorder(function: Function) -> List[BasicBlock]:
+    order = []
+    visited = {function.entry}
+    # Iterative depth first search. Every entry is a block and the successors not visited yet.
+    stack = [(function.entry, iter(function.entry.successors()))]
+    while stack:
+        block, successors = stack[-1]
+        successor = next(successors, None)
+        if successor is None:
+            stack.pop()
+            order.append(block)
+        elif successor not in visited:
+            visited.add(successor)
+            stack.append((successor, iter(successor.successors())))
+    order.reverse()
+    return order
+
+
+def immediate_dominators(function: Function) -> Dict[BasicBlock, Optional[BasicBlock]]:
+    """
+    Cooper, Harvey and Kennedy's iterative algorithm. The entry has no immediate dominator.
+    """
+    order = reverse_postorder(function)
+    index = {block: number for number, block in enumerate(order)}
+    predecessors = function.predecessors()
+    dominators: Dict[BasicBlock, Optional[BasicBlock]] = {
+        function.entry: function.entry
+    }
+
+    def intersect(first: BasicBlock, second: BasicBlock) -> BasicBlock:
+        while first is not second:
+            while index[first] > index[second]:
+                first = dominators[first]
+            while index[second] > index[first]:
+                second = dominators[second]
+        return first
+
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            processed = [p for p in predecessors[block] if p in dominators]
+            new_dominator = processed[0]
+            for predecessor in processed[1:]:
+                new_dominator = intersect(predecessor, new_dominator)
+            if dominators.get(block) is not new_dominator:
+                dominators[block] = new_dominator
+                changed = True
+    dominators[function.entry] = None
+    return dominators
+
+
+def dominator_tree(
+    function: Function, dominators: Dict[BasicBlock, Optional[BasicBlock]]
+) -> Dict[BasicBlock, List[BasicBlock]]:
+    """
+    Children of every block in the dominator tree, in layout order.
+    """
+    children = {block: [] for block in function.blocks}
+    for block in function.blocks:
+        if dominators[block] is not None:
+            children[dominators[block]].append(block)
+    return children
+
+
+def dominance_frontiers(
+    function: Function, dominators: Dict[BasicBlock, Optional[BasicBlock]]
+) -> Dict[BasicBlock, Set[BasicBlock]]:
+    frontiers = {block: set() for block in function.blocks}
+    for block, predecessors in function.predecessors().items():
+        if len(predecessors) < 2:
+            continue
+        for predecessor in predecessors:
+            runner = predecessor
+            while runner is not dominators[block]:
+                frontiers[runner].add(block)
+                runner = dominators[runner]
+    return frontiers
+
+
+def phis(block: BasicBlock) -> List[Phi]:
+    phi_count = 0
+    while phi_count < len(block.instructions) and isinstance(
+        block.instructions[phi_count], Phi
+    ):
+        phi_count += 1
+    return block.instructions[:phi_count]
+
+
+def construct_ssa(function: Function):
+    """
+    Renames the temporaries assigned more than once, so every temporary has exactly one definition
+    that dominates its uses. Parameters and 'this' are defined on entry.
+    """
+    for block in function.blocks:
+        terminator = block.terminator
+        if (
+            isinstance(terminator, Branch)
+            and terminator.true_target is terminator.false_target
+        ):
+            # A phi has one argument per predecessor, so no block may reach another one twice.
+            block.terminator = Jump(terminator.true_target)
+    if function.predecessors()[function.entry]:
+        # The entry is the start of a loop. Phis need a block before it.
+        function.blocks.insert(
+            0, BasicBlock(function.new_label(), [], Jump(function.entry))
+        )
+    incoming = set(function.parameters)
+    if function.this is not None:
+        incoming.add(function.this)
+    definition_blocks: Dict[Temporary, Set[BasicBlock]] = {
+        temporary: {function.entry} for temporary in incoming
+    }
+    definition_counts: Dict[Temporary, int] = {temporary: 1 for temporary in incoming}
+    for block in function.blocks:
+        for instruction in block.instructions:
+            definition = instruction.definition()
+            if definition is not None:
+                definition_blocks.setdefault(definition, set()).add(block)
+                definition_counts[definition] = definition_counts.get(definition, 0) + 1
+    variables = {
+        temporary for temporary, count in definition_counts.items() if count > 1
+    }
+
+    dominators = immediate_dominators(function)
+    frontiers = dominance_frontiers(function, dominators)
+    live_in, _ = live_temporaries(function)
+    phi_variables: Dict[Phi, Temporary] = dict()
+    for variable in sorted(variables, key=lambda t: t.number):
+        placed = set()
+        pending = list(definition_blocks[variable])
+        while pending:
+            for frontier in frontiers[pending.pop()]:
+                if frontier in placed or variable not in live_in[frontier]:
+                    continue
+                placed.add(frontier)
+                phi = Phi(variable, dict())
+                phi_variables[phi] = variable
+                frontier.instructions.insert(0, phi)
+                pending.append(frontier)
+
+    rename(function, dominators, variables, incoming, phi_variables)
+
+
+def rename(
+    function: Function,
+    dominators: Dict[BasicBlock, Optional[BasicBlock]],
+    variables: Set[Temporary],
+    incoming: Set[Temporary],
+    phi_variables: Dict[Phi, Temporary],
+):
+    children = dominator_tree(function, dominators)
+    # Current name of every variable, as a stack per variable. Incoming values keep their names.
+    names: Dict[Temporary, List[Temporary]] = {
+        variable: [variable] if variable in incoming else [] for variable in variables
+    }
+
+    def current(value: Value) -> Value:
+        if isinstance(value, Temporary) and value in variables:
+            return names[value][-1]
+        return value
+
+    # Walks the dominator tree without recursion. A None entry pops the names of the block above it.
+    pending: List[Optional[BasicBlock]] = [function.entry]
+    defined: List[List[Temporary]] = []
+    while pending:
+        block = pending.pop()
+        if block is None:
+            for variable in defined.pop():
+                names[variable].pop()
+            continue
+        block_definitions = []
+        for instruction in block.all_instructions():
+            if not isinstance(instruction, Phi):
+                instruction.replace_operands(current)
+            variable = (
+                phi_variables[instruction]
+                if isinstance(instruction, Phi)
+                else instruction.definition()
+            )
+            if variable in variables:
+                name = function.new_temporary(variable.type, variable.name)
+                instruction.destination = name
+                names[variable].append(name)
+                block_definitions.append(variable)
+        for successor in block.successors():
+            for phi in phis(successor):
+                phi.arguments[block] = names[phi_variables[phi]][-1]
+        defined.append(block_definitions)
+        pending.append(None)
+        pending += reversed(children[block])
+
+
+def split_critical_edges(function: Function) -> List[BasicBlock]:
+    """
+    An edge from a block with several successors to a block with several predecessors gets a block
+    of its own, for the copies of the phis. Returns the new blocks.
+    """
+    predecessors = function.predecessors()
+    blocks = []
+    edges = []
+    for block in function.blocks:
+        blocks.append(block)
+        terminator = block.terminator
+        if not isinstance(terminator, Branch):
+            continue
+        for attribute in ("true_target", "false_target"):
+            successor = getattr(terminator, attribute)
+            if len(predecessors[successor]) < 2 or not phis(successor):
+                continue
+            edge = BasicBlock(function.new_label(), [], Jump(successor))
+            setattr(terminator, attribute, edge)
+            for phi in phis(successor):
+                if block in phi.arguments:
+                    phi.arguments[edge] = phi.arguments.pop(block)
+            predecessors[successor].remove(block)
+            predecessors[successor].append(edge)
+            # Right after the branch, so loops stay contiguous in the layout.
+            blocks.append(edge)
+            edges.append(edge)
+    function.blocks = blocks
+    return edges
+
+
+def ssa_live_temporaries(function: Function) -> Tuple[LiveSets, LiveSets]:
+    """
+    Like live_temporaries, but the arguments of a phi are live at the end of the predecessor they
+    come from, and the destination is defined at the start of the block of the phi.
+    """
+    summaries = dict()
+    for block in function.blocks:
+        uses, definitions = set(), set()
+        for instruction in block.all_instructions():
+            if not isinstance(instruction, Phi):
+                uses.update(t for t in instruction.uses() if t not in definitions)
+            definition = instruction.definition()
+            if definition is not None:
+                definitions.add(definition)
+        summaries[block] = uses, definitions
+    live_in: LiveSets = {block: set() for block in function.blocks}
+    live_out: LiveSets = {block: set() for block in function.blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(function.blocks):
+            out = set()
+            for successor in block.successors():
+                out |= live_in[successor]
+                for phi in phis(successor):
+                    argument = phi.arguments.get(block)
+                    if isinstance(argument, Temporary):
+                        out.add(argument)
+            uses, definitions = summaries[block]
+            new_in = uses | (out - definitions)
+            if out != live_out[block] or new_in != live_in[block]:
+                live_out[block], live_in[block] = out, new_in
+                changed = True
+    return live_in, live_out
+
+
+def interferences(function: Function) -> Dict[Temporary, Set[Temporary]]:
+    """
+    Temporaries that are live at the same time. A temporary interferes with everything live where
+    it is defined.
+    """
+    _, live_out = ssa_live_temporaries(function)
+    graph: Dict[Temporary, Set[Temporary]] = dict()
+
+    def interfere(definition: Temporary, live: Set[Temporary]):
+        for temporary in live:
+            if temporary != definition:
+                graph.setdefault(definition, set()).add(temporary)
+                graph.setdefault(temporary, set()).add(definition)
+
+    for block in function.blocks:
+        live = set(live_out[block])
+        block_phis = phis(block)
+        for instruction in reversed(block.all_instructions()[len(block_phis) :]):
+            definition = instruction.definition()
+            if definition is not None:
+                interfere(definition, live)
+                live.discard(definition)
+            live.update(instruction.uses())
+        # Phis are all defined at once when the block is entered, like parameters on entry.
+        definitions = [phi.destination for phi in block_phis]
+        if block is function.entry:
+            definitions += function.parameters
+            if function.this is not None:
+                definitions.append(function.this)
+        live.update(definitions)
+        for definition in definitions:
+            interfere(definition, live)
+    return graph
+
+
+def sequentialize(
+    function: Function, copies: List[Tuple[Temporary, Value]]
+) -> List[Instruction]:
+    """
+    Moves that do the copies as if they all happened at once. A cycle of copies, like a swap, is
+    broken with a new temporary.
+    """
+    pending = [(destination, source) for destination, source in copies]
+    pending = [(d, s) for d, s in pending if d != s]
+    moves = []
+    while pending:
+        for index, (destination, source) in enumerate(pending):
+            if all(other_source != destination for _, other_source in pending):
+                moves.append(Move(destination, source))
+                del pending[index]
+                break
+        else:
+            destination = pending[0][0]
+            saved = function.new_temporary(destination.type, destination.name)
+            moves.append(Move(saved, destination))
+            pending = [(d, saved if s == destination else s) for d, s in pending]
+    return moves
+
+
+def destruct_ssa(function: Function):
+    """
+    Replaces the phis by copies. Temporaries joined by a phi share one name when their live
+    ranges do not overlap, which makes most of the copies disappear.
+    """
+    edges = split_critical_edges(function)
+    graph = interferences(function)
+    # Union find over temporaries. Every class knows its members and what they interfere with.
+    parents: Dict[Temporary, Temporary] = dict()
+    members: Dict[Temporary, Set[Temporary]] = dict()
+    neighbors: Dict[Temporary, Set[Temporary]] = dict()
+
+    def find(temporary: Temporary) -> Temporary:
+        root = temporary
+        while root in parents:
+            root = parents[root]
+        # Path compression.
+        while temporary in parents and parents[temporary] != root:
+            parents[temporary], temporary = root, parents[temporary]
+        return root
+
+    def union(first: Temporary, second: Temporary):
+        first, second = find(first), find(second)
+        if first == second:
+            return
+        first_members = members.get(first, {first})
+        second_members = members.get(second, {second})
+        first_neighbors = neighbors.get(first, graph.get(first, set()))
+        if first_neighbors & second_members:
+            return
+        parents[second] = first
+        members[first] = first_members | second_members
+        neighbors[first] = first_neighbors | neighbors.get(
+            second, graph.get(second, set())
+        )
+
+    for block in function.blocks:
+        for phi in phis(block):
+            for argument in phi.arguments.values():
+                if isinstance(argument, Temporary):
+                    union(phi.destination, argument)
+
+    incoming = set(function.parameters)
+    if function.this is not None:
+        incoming.add(function.this)
+    # A parameter names its class, so it is still found where the caller put it.
+    names = {find(temporary): temporary for temporary in incoming}
+
+    def name(value: Value) -> Value:
+        if isinstance(value, Immediate):
+            return value
+        root = find(value)
+        return names.get(root, root)
+
+    predecessors = function.predecessors()
+    for block in function.blocks:
+        block_phis = phis(block)
+        if not block_phis:
+            continue
+        del block.instructions[: len(block_phis)]
+        for predecessor in predecessors[block]:
+            copies = [
+                (name(phi.destination), name(phi.arguments[predecessor]))
+                for phi in block_phis
+            ]
+            moves = sequentialize(function, copies)
+            if len(predecessors[block]) == 1:
+                block.instructions[:0] = moves
+            else:
+                predecessor.instructions += moves
+
+    for block in function.blocks:
+        for instruction in block.all_instructions():
+            instruction.replace_operands(name)
+            definition = instruction.definition()
+            if definition is not None:
+                instruction.destination = name(definition)
+        block.instructions = [
+            instruction
+            for instruction in block.instructions
+            if not (
+                isinstance(instruction, Move)
+                and instruction.source == instruction.destination
+            )
+        ]
+    hoist_edge_copies(function, edges)
+
+
+def hoist_edge_copies(function: Function, edges: List[BasicBlock]):
+    """
+    The copies of a split edge go before the branch instead when the other way out of the branch
+    does not read what they write, so taking the edge costs no jump.
+    """
+    live_in, _ = live_temporaries(function)
+    predecessors = function.predecessors()
+    hoisted: Dict[BasicBlock, List[Instruction]] = dict()
+    for edge in edges:
+        branch_block = predecessors[edge][0]
+        if branch_block in hoisted:
+            # The other edge of the branch may need some of the copies that are now before it.
+            done = hoisted[branch_block]
+            written = {move.destination for move in done}
+            read = {move.source for move in edge.instructions}
+            edge.instructions = [
+                move
+                for move in edge.instructions
+                if move.destination in read
+                or move.source in written
+                or not any(
+                    other.destination == move.destination
+                    and other.source == move.source
+                    for other in done
+                )
+            ]
+            continue
+        written = {move.destination for move in edge.instructions}
+        if written & set(branch_block.terminator.uses()) or any(
+            written & live_in[successor]
+            for successor in branch_block.successors()
+            if successor is not edge
+        ):
+            continue
+        branch_block.instructions += edge.instructions
+        hoisted[branch_block] = edge.instructions
+        edge.instructions = []
@@ -1,13 +1,25 @@
 from __future__ import annotations
 
 import getopt
+import glob
+import io
 import logging
 import os
 import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from lark import Lark
 
 from .decaf_transformer import DecafTransformer
-from .parser import decaf_parser
-from .standard_library_functions import standard_library_functions
+from .emitter import ReferenceEmitter, StreamEmitter
+from .parser import decaf_parser, build_parser, USE_PARSER_CACHE
+from .peephole import PeepholeEmitter, PeepholeOptimizer
+from .standard_library_functions import RUNTIME_SYMBOLS, link_runtime
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -97,35 +109,400 @@ int main(){
 }"""
 
 
+DECAF_SOURCE_EXTENSIONS = (".decaf", ".d")
+# Level 0 generates code straight from the AST, level 1 and above go through the IR.
+DEFAULT_OPTIMIZATION_LEVEL = 1
+
+
+@lru_cache(maxsize=None)
+def inline_decaf_transformer() -> DecafTransformer:
+    return DecafTransformer()
+
+
+@lru_cache(maxsize=None)
+def inline_decaf_parser() -> Lark:
+    """
+    Parser that runs DecafTransformer while parsing, so AST nodes are created as the LALR parser
+    reduces and the parse tree of the program is never materialized.
+    """
+    return build_parser(
+        use_cache=USE_PARSER_CACHE, transformer=inline_decaf_transformer()
+    )
+
+
+def compile_to_stream(
+    raw_code: str,
+    stream: TextIO,
+    inline_transform: bool = False,
+    peephole: bool = True,
+    optimizer: Optional[PeepholeOptimizer] = None,
+    optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL,
+    ir_stream: Optional[TextIO] = None,
+    runtime: bool = True,
+):
+    """
+    Writes the compiled program to stream line by line while code is being generated,
+    so the whole assembly never has to be held in memory.
+    With peephole, every function goes through optimizer (a default one if not given) first.
+    With an ir_stream, the IR of the program is written to it as well.
+    With runtime, the routines of the standard library the program refers to are written after it.
+    """
+    # Under the peephole optimizer, so references it removes do not count.
+    references = ReferenceEmitter(StreamEmitter(stream), RUNTIME_SYMBOLS)
+    emitter = references
+    if peephole:
+        emitter = PeepholeEmitter(emitter, optimizer or PeepholeOptimizer())
+    if inline_transform:
+        transformer = inline_decaf_transformer()
+        transformer.emitter = emitter
+        transformer.optimization_level = optimization_level
+        transformer.ir_stream = ir_stream
+        try:
+            inline_decaf_parser().parse(raw_code)
+        finally:
+            transformer.emitter = None
+            transformer.ir_stream = None
+    else:
+        tree = decaf_parser.parse(raw_code)
+        DecafTransformer(emitter, optimization_level, ir_stream).transform(tree)
+    emitter.flush()
+    if runtime:
+        stream.write(link_runtime(references.referenced))
+        stream.write("\n")
+
+
+def compile_source(
+    raw_code: str,
+    inline_transform: bool = False,
+    peephole: bool = True,
+    optimizer: Optional[PeepholeOptimizer] = None,
+    optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL,
+) -> str:
+    output = io.StringIO()
+    compile_to_stream(
+        raw_code, output, inline_transform, peephole, optimizer, optimization_level
+    )
+    return output.getvalue()
+
+
+def compile_to_file(
+    raw_code: str,
+    output_path: str,
+    inline_transform: bool = False,
+    peephole: bool = True,
+    optimizer: Optional[PeepholeOptimizer] = None,
+    optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL,
+    emit_ir: bool = False,
+):
+    """
+    Streams the compiled program into output_path. A failed compilation does not leave a
+    partially written file behind.
+    With emit_ir, the IR of the program is written next to it, with the extension .ir.
+    """
+    ir_path = os.path.splitext(output_path)[0] + ".ir"
+    try:
+        with ExitStack() as files:
+            output_file = files.enter_context(open(output_path, "w"))
+            ir_file = files.enter_context(open(ir_path, "w")) if emit_ir else None
+            compile_to_stream(
+                raw_code,
+                output_file,
+                inline_transform,
+                peephole,
+                optimizer,
+                optimization_level,
+                ir_file,
+            )
+    except BaseException:
+        for path in (output_path, ir_path) if emit_ir else (output_path,):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+
+def collect_batch_inputs(patterns: List[str]) -> List[str]:
+    """
+    Every pattern is either a file, a directory (all Decaf sources directly inside it) or a glob.
+    """
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            inputs += sorted(
+                os.path.join(pattern, name)
+                for name in os.listdir(pattern)
+                if name.endswith(DECAF_SOURCE_EXTENSIONS)
+            )
+        elif glob.has_magic(pattern):
+            inputs += sorted(glob.glob(pattern))
+        else:
+            inputs.append(pattern)
+    return inputs
+
+
+def batch_output_path(input_path: str, output_directory: str) -> str:
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_directory, f"{name}.s")
+
+
+def output_clashes(input_paths: List[str], output_paths: List[str]) -> Dict[int, str]:
+    """
+    Inputs with the same name, like d1/a.d and d2/a.d or a.d and a.decaf, would write the same
+    output file. Returns an error message for every such input, by index.
+    """
+    indices_by_output: Dict[str, List[int]] = dict()
+    for index, output_path in enumerate(output_paths):
+        indices_by_output.setdefault(os.path.normpath(output_path), []).append(index)
+    errors = dict()
+    for indices in indices_by_output.values():
+        if len(indices) == 1:
+            continue
+        for index in indices:
+            others = ", ".join(
+                input_paths[other] for other in indices if other != index
+            )
+            errors[index] = f"{output_paths[index]} would also be written by {others}"
+    return errors
+
+
+def compile_file(
+    input_path: str,
+    output_path: str,
+    inline_transform: bool = False,
+    peephole: bool = True,
+    optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL,
+    emit_ir: bool = False,
+) -> Tuple[bool, str, float]:
+    """
+    Returns whether compilation succeeded, the error message if it did not and the time it took in ms.
+    Runs inside the worker processes of a parallel batch, so it only takes picklable arguments.
+    """
+    start = time.perf_counter()
+    try:
+        with open(input_path, "r") as input_file:
+            raw_code = input_file.read()
+        compile_to_file(
+            raw_code,
+            output_path,
+            inline_transform,
+            peephole,
+            optimization_level=optimization_level,
+            emit_ir=emit_ir,
+        )
+    except Exception as e:
+        return False, str(e) or type(e).__name__, (time.perf_counter() - start) * 1000
+    return True, "", (time.perf_counter() - start) * 1000
+
+
+def batch_compile(
+    input_paths: List[str],
+    output_directory: str,
+    jobs: int = 1,
+    inline_transform: bool = False,
+    peephole: bool = True,
+    optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL,
+    emit_ir: bool = False,
+) -> int:
+    """
+    Compiles every input with the same parser and prints a summary.
+    With jobs > 1 the files are spread over a pool of worker processes. Every worker imports this
+    module once, so it keeps its own warm parser for all the files it gets.
+    Results are always reported in input order. Returns the number of files that failed.
+    If a worker dies, the files that were not compiled yet fail and the batch goes on reporting.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    output_paths = [
+        batch_output_path(input_path, output_directory) for input_path in input_paths
+    ]
+    # Inputs whose outputs clash are not compiled at all, so none of them overwrites another.
+    clashes = output_clashes(input_paths, output_paths)
+    compiled = [index for index in range(len(input_paths)) if index not in clashes]
+    compiled_inputs = [input_paths[index] for index in compiled]
+    compiled_outputs = [output_paths[index] for index in compiled]
+    batch_start = time.perf_counter()
+
+    def all_results(results: Iterable[Tuple[bool, str, float]]):
+        results = iter(results)
+        for index in range(len(input_paths)):
+            yield (False, clashes[index], 0.0) if index in clashes else next(results)
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    compile_file,
+                    input_path,
+                    output_path,
+                    inline_transform,
+                    peephole,
+                    optimization_level,
+                    emit_ir,
+                )
+                for input_path, output_path in zip(compiled_inputs, compiled_outputs)
+            ]
+            results = map(future_result, futures)
+            failed = report_batch_results(
+                input_paths, output_paths, all_results(results)
+            )
+    else:
+        results = map(
+            compile_file,
+            compiled_inputs,
+            compiled_outputs,
+            repeat(inline_transform),
+            repeat(peephole),
+            repeat(optimization_level),
+            repeat(emit_ir),
+        )
+        failed = report_batch_results(input_paths, output_paths, all_results(results))
+    total = (time.perf_counter() - batch_start) * 1000
+    print(
+        f"Compiled {len(input_paths) - failed}/{len(input_paths)} files in {total:.1f} ms, {failed} failed."
+    )
+    return failed
+
+
+def future_result(future: Future) -> Tuple[bool, str, float]:
+    """
+    Result of compile_file in a worker. If the worker died, e.g. killed for running out of memory,
+    the file fails instead of the whole batch.
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        return False, str(e) or type(e).__name__, 0.0
+
+
+def report_batch_results(
+    input_paths: List[str],
+    output_paths: List[str],
+    results: Iterable[Tuple[bool, str, float]],
+) -> int:
+    failed = 0
+    for input_path, output_path, (succeeded, error, elapsed) in zip(
+        input_paths, output_paths, results
+    ):
+        if succeeded:
+            print(f"OK     {elapsed:9.1f} ms  {input_path} -> {output_path}")
+        else:
+            failed += 1
+            print(f"FAILED {elapsed:9.1f} ms  {input_path}: {error}")
+    return failed
+
+
+def print_usage():
+    print(
+        "main.py [-O<level>] [--emit-ir] [--inline-transform] [--no-peephole] [--peephole-stats] -i <inputfile> -o <outputfile>"
+    )
+    print(
+        "main.py --batch [-O<level>] [--emit-ir] [--inline-transform] [--no-peephole] [--outdir <directory>] [--jobs <N>] <file|directory|glob>..."
+    )
+
+
+def print_peephole_stats(optimizer: PeepholeOptimizer):
+    for rule in optimizer.rules:
+        print(f"{optimizer.hits[rule.name]:8d}  {rule.name}")
+    print(f"{sum(optimizer.hits.values()):8d}  total")
+
+
 def main(argv):
     inputfile = ""
     outputfile = ""
+    batch = False
+    output_directory = "out"
+    jobs = 1
+    inline_transform = False
+    peephole = True
+    peephole_stats = False
+    optimization_level = DEFAULT_OPTIMIZATION_LEVEL
+    emit_ir = False
     try:
-        opts, args = getopt.getopt(argv, "hi:o:", ["ifile=", "ofile="])
+        opts, args = getopt.getopt(
+            argv,
+            "hi:o:j:O:",
+            [
+                "ifile=",
+                "ofile=",
+                "batch",
+                "outdir=",
+                "jobs=",
+                "inline-transform",
+                "no-peephole",
+                "peephole-stats",
+                "emit-ir",
+            ],
+        )
     except getopt.GetoptError:
-        print("main.py -i <inputfile> -o <outputfile>")
+        print_usage()
         sys.exit(2)
     for opt, arg in opts:
         if opt == "-h":
-            print("test.py -i <inputfile> -o <outputfile>")
+            print_usage()
             sys.exit()
         elif opt in ("-i", "--ifile"):
             inputfile = arg
         elif opt in ("-o", "--ofile"):
             outputfile = arg
-    with open(os.path.join("tests", inputfile), "r") as input_file:
-        try:
-            raw_code = input_file.read()
-            tree = decaf_parser.parse(raw_code)
-            code = DecafTransformer().transform(tree)
-        except BaseException as e:
-            print(e)
-            sys.exit(1)
+        elif opt == "--batch":
+            batch = True
+        elif opt == "--outdir":
+            output_directory = arg
+        elif opt == "--inline-transform":
+            inline_transform = True
+        elif opt == "--no-peephole":
+            peephole = False
+        elif opt == "--peephole-stats":
+            peephole_stats = True
+        elif opt == "--emit-ir":
+            emit_ir = True
+        elif opt == "-O":
+            if not arg.isdigit():
+                print_usage()
+                sys.exit(2)
+            optimization_level = int(arg)
+        elif opt in ("-j", "--jobs"):
+            if not arg.isdigit():
+                print_usage()
+                sys.exit(2)
+            # 0 means one worker per CPU.
+            jobs = int(arg) or os.cpu_count() or 1
+    if batch:
+        input_paths = collect_batch_inputs(args)
+        if not input_paths:
+            print_usage()
+            sys.exit(2)
+        sys.exit(
+            1
+            if batch_compile(
+                input_paths,
+                output_directory,
+                jobs,
+                inline_transform,
+                peephole,
+                optimization_level,
+                emit_ir,
+            )
+            else 0
+        )
 
-    with open(os.path.join("out", outputfile), "w") as output_file:
+    with open(os.path.join("tests", inputfile), "r") as input_file:
+        raw_code = input_file.read()
+    optimizer = PeepholeOptimizer()
+    try:
         # write result to output file.
-        print("\n".join(code), file=output_file)
-        print(standard_library_functions, file=output_file)
+        compile_to_file(
+            raw_code,
+            os.path.join("out", outputfile),
+            inline_transform,
+            peephole,
+            optimizer,
+            optimization_level,
+            emit_ir,
+        )
+    except BaseException as e:
+        print(e)
+        sys.exit(1)
+    if peephole and peephole_stats:
+        print_peephole_stats(optimizer)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,15 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, TYPE_CHECKING, Optional
+from typing import Dict, List, TYPE_CHECKING, Optional
 
 from .Identifier import Identifier
 from .Node import Node
-from ..utils import calc_variable_size
+from ..utils import calc_variable_size, VTABLE_POINTER_SIZE, VTABLE_SLOT_SIZE
 
 if TYPE_CHECKING:
     from .Statement import StatementBlock
+    from ..emitter import Emitter
     from .SymbolTable import SymbolTable
     from .Type import Type
 
@@ -28,19 +29,32 @@ class VariableDeclaration(Declaration):
     is_function_parameter: bool = False
     function_parameter_offset: int = 0
     local_offset: int = 0
+    # Saved register the variable lives in instead of memory, set by register allocation.
+    register: Optional[str] = None
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = [f"\t# Code for variable declaration {self.identifier.name}:"]
+    def resolve_names(self, symbol_table: SymbolTable):
+        # Globals are already in the global scope.
+        if not self.is_global:
+            symbol_table.enter_new_scope().add_declaration(self)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        emitter.emit(f"\t# Code for variable declaration {self.identifier.name}:")
         current_scope = symbol_table.enter_new_scope()
         current_scope.add_declaration(self)
-        if not (self.is_global or self.is_class_member or self.is_function_parameter):
+        if not (
+            self.is_global
+            or self.is_class_member
+            or self.is_function_parameter
+            or self.register is not None
+        ):
             self.local_offset = symbol_table.get_local_offset()
             symbol_table.increment_local_offset(calc_variable_size(self.variable_type))
-            code += [
+            emitter.emit(
                 f"\tsubu $sp, $sp, {calc_variable_size(self.variable_type)}\t# Decrement sp to make space for variable {self.identifier.name}."
-            ]
-        code.append(f"\t# End of code for variable declaration {self.identifier.name}.")
-        return code
+            )
+        emitter.emit(
+            f"\t# End of code for variable declaration {self.identifier.name}."
+        )
 
 
 @dataclass
@@ -51,6 +65,9 @@ class FunctionDeclaration(Declaration):
     is_method: bool = False
     owner_class: Optional[ClassDeclaration] = None
     label: str = "UNSPECIFIED"
+    # Where method calls find the address of the method, relative to the vtable of the object.
+    # Negative for interface methods.
+    vtable_offset: int = 0
 
     def stamp_label(self):
         if self.owner_class is None:
@@ -60,7 +77,17 @@ class FunctionDeclaration(Declaration):
                 f"{self.owner_class.identifier.name}_{self.identifier.name}_meth"
             )
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        function_scope = symbol_table.enter_new_scope(self.owner_class)
+        for param in self.formal_parameters:
+            function_scope.add_declaration(param)
+        self.body.resolve_names(symbol_table)
+        symbol_table.set_current_scope(function_scope.parent_scope)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        from ..register_allocation import allocate_variable_registers
+        from .Expression import OFFSET_TO_FIRST_LOCAL, OFFSET_TO_FIRST_PARAM
+
         # Reset local offset for correct local variable addressing
         symbol_table.reset_local_offset()
         if self.owner_class is None:
@@ -72,25 +99,48 @@ class FunctionDeclaration(Declaration):
         function_scope = symbol_table.enter_new_scope(self.owner_class)
         for param in self.formal_parameters:
             function_scope.add_declaration(param)
-        code = [
-            f"{self.label}:",
-            "\tsubu $sp, $sp, 8\t# decrement sp to make space to save ra, fp",
-            "\tsw $fp, 8($sp)\t# save fp",
-            "\tsw $ra, 4($sp)\t# save ra",
-            "\taddiu $fp, $sp, 8\t# set up new fp",
+        emitter.emit_lines(
+            [
+                f"{self.label}:",
+                "\tsubu $sp, $sp, 8\t# decrement sp to make space to save ra, fp",
+                "\tsw $fp, 8($sp)\t# save fp",
+                "\tsw $ra, 4($sp)\t# save ra",
+                "\taddiu $fp, $sp, 8\t# set up new fp",
+            ]
+        )
+        # Saved registers of the caller go right below ra, before the locals.
+        saved_registers = allocate_variable_registers(self)
+        saved_register_addresses = [
+            f"{OFFSET_TO_FIRST_LOCAL - 4 * index}($fp)"
+            for index in range(len(saved_registers))
         ]
+        if saved_registers:
+            emitter.emit(
+                f"\tsubu $sp, $sp, {4 * len(saved_registers)}\t# make space to save registers"
+            )
+            symbol_table.increment_local_offset(4 * len(saved_registers))
+        for register, address in zip(saved_registers, saved_register_addresses):
+            emitter.emit(f"\tsw {register}, {address}\t# save {register}")
+        for param in self.formal_parameters:
+            if param.register is not None:
+                emitter.emit(
+                    f"\tlw {param.register}, {OFFSET_TO_FIRST_PARAM + param.function_parameter_offset + 4}($fp)\t# load parameter {param.identifier.name}"
+                )
         # TODO: What about objects? What about them?
-        code += self.body.generate_code(symbol_table)
-        code += [
-            "\tmove $sp, $fp\t\t# pop callee frame off stack",
-            "\tlw $ra, -4($fp)\t# restore saved ra",
-            "\tlw $fp, 0($fp)\t# restore saved fp",
-            "\tjr $ra\t\t# return from function",
-        ]
+        self.body.generate_code(symbol_table, emitter)
+        for register, address in zip(saved_registers, saved_register_addresses):
+            emitter.emit(f"\tlw {register}, {address}\t# restore {register}")
+        emitter.emit_lines(
+            [
+                "\tmove $sp, $fp\t\t# pop callee frame off stack",
+                "\tlw $ra, -4($fp)\t# restore saved ra",
+                "\tlw $fp, 0($fp)\t# restore saved fp",
+                "\tjr $ra\t\t# return from function",
+            ]
+        )
         # Reset
         symbol_table.reset_local_offset()
         symbol_table.set_current_scope(function_scope.parent_scope)
-        return code
 
     def __eq__(self, other):
         if isinstance(other, FunctionDeclaration):
@@ -102,62 +152,164 @@ class FunctionDeclaration(Declaration):
         return False
 
 
+@dataclass
+class ClassLayout:
+    """
+    Object layout and method table of a class, inherited members included. Computed once per class.
+    """
+
+    # Highest parent's variables first, in declaration order. Offsets are stamped on the declarations.
+    variables: List[VariableDeclaration]
+    # Includes the vtable pointer every object starts with.
+    size: int
+    # The vtable. Inherited slots first, overriding methods take the slot of the method they override.
+    methods: List[FunctionDeclaration]
+    variables_by_name: Dict[str, VariableDeclaration]
+    methods_by_name: Dict[str, FunctionDeclaration]
+    # What the scope of the class maps names to. Methods shadow variables with the same name.
+    members_by_name: Dict[str, Declaration]
+    # Implemented interfaces, inherited ones included.
+    interfaces: List[InterfaceDeclaration]
+
+
 @dataclass
 class ClassDeclaration(Declaration):
     extends: Optional[Identifier]
+    implements: List[Identifier]
     variables: List[VariableDeclaration]
     methods: List[FunctionDeclaration]
+    layout: Optional[ClassLayout] = None
+
+    def resolve_names(self, symbol_table: SymbolTable):
+        if self.extends is not None:
+            self.extends.declaration = symbol_table.get_global_scope().lookup(
+                self.extends.name
+            )
+        for interface_identifier in self.implements:
+            interface_identifier.resolve(symbol_table)
+        class_scope = symbol_table.enter_new_scope(owner_class_declaration=self)
+        class_scope.add_members(self.get_layout(symbol_table).members_by_name)
+        for method in self.methods:
+            method.resolve_names(symbol_table)
+        symbol_table.set_current_scope(class_scope.parent_scope)
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        self.generate_vtable(symbol_table, emitter)
         class_scope = symbol_table.enter_new_scope(owner_class_declaration=self)
-        vars_decls = self.all_variables_declarations(symbol_table)
-        methods_decls = self.all_methods_declarations(symbol_table)
-        # Add attributes to scope
-        for var_decl in vars_decls:
-            class_scope.add_declaration(var_decl)
-        # Add methods to scope
-        for method_decl in methods_decls:
-            class_scope.add_declaration(method_decl)
-        code = []
+        # Attributes and methods
+        class_scope.add_members(self.get_layout(symbol_table).members_by_name)
         for method in self.methods:
-            code += method.generate_code(symbol_table)
+            method.generate_code(symbol_table, emitter)
         symbol_table.set_current_scope(class_scope.parent_scope)
-        return code
+
+    @property
+    def vtable_label(self) -> str:
+        return f"{self.identifier.name}_vtable"
+
+    def generate_vtable(self, symbol_table: SymbolTable, emitter: Emitter):
+        """
+        The label points to the first method slot. Slots of interface methods, numbered over the
+        whole program, are laid out right before the label in reverse, so interface method i is at
+        -4 * (i + 1) from the label. They are 0 for interfaces the class does not implement.
+        """
+        layout = self.get_layout(symbol_table)
+        interface_slots = dict()
+        for interface_decl in layout.interfaces:
+            for prototype in interface_decl.prototypes:
+                method = self.find_method_declaration(
+                    symbol_table, prototype.identifier
+                )
+                interface_slots[prototype.vtable_offset] = method.label
+        emitter.emit_lines(
+            [f"	# VTable of class {self.identifier.name}", "	.data", "	.align 2"]
+        )
+        interface_method_count = len(symbol_table.interface_methods)
+        if interface_method_count:
+            emitter.emit(
+                "	.word "
+                + ", ".join(
+                    interface_slots.get(-VTABLE_SLOT_SIZE * slot, "0")
+                    for slot in range(interface_method_count, 0, -1)
+                )
+            )
+        emitter.emit(f"{self.vtable_label}:")
+        if layout.methods:
+            emitter.emit(
+                "	.word " + ", ".join(method.label for method in layout.methods)
+            )
+        else:
+            emitter.emit("	.word 0	# No methods.")
+        emitter.emit(".text")
+
+    def get_layout(self, symbol_table: SymbolTable) -> ClassLayout:
+        if self.layout is None:
+            self.layout = self.calculate_layout(symbol_table)
+        return self.layout
+
+    def calculate_layout(self, symbol_table: SymbolTable) -> ClassLayout:
+        if self.extends is None:
+            parent_layout = ClassLayout(
+                [], VTABLE_POINTER_SIZE, [], dict(), dict(), dict(), []
+            )
+        else:
+            parent_decl = self.extends.find_declaration(symbol_table)
+            assert isinstance(parent_decl, ClassDeclaration)
+            parent_layout = parent_decl.get_layout(symbol_table)
+        # Copying the parent's tables keeps building the layout of a deep hierarchy cheap.
+        variables_by_name = parent_layout.variables_by_name.copy()
+        class_member_offset = parent_layout.size
+        for var_decl in self.variables:
+            var_decl.class_member_offset = class_member_offset
+            class_member_offset += calc_variable_size(var_decl.variable_type)
+            variables_by_name.setdefault(var_decl.identifier.name, var_decl)
+        methods_by_name = parent_layout.methods_by_name.copy()
+        methods = parent_layout.methods.copy()
+        for method in self.methods:
+            overridden_method = methods_by_name.get(method.identifier.name)
+            if overridden_method is None:
+                method.vtable_offset = len(methods) * VTABLE_SLOT_SIZE
+                methods.append(method)
+            else:
+                method.vtable_offset = overridden_method.vtable_offset
+                methods[method.vtable_offset // VTABLE_SLOT_SIZE] = method
+            methods_by_name[method.identifier.name] = method
+        interfaces = parent_layout.interfaces.copy()
+        for interface_identifier in self.implements:
+            interface_decl = interface_identifier.find_declaration(symbol_table)
+            assert isinstance(interface_decl, InterfaceDeclaration)
+            if interface_decl not in interfaces:
+                interfaces.append(interface_decl)
+        members_by_name = parent_layout.members_by_name.copy()
+        members_by_name.update(
+            (var_decl.identifier.name, var_decl)
+            for var_decl in self.variables
+            if var_decl.identifier.name not in parent_layout.methods_by_name
+        )
+        members_by_name.update(
+            (method.identifier.name, method) for method in self.methods
+        )
+        return ClassLayout(
+            parent_layout.variables + self.variables,
+            class_member_offset,
+            methods,
+            variables_by_name,
+            methods_by_name,
+            members_by_name,
+            interfaces,
+        )
 
     def calculate_size(self, symbol_table: SymbolTable) -> int:
-        vars_decls = self.all_variables_declarations(symbol_table)
-        size = 0
-        for var_decl in vars_decls:
-            size += calc_variable_size(var_decl.variable_type)
-        return size
+        return self.get_layout(symbol_table).size
 
     def all_variables_declarations(
         self, symbol_table: SymbolTable
     ) -> List[VariableDeclaration]:
-        parents_decls = self.all_parents_declarations(symbol_table)
-        vars_decls = []
-        # In reverse. First variable of the highest parent first!
-        for parent_decl in reversed(parents_decls):
-            vars_decls += parent_decl.variables
-        vars_decls += self.variables
-        class_member_offset = 0
-        for var_decl in vars_decls:
-            var_decl.class_member_offset = class_member_offset
-            class_member_offset += calc_variable_size(var_decl.variable_type)
-        return vars_decls
+        return self.get_layout(symbol_table).variables
 
     def all_methods_declarations(
         self, symbol_table: SymbolTable
     ) -> List[FunctionDeclaration]:
-        parents_decls = self.all_parents_declarations(symbol_table)
-        methods_decls = self.methods.copy()
-        method_names = set([method.identifier.name for method in methods_decls])
-        for parent_decl in parents_decls:
-            for method in parent_decl.methods:
-                if method.identifier.name not in method_names:
-                    methods_decls.append(method)
-                    method_names.add(method.identifier.name)
-        return methods_decls
+        return self.get_layout(symbol_table).methods
 
     def all_parents_declarations(
         self, symbol_table: SymbolTable, parents_found: List[ClassDeclaration] = None
@@ -174,29 +326,44 @@ class ClassDeclaration(Declaration):
     def find_variable_declaration(
         self, symbol_table: SymbolTable, variable_identifier: Identifier
     ) -> VariableDeclaration:
-        # The optimal solution is to have the methods in a set.
-        for var_decl in self.all_variables_declarations(symbol_table):
-            if var_decl.identifier.name == variable_identifier.name:
-                return var_decl
+        variables_by_name = self.get_layout(symbol_table).variables_by_name
+        if variable_identifier.name in variables_by_name:
+            return variables_by_name[variable_identifier.name]
         print(
-            f"Error. Method {variable_identifier.name} not found in class {self.identifier.name}!"
+            f"Error. Variable {variable_identifier.name} not found in class {self.identifier.name}!"
         )
 
     def find_method_declaration(
         self, symbol_table: SymbolTable, method_identifier: Identifier
     ) -> FunctionDeclaration:
-        # The optimal solution is to have the methods in a set.
-        for method in self.methods:
-            if method.identifier.name == method_identifier.name:
-                return method
-        parents_decls = self.all_parents_declarations(symbol_table)
-        if len(parents_decls):
-            print(
-                f"Error. Method {method_identifier.name} not found in class {self.identifier.name}!"
-            )
-        return parents_decls[0].find_method_declaration(symbol_table, method_identifier)
+        methods_by_name = self.get_layout(symbol_table).methods_by_name
+        if method_identifier.name in methods_by_name:
+            return methods_by_name[method_identifier.name]
+        print(
+            f"Error. Method {method_identifier.name} not found in class {self.identifier.name}!"
+        )
 
     def __eq__(self, other):
         if isinstance(other, ClassDeclaration):
             return other.identifier.name == self.identifier.name
         return False
+
+
+@dataclass
+class InterfaceDeclaration(Declaration):
+    prototypes: List[FunctionDeclaration]
+
+    def find_method_declaration(
+        self, symbol_table: SymbolTable, method_identifier: Identifier
+    ) -> FunctionDeclaration:
+        for prototype in self.prototypes:
+            if prototype.identifier.name == method_identifier.name:
+                return prototype
+        print(
+            f"Error. Method {method_identifier.name} not found in interface {self.identifier.name}!"
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, InterfaceDeclaration):
+            return other.identifier.name == self.identifier.name
+        return False
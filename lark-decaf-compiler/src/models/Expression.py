@@ -3,28 +3,36 @@ from __future__ import annotations
 import math
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING, List, Union, Tuple, Optional
+from typing import TYPE_CHECKING, Callable, List, Union, Tuple, Optional, TypeVar
 
-from .Declaration import ClassDeclaration, FunctionDeclaration, VariableDeclaration
+from .Declaration import (
+    ClassDeclaration,
+    FunctionDeclaration,
+    InterfaceDeclaration,
+    VariableDeclaration,
+)
 from .Identifier import Identifier
 from .Node import Node
 from .Type import Type, PrimitiveTypes, NamedType, ArrayType
+from ..registers import MINIMUM_FREE_REGISTERS, is_double_register
 from ..standard_library_functions import STANDARD_LIBRARY_FUNCTIONS
 from ..utils import (
     calc_variable_size,
-    pop_to_temp,
-    push_to_stack,
-    pop_double_to_femp,
-    push_double_to_stack,
+    pop_register,
+    push_register,
     ARRAY_LENGTH_SIZE,
     THIS_ADDRESS,
-    DOUBLE_RETURN_REGISTER_NUMBER,
+    DOUBLE_RETURN_REGISTER,
+    RETURN_REGISTER,
 )
 
 if TYPE_CHECKING:
     from .SymbolTable import SymbolTable
+    from ..emitter import Emitter
     from typing import TYPE_CHECKING
 
+T = TypeVar("T")
+
 
 class Operator(Enum):
     MINUS = "-"
@@ -44,18 +52,228 @@ class Operator(Enum):
 
 
 """
-When we generate code for expressions, we push their result to stack.
-So if you have multiple expressions, first call generate_code on all of them, and then
-    start popping values from stack to access their results.
-Don't forget to pop expressions results after evaluating them.
+Expressions are evaluated into registers. generate_value emits the code of an expression and returns
+the register that holds its value. Whoever uses the value releases the register afterwards
+(symbol_table.registers.release). generate_code pushes the value to stack instead.
+Operands are evaluated in Sethi-Ullman order when that can not change the result, and values are
+only spilled to stack when there are not enough free registers for the rest of the evaluation.
 """
 
 
 @dataclass
 class Expression(Node):
+    # Filled by annotate_type. Not a dataclass field, so it stays out of __init__, __eq__ and __repr__.
+    expression_type = None
+    # Filled by register_need and has_side_effects, same as above.
+    needed_registers = None
+    side_effects = None
+
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.annotate_type(symbol_table)
+
+    def annotate_type(self, symbol_table: SymbolTable):
+        """
+        Computes the type of the expression and caches it on the node. Called by resolve_names
+        after the operands are resolved (and annotated), so every type is computed exactly once.
+        """
+        self.expression_type = self.compute_type(symbol_table)
+
     def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+        if self.expression_type is None:
+            self.annotate_type(symbol_table)
+        return self.expression_type
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         pass
 
+    def register_need(self) -> int:
+        """
+        Sethi-Ullman number of the expression: how many registers it needs to be evaluated without
+        spilling anything to stack.
+        """
+        if self.needed_registers is None:
+            self.needed_registers = self.compute_register_need()
+        return self.needed_registers
+
+    def compute_register_need(self) -> int:
+        return 1
+
+    def has_side_effects(self) -> bool:
+        """
+        Whether evaluating the expression can change the value of other expressions (or the input).
+        Only operands without side effects may be evaluated out of order.
+        """
+        if self.side_effects is None:
+            self.side_effects = self.compute_side_effects()
+        return self.side_effects
+
+    def compute_side_effects(self) -> bool:
+        return False
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        pass
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        register = self.generate_value(symbol_table, emitter)
+        emitter.emit_lines(push_register(register))
+        symbol_table.registers.release(register)
+
+    def generate_branch(
+        self, symbol_table: SymbolTable, emitter: Emitter, label: str, branch_if: bool
+    ):
+        """
+        Jumps to label if the (bool) value of the expression is branch_if and falls through otherwise.
+        No register is held at the jump, so conditions never need to materialize their value.
+        """
+        register = self.generate_value(symbol_table, emitter)
+        emitter.emit(f"\t{'bnez' if branch_if else 'beqz'} {register}, {label}")
+        symbol_table.registers.release(register)
+
+
+def combine_register_needs(first_need: int, second_need: int) -> int:
+    if first_need == second_need:
+        return first_need + 1
+    return max(first_need, second_need)
+
+
+def generate_while_holding(
+    symbol_table: SymbolTable,
+    emitter: Emitter,
+    held_register: str,
+    register_need: int,
+    generate: Callable[[], T],
+    has_side_effects: bool = False,
+) -> Tuple[str, T]:
+    """
+    Calls generate while the value in held_register is still needed. If generate may need more
+    registers than are free, the held value is spilled to stack meanwhile and loaded back afterwards,
+    maybe into another register. Returns the register holding the value and the result of generate.
+    """
+    registers = symbol_table.registers
+    if has_side_effects and not registers.is_temporary(held_register):
+        # generate may assign to the variable whose register we hold. Keep its current value.
+        copy_register = registers.allocate(is_double_register(held_register))
+        emitter.emit(f"\tmove {copy_register}, {held_register}")
+        held_register = copy_register
+    if register_need == 0 or registers.free_count() >= max(
+        register_need, MINIMUM_FREE_REGISTERS
+    ):
+        return held_register, generate()
+    emitter.emit_lines(push_register(held_register))
+    registers.release(held_register)
+    result = generate()
+    held_register = registers.allocate(is_double_register(held_register))
+    emitter.emit_lines(pop_register(held_register))
+    return held_register, result
+
+
+def generate_operands(
+    symbol_table: SymbolTable, emitter: Emitter, first: Expression, second: Expression
+) -> Tuple[str, str]:
+    """
+    Evaluates two operands and returns their registers in (first, second) order.
+    """
+    if second.register_need() > first.register_need() and not (
+        first.has_side_effects() or second.has_side_effects()
+    ):
+        # The operand that needs more registers goes first, so its registers are free again
+        # while the other one is evaluated.
+        second_register = second.generate_value(symbol_table, emitter)
+        second_register, first_register = generate_while_holding(
+            symbol_table,
+            emitter,
+            second_register,
+            first.register_need(),
+            lambda: first.generate_value(symbol_table, emitter),
+        )
+    else:
+        first_register = first.generate_value(symbol_table, emitter)
+        first_register, second_register = generate_while_holding(
+            symbol_table,
+            emitter,
+            first_register,
+            second.register_need(),
+            lambda: second.generate_value(symbol_table, emitter),
+            second.has_side_effects(),
+        )
+    return first_register, second_register
+
+
+def save_live_registers(symbol_table: SymbolTable, emitter: Emitter) -> List[str]:
+    """
+    Called functions may use any temporary register, so registers holding values are pushed to
+    stack before a call. Returns the saved registers for restore_live_registers.
+    """
+    live_registers = symbol_table.registers.live_registers()
+    for register in live_registers:
+        emitter.emit_lines(push_register(register))
+    return live_registers
+
+
+def restore_live_registers(emitter: Emitter, saved_registers: List[str]):
+    for register in reversed(saved_registers):
+        emitter.emit_lines(pop_register(register))
+
+
+def destination_register(symbol_table: SymbolTable, *operand_registers: str) -> str:
+    """
+    Register for the result of an operation. Expressions may read the registers of variables
+    but never write them, so the result goes to the first operand register that is a temporary,
+    or to a new one. The other operand registers are released.
+    """
+    registers = symbol_table.registers
+    destination = next(
+        (r for r in operand_registers if registers.is_temporary(r)), None
+    )
+    if destination is None:
+        destination = registers.allocate(is_double_register(operand_registers[0]))
+    for register in operand_registers:
+        if register != destination:
+            registers.release(register)
+    return destination
+
+
+INT_INSTRUCTIONS = {
+    Operator.ADDITION: "add",
+    Operator.MINUS: "sub",
+    Operator.MULTIPLICATION: "mul",
+    Operator.DIVISION: "div",
+    Operator.LTE: "sle",
+    Operator.LT: "slt",
+    Operator.GTE: "sge",
+    Operator.GT: "sgt",
+    Operator.EQUALS: "seq",
+    Operator.NOT_EQUALS: "sne",
+    Operator.AND: "and",
+    Operator.OR: "or",
+}
+DOUBLE_INSTRUCTIONS = {
+    Operator.ADDITION: "add.d",
+    Operator.MINUS: "sub.d",
+    Operator.MULTIPLICATION: "mul.d",
+    Operator.DIVISION: "div.d",
+}
+# Compare instruction, whether the operands are compared in reverse order and the branch that
+# skips clearing the result.
+DOUBLE_COMPARISONS = {
+    Operator.LT: ("c.lt.d", False, "bc1t"),
+    Operator.LTE: ("c.le.d", False, "bc1t"),
+    Operator.GT: ("c.lt.d", True, "bc1t"),
+    Operator.GTE: ("c.le.d", True, "bc1t"),
+    Operator.EQUALS: ("c.eq.d", False, "bc1t"),
+    Operator.NOT_EQUALS: ("c.eq.d", False, "bc1f"),
+}
+# Branches on the comparison of two int registers: (taken if true, taken if false).
+INT_BRANCHES = {
+    Operator.LT: ("blt", "bge"),
+    Operator.LTE: ("ble", "bgt"),
+    Operator.GT: ("bgt", "ble"),
+    Operator.GTE: ("bge", "blt"),
+    Operator.EQUALS: ("beq", "bne"),
+    Operator.NOT_EQUALS: ("bne", "beq"),
+}
+OPPOSITE_DOUBLE_BRANCHES = {"bc1t": "bc1f", "bc1f": "bc1t"}
+
 
 @dataclass
 class BinaryExpression(Expression):
@@ -63,7 +281,12 @@ class BinaryExpression(Expression):
     left_expression: Expression
     right_expression: Expression
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.left_expression.resolve_names(symbol_table)
+        self.right_expression.resolve_names(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         if self.operator in {
             Operator.AND,
             Operator.OR,
@@ -78,168 +301,137 @@ class BinaryExpression(Expression):
         else:
             return self.left_expression.evaluate_type(symbol_table)
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def compute_register_need(self) -> int:
+        if self.operator in (Operator.AND, Operator.OR):
+            # The operands are evaluated one after the other, see generate_branch.
+            return max(
+                self.left_expression.register_need(),
+                self.right_expression.register_need(),
+            )
+        return combine_register_needs(
+            self.left_expression.register_need(), self.right_expression.register_need()
+        )
+
+    def compute_side_effects(self) -> bool:
+        return (
+            self.left_expression.has_side_effects()
+            or self.right_expression.has_side_effects()
+        )
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        if self.operator in (Operator.AND, Operator.OR):
+            label_number = symbol_table.get_label()
+            false_label = f"__false__{label_number}"
+            end_label = f"__end_bool__{label_number}"
+            self.generate_branch(symbol_table, emitter, false_label, False)
+            register = symbol_table.registers.allocate()
+            emitter.emit_lines(
+                [
+                    f"\tli {register}, 1",
+                    f"\tj {end_label}",
+                    f"{false_label}:",
+                    f"\tli {register}, 0",
+                    f"{end_label}:",
+                ]
+            )
+            return register
         left_operand_type = self.left_expression.evaluate_type(symbol_table)
         right_operand_type = self.right_expression.evaluate_type(symbol_table)
         assert left_operand_type == right_operand_type
-        operand_type = left_operand_type
-        code = []
-        code += self.left_expression.generate_code(symbol_table)
-        code += self.right_expression.generate_code(symbol_table)
-        if self.operator == Operator.ADDITION:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("add $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("add.d $f4, $f2, $f0")
-                code += push_double_to_stack(4)
-        elif self.operator == Operator.MINUS:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("sub $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("sub.d $f4, $f2, $f0")
-                code += push_double_to_stack(4)
-        elif self.operator == Operator.MULTIPLICATION:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("mul $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("mul.d $f4, $f2, $f0")
-                code += push_double_to_stack(4)
-        elif self.operator == Operator.DIVISION:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("div $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("div.d $f4, $f2, $f0")
-                code += push_double_to_stack(4)
-        elif self.operator == Operator.MODULO:
-            code += pop_to_temp(0)
-            code += pop_to_temp(1)
-            code.append("div $t2,$t1,$t0")
-            code.append("mfhi $t2")
-            code += push_to_stack(2)
-        elif self.operator == Operator.LTE:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("sle $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.le.d $f2,$f0")
-                code.append(f"bc1f __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-        elif self.operator == Operator.LT:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("slt $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.lt.d $f2,$f0")
-                code.append(f"bc1f __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-        elif self.operator == Operator.GTE:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("sge $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.lt.d $f2,$f0")
-                code.append(f"bc1t __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-        elif self.operator == Operator.GT:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("sgt $t2,$t1,$t0")
-                code += push_to_stack(2)
-            else:
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.le.d $f2,$f0")
-                code.append(f"bc1t __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-        elif self.operator == Operator.AND:
-            code += pop_to_temp(0)
-            code += pop_to_temp(1)
-            code.append("and $t2,$t1,$t0")
-            code += push_to_stack(2)
-        elif self.operator == Operator.OR:
-            code += pop_to_temp(0)
-            code += pop_to_temp(1)
-            code.append("or $t2,$t1,$t0")
-            code += push_to_stack(2)
-        elif self.operator == Operator.EQUALS:  # TODO: String
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("seq $t2,$t1,$t0")
-                code += push_to_stack(2)
-            elif operand_type == "double":
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.eq.d $f2,$f0")
-                code.append(f"bc1f __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-            # else:
-        elif self.operator == Operator.NOT_EQUALS:  # TODO: String
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code += pop_to_temp(1)
-                code.append("sne $t2,$t1,$t0")
-                code += push_to_stack(2)
-            elif operand_type == "double":
-                counter = symbol_table.get_label()
-                code += pop_double_to_femp(0)
-                code += pop_double_to_femp(2)
-                code.append("c.eq.d $f2,$f0")
-                code.append(f"bc1t __double_le__{counter}")
-                code.append("li $t0, 1")
-                code.append(f"__double_le__{counter}:")
-                code += push_to_stack(0)
-            # else:
-
-        return code
+        left_register, right_register = generate_operands(
+            symbol_table, emitter, self.left_expression, self.right_expression
+        )
+        registers = symbol_table.registers
+        if left_operand_type == PrimitiveTypes.DOUBLE:
+            if self.operator in DOUBLE_INSTRUCTIONS:
+                result_register = destination_register(
+                    symbol_table, left_register, right_register
+                )
+                emitter.emit(
+                    f"\t{DOUBLE_INSTRUCTIONS[self.operator]} {result_register}, {left_register}, {right_register}"
+                )
+                return result_register
+            compare, reverse, branch = DOUBLE_COMPARISONS[self.operator]
+            first_register, second_register = left_register, right_register
+            if reverse:
+                first_register, second_register = right_register, left_register
+            result_register = registers.allocate()
+            label = f"__double_compare__{symbol_table.get_label()}"
+            emitter.emit_lines(
+                [
+                    f"\tli {result_register}, 1",
+                    f"\t{compare} {first_register}, {second_register}",
+                    f"\t{branch} {label}",
+                    f"\tli {result_register}, 0",
+                    f"{label}:",
+                ]
+            )
+            registers.release(left_register)
+            registers.release(right_register)
+            return result_register
+        result_register = destination_register(
+            symbol_table, left_register, right_register
+        )
+        if self.operator == Operator.MODULO:
+            emitter.emit(f"\tdiv {result_register}, {left_register}, {right_register}")
+            emitter.emit(f"\tmfhi {result_register}")
+        else:
+            # TODO: String equality compares the pointers.
+            emitter.emit(
+                f"\t{INT_INSTRUCTIONS[self.operator]} {result_register}, {left_register}, {right_register}"
+            )
+        return result_register
+
+    def generate_branch(
+        self, symbol_table: SymbolTable, emitter: Emitter, label: str, branch_if: bool
+    ):
+        if self.operator in INT_BRANCHES:
+            self.generate_comparison_branch(symbol_table, emitter, label, branch_if)
+            return
+        if self.operator not in (Operator.AND, Operator.OR):
+            return super().generate_branch(symbol_table, emitter, label, branch_if)
+        # The right operand is only evaluated if the left one does not decide the value:
+        # when it is false for &&, and when it is true for ||.
+        deciding_value = self.operator == Operator.OR
+        if branch_if == deciding_value:
+            self.left_expression.generate_branch(
+                symbol_table, emitter, label, deciding_value
+            )
+            self.right_expression.generate_branch(
+                symbol_table, emitter, label, deciding_value
+            )
+            return
+        skip_label = f"__short_circuit__{symbol_table.get_label()}"
+        self.left_expression.generate_branch(
+            symbol_table, emitter, skip_label, deciding_value
+        )
+        self.right_expression.generate_branch(symbol_table, emitter, label, branch_if)
+        emitter.emit(f"{skip_label}:")
+
+    def generate_comparison_branch(
+        self, symbol_table: SymbolTable, emitter: Emitter, label: str, branch_if: bool
+    ):
+        """
+        Compares the operands and branches on the result, without computing it as a value.
+        """
+        operand_type = self.left_expression.evaluate_type(symbol_table)
+        left_register, right_register = generate_operands(
+            symbol_table, emitter, self.left_expression, self.right_expression
+        )
+        if operand_type == PrimitiveTypes.DOUBLE:
+            compare, reverse, branch = DOUBLE_COMPARISONS[self.operator]
+            first_register, second_register = left_register, right_register
+            if reverse:
+                first_register, second_register = right_register, left_register
+            if not branch_if:
+                branch = OPPOSITE_DOUBLE_BRANCHES[branch]
+            emitter.emit(f"\t{compare} {first_register}, {second_register}")
+            emitter.emit(f"\t{branch} {label}")
+        else:
+            branch = INT_BRANCHES[self.operator][0 if branch_if else 1]
+            emitter.emit(f"\t{branch} {left_register}, {right_register}, {label}")
+        symbol_table.registers.release(left_register)
+        symbol_table.registers.release(right_register)
 
 
 @dataclass
@@ -247,83 +439,131 @@ class UnaryExpression(Expression):
     operator: Operator
     expression: Expression
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.expression.resolve_names(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         if self.operator == Operator.MINUS:
             return self.expression.evaluate_type(symbol_table)
         elif self.operator == Operator.NOT:
             return Type(PrimitiveTypes.BOOL.value)
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = self.expression.generate_code(symbol_table)
-        operand_type = self.expression.evaluate_type(symbol_table)
+    def compute_register_need(self) -> int:
+        return self.expression.register_need()
+
+    def compute_side_effects(self) -> bool:
+        return self.expression.has_side_effects()
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        operand_register = self.expression.generate_value(symbol_table, emitter)
+        register = destination_register(symbol_table, operand_register)
         if self.operator == Operator.MINUS:
-            if operand_type == "int":
-                code += pop_to_temp(0)
-                code.append("addi $t1, $zero, -1")
-                code.append("mul $t2,$t0,$t1")
-                code += push_to_stack(2)
+            if is_double_register(register):
+                emitter.emit(f"\tneg.d {register}, {operand_register}")
             else:
-                code += pop_double_to_femp(0)
-                code.append("addi $f2, $zero, -1")
-                code.append("mul.d $f4, $f2, $f0")
-                code += push_double_to_stack(4)
+                emitter.emit(f"\tnegu {register}, {operand_register}")
         elif self.operator == Operator.NOT:
-            code += pop_to_temp(0)
-            code.append("nor $t0, $t0, $t0")
-            code += push_to_stack(0)
-        return code
+            # Booleans are 0 or 1.
+            emitter.emit(f"\txori {register}, {operand_register}, 1")
+        return register
+
+    def generate_branch(
+        self, symbol_table: SymbolTable, emitter: Emitter, label: str, branch_if: bool
+    ):
+        if self.operator == Operator.NOT:
+            self.expression.generate_branch(symbol_table, emitter, label, not branch_if)
+        else:
+            super().generate_branch(symbol_table, emitter, label, branch_if)
 
 
 @dataclass
 class ThisExpression(Expression):
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = [
-            "\t# Code for 'this' expression",
-            f"\tsubu $sp,$sp,4\t# Make space for 'this' pointer",
-            f"\tlw $t0,{THIS_ADDRESS}\t# Copy 'this' pointer pointer to $t0",
-            f"\tsw $t0,4($sp)\t# Copy 'this' pointer pointer to stack",
-            "\t# End of code for 'this' expression",
-        ]
-        return code
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        register = symbol_table.registers.allocate()
+        emitter.emit(
+            f"\tlw {register}, {THIS_ADDRESS}\t# Copy 'this' pointer to {register}"
+        )
+        return register
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         class_decl = symbol_table.get_current_scope().find_which_class_we_are_in()
         return NamedType(class_decl.identifier)
 
 
+def generate_read(
+    symbol_table: SymbolTable, emitter: Emitter, function_label: str
+) -> str:
+    saved_registers = save_live_registers(symbol_table, emitter)
+    emitter.emit(f"\tjal {function_label}")
+    restore_live_registers(emitter, saved_registers)
+    register = symbol_table.registers.allocate()
+    emitter.emit(f"\tmove {register}, {RETURN_REGISTER}")
+    return register
+
+
 @dataclass
 class ReadInteger(Expression):
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = [f"\tjal _ReadInteger"]
-        code += [
-            f"\tsubu $sp,$sp,4\t# Make space for Integer.",
-            f"\tsw $v0,4($sp)\t# Copy Integer to stack.",
-        ]
-        return code
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        return generate_read(symbol_table, emitter, "_ReadInteger")
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_side_effects(self) -> bool:
+        return True
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return Type(PrimitiveTypes.INT.value)
 
 
 @dataclass
 class ReadLine(Expression):
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = [f"\tjal _ReadLine"]
-        code += [
-            f"\tsubu $sp,$sp,4\t# Make space for string pointer.",
-            f"\tsw $v0,4($sp)\t# Copy string pointer to stack.",
-        ]
-        return code
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        return generate_read(symbol_table, emitter, "_ReadLine")
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_side_effects(self) -> bool:
+        return True
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return Type(PrimitiveTypes.STRING.value)
 
 
 @dataclass
 class LValue(Expression):
-    def calculate_address(self, symbol_table: SymbolTable) -> Tuple[List[str], str]:
+    def calculate_address(
+        self, symbol_table: SymbolTable, emitter: Emitter
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Emits the code that computes the address of the l-value. Returns the address operand and the
+        register it is relative to, if one was allocated for it. The caller releases that register.
+        """
         pass
 
+    def address_register_need(self) -> int:
+        """
+        Registers needed to calculate the address. 0 if it is relative to $fp or $gp.
+        """
+        return 1
+
+    def variable_register(self) -> Optional[str]:
+        """
+        Register the l-value lives in, if it is a variable that was given one.
+        """
+        return None
+
+    def compute_register_need(self) -> int:
+        return max(self.address_register_need(), 1)
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        address, address_register = self.calculate_address(symbol_table, emitter)
+        if self.evaluate_type(symbol_table) == PrimitiveTypes.DOUBLE:
+            register = symbol_table.registers.allocate(is_double=True)
+            emitter.emit(f"\tl.d {register}, {address}\t# Load value from {address}")
+            if address_register is not None:
+                symbol_table.registers.release(address_register)
+            return register
+        register = address_register or symbol_table.registers.allocate()
+        emitter.emit(f"\tlw {register}, {address}\t# Load value from {address}")
+        return register
+
 
 OFFSET_TO_FIRST_LOCAL = -8
 OFFSET_TO_FIRST_PARAM = 4
@@ -334,66 +574,81 @@ OFFSET_TO_FIRST_GLOBAL = 0
 class IdentifierLValue(LValue):
     identifier: Identifier
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = [f"\t# Code for identifier {self.identifier.name}"]
-        address_calculation_code, address = self.calculate_address(symbol_table)
-        code += address_calculation_code
-        if self.evaluate_type(symbol_table) == PrimitiveTypes.DOUBLE:
-            code.append(f"\tl.d $f0, {address}\t# Load value from {address} to $f0")
-            code += push_double_to_stack(0)
-        else:
-            code.append(f"\tlw $t0, {address}\t# Load value from {address} to $t0")
-            code += push_to_stack(0)
-        code.append(
-            f"\t# End of code for identifier {self.identifier.name}. Identifier value is on top of stack now."
-        )
-        return code
-
-    def calculate_address(self, symbol_table: SymbolTable) -> Tuple[List[str], str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.identifier.resolve(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def address_register_need(self) -> int:
+        decl = self.identifier.declaration
+        if decl is not None and not decl.is_class_member:
+            return 0
+        return 1
+
+    def variable_register(self) -> Optional[str]:
+        decl = self.identifier.declaration
+        if isinstance(decl, VariableDeclaration):
+            return decl.register
+        return None
+
+    def compute_register_need(self) -> int:
+        if self.variable_register() is not None:
+            # Read in place.
+            return 0
+        return super().compute_register_need()
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        register = self.variable_register()
+        if register is not None:
+            return register
+        return super().generate_value(symbol_table, emitter)
+
+    def calculate_address(
+        self, symbol_table: SymbolTable, emitter: Emitter
+    ) -> Tuple[str, Optional[str]]:
         """
         In a MIPS stack frame, first local is at fp-8, subsequent locals are at fp-12, fp-16, and so on.
-        The first param is at fp+4, subsequent ones as fp+8, fp+12, etc. (Because methods have secret
+        The first param is at fp+8, subsequent ones as fp+12, fp+16, etc. (Because methods have secret
         "this" passed in first param slot at fp+4, all normal params are shifted up by 4.)
         """
-        code = []
         decl = self.identifier.find_declaration(symbol_table)
         assert isinstance(decl, VariableDeclaration)
-        # To load and save double, pointer must point to the end of double.
-        double_offset = 0
-        if decl.variable_type == PrimitiveTypes.DOUBLE:
-            double_offset = 8
         if decl.is_class_member:
             # Class members only accessible in class methods. They're protected.
-            return calculate_member_address(decl.class_member_offset - double_offset)
-        elif decl.is_function_parameter:
+            return calculate_member_address(
+                symbol_table, emitter, decl.class_member_offset
+            )
+        # Offsets of stack slots and globals point to their last 4 bytes. A double starts 4 bytes lower.
+        double_offset = 0
+        if decl.variable_type == PrimitiveTypes.DOUBLE:
+            double_offset = 4
+        if decl.is_function_parameter:
             return (
-                code,
                 f"{OFFSET_TO_FIRST_PARAM + decl.function_parameter_offset + calc_variable_size(decl.variable_type) - double_offset}($fp)",
+                None,
             )
         elif decl.is_global:
             return (
-                code,
                 f"{OFFSET_TO_FIRST_GLOBAL - decl.global_offset - double_offset}($gp)",
+                None,
             )
         else:
             return (
-                code,
                 f"{OFFSET_TO_FIRST_LOCAL - decl.local_offset - double_offset}($fp)",
+                None,
             )
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return self.identifier.evaluate_type(symbol_table)
 
 
-def calculate_member_address(member_offset: int) -> Tuple[List[str], str]:
-    code = [
-        "\t# Code for class member address calculation:",
-        f"\tlw $t0, {THIS_ADDRESS}\t# Load 'this' address to $t0.",
-        f"\taddi $t0, $t0, {member_offset}\t# Extra {member_offset} bytes for member offset.",
-        "\tmove $t1, $t0\t# Copy member address to $t1.",
-        "\t# End of code for class member address calculation. Member address is in $t1 now.",
-    ]
-    return code, "0($t1)"
+def calculate_member_address(
+    symbol_table: SymbolTable, emitter: Emitter, member_offset: int
+) -> Tuple[str, str]:
+    register = symbol_table.registers.allocate()
+    emitter.emit(
+        f"\tlw {register}, {THIS_ADDRESS}\t# Load 'this' address to {register}."
+    )
+    return f"{member_offset}({register})", register
 
 
 @dataclass
@@ -401,47 +656,36 @@ class MemberAccessLValue(LValue):
     expression: Expression
     identifier: Identifier
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.expression.resolve_names(symbol_table)
+        self.identifier.declaration = symbol_table.get_current_scope().lookup_in_class_members(
+            symbol_table, self.identifier
+        )
+        self.annotate_type(symbol_table)
+
+    def calculate_address(
+        self, symbol_table: SymbolTable, emitter: Emitter
+    ) -> Tuple[str, Optional[str]]:
         # Only way to access members. We cant use them outside of the object.
         assert isinstance(self.expression, ThisExpression)
         var_decl = self.find_declaration(symbol_table)
-        code = ["\t# Code for class member access:"]
-        address_calculation_code, address = calculate_member_address(
-            var_decl.class_member_offset
-        )
-        code += address_calculation_code
-        if var_decl.variable_type == PrimitiveTypes.DOUBLE:
-            code.append(f"\tl.d $f0, {address}\t# Load value from {address} to $f0.")
-            code += push_double_to_stack(0)
-        else:
-            code.append(f"\tlw $t0, {address}\t# Load value from {address} to $t0.")
-            code += push_to_stack(0)
-        code.append(
-            "\t# End of code for class member access. Member value is on top of stack now."
+        return calculate_member_address(
+            symbol_table, emitter, var_decl.class_member_offset
         )
-        return code
-
-    def calculate_address(self, symbol_table: SymbolTable) -> Tuple[List[str], str]:
-        var_decl = self.find_declaration(symbol_table)
-        return calculate_member_address(var_decl.class_member_offset)
 
     def find_declaration(self, symbol_table: SymbolTable) -> VariableDeclaration:
-        var_decl = symbol_table.get_current_scope().lookup_in_class_members(
-            symbol_table, self.identifier
-        )
+        var_decl = self.identifier.declaration
+        if var_decl is None:
+            var_decl = symbol_table.get_current_scope().lookup_in_class_members(
+                symbol_table, self.identifier
+            )
         assert isinstance(var_decl, VariableDeclaration)
         return var_decl
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         # Based on language description, object members are protected.
         assert isinstance(self.expression, ThisExpression)
-        class_type = self.expression.evaluate_type(symbol_table)
-        assert isinstance(class_type, NamedType)
-        class_decl = symbol_table.get_global_scope().lookup(class_type.name)
-        assert isinstance(class_decl, ClassDeclaration)
-        return class_decl.find_variable_declaration(
-            symbol_table, self.identifier
-        ).variable_type
+        return self.find_declaration(symbol_table).variable_type
 
 
 @dataclass
@@ -449,44 +693,47 @@ class ArrayAccessLValue(LValue):
     array_expression: Expression
     index_expression: Expression
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.array_expression.resolve_names(symbol_table)
+        self.index_expression.resolve_names(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         array_type = self.array_expression.evaluate_type(symbol_table)
         assert isinstance(array_type, ArrayType)
         return array_type.element_type
 
-    def calculate_address(self, symbol_table: SymbolTable) -> Tuple[List[str], str]:
-        array_type = self.array_expression.evaluate_type(symbol_table)
-        assert isinstance(array_type, ArrayType)
-        array_element_size = calc_variable_size(array_type.element_type)
-        code = ["\t# Code for array access"]
-        code += self.array_expression.generate_code(
-            symbol_table
-        )  # pushes array address
-        code += self.index_expression.generate_code(symbol_table)  # pushes index
-        code += pop_to_temp(1)  # index at $t0
-        code += pop_to_temp(0)  # array address at $t0
-        code.append(f"\tsll $t1,$t1,{int(math.sqrt(array_element_size))}")
-        code.append(
-            f"\taddi $t1, $t1, {ARRAY_LENGTH_SIZE}\t# Extra {ARRAY_LENGTH_SIZE} bytes for length of array"
+    def address_register_need(self) -> int:
+        return combine_register_needs(
+            self.array_expression.register_need(), self.index_expression.register_need()
+        )
+
+    def compute_side_effects(self) -> bool:
+        return (
+            self.array_expression.has_side_effects()
+            or self.index_expression.has_side_effects()
         )
-        code.append("\taddu $t2,$t1,$t0\t# Address of element is now in $t2")
-        code.append("\t# End of code for array access")
-        return code, "0($t2)"
 
-    def generate_code(self, symbol_table: SymbolTable):
+    def calculate_address(
+        self, symbol_table: SymbolTable, emitter: Emitter
+    ) -> Tuple[str, Optional[str]]:
         array_type = self.array_expression.evaluate_type(symbol_table)
         assert isinstance(array_type, ArrayType)
-        code = ["\t# Code for array access + use"]
-        access_code, access_address = self.calculate_address(symbol_table)
-        code += access_code
-        if array_type.element_type == "int":
-            code.append(f"\tlw $t0, {access_address}")
-            code += push_to_stack(0)
-        elif array_type.element_type == "double":
-            code.append(f"\tl.d $f0, {access_address}")
-            code += push_double_to_stack(0)
-        code.append("\t# End of code for array access + use")
-        return code
+        array_element_size = calc_variable_size(array_type.element_type)
+        array_register, index_register = generate_operands(
+            symbol_table, emitter, self.array_expression, self.index_expression
+        )
+        offset_register = destination_register(symbol_table, index_register)
+        emitter.emit(
+            f"\tsll {offset_register}, {index_register}, {int(math.log2(array_element_size))}"
+        )
+        address_register = destination_register(
+            symbol_table, array_register, offset_register
+        )
+        emitter.emit(
+            f"\taddu {address_register}, {array_register}, {offset_register}\t# Elements start after the {ARRAY_LENGTH_SIZE} bytes of array length"
+        )
+        return f"{ARRAY_LENGTH_SIZE}({address_register})", address_register
 
 
 @dataclass
@@ -494,32 +741,58 @@ class Assignment(Expression):
     l_value: LValue
     expression: Expression
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.expression.resolve_names(symbol_table)
+        self.l_value.resolve_names(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return self.expression.evaluate_type(symbol_table)
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = self.expression.generate_code(symbol_table)
-        # We do not generate_code for l_value. We only need address.
-        if self.expression.evaluate_type(symbol_table) == "double":
-            l_value_code, l_value_address = self.l_value.calculate_address(symbol_table)
-            code += l_value_code
-            code += pop_double_to_femp(0)  # Expression result
-            code.append(f"\ts.d $f0, {l_value_address}\t# assignment")
-            # Push expression result to stack
-            code += push_double_to_stack(0)
+    def compute_register_need(self) -> int:
+        address_need = self.l_value.address_register_need()
+        if address_need == 0:
+            return self.expression.register_need()
+        return combine_register_needs(self.expression.register_need(), address_need)
+
+    def compute_side_effects(self) -> bool:
+        return True
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
+        value_register = self.expression.generate_value(symbol_table, emitter)
+        variable_register = self.l_value.variable_register()
+        if variable_register is not None:
+            if variable_register != value_register:
+                emitter.emit(
+                    f"\tmove {variable_register}, {value_register}\t# assignment"
+                )
+            return value_register
+        # We do not generate_value for l_value. We only need address.
+        value_register, (address, address_register) = generate_while_holding(
+            symbol_table,
+            emitter,
+            value_register,
+            self.l_value.address_register_need(),
+            lambda: self.l_value.calculate_address(symbol_table, emitter),
+            self.l_value.has_side_effects(),
+        )
+        if is_double_register(value_register):
+            emitter.emit(f"\ts.d {value_register}, {address}\t# assignment")
         else:
-            l_value_code, l_value_address = self.l_value.calculate_address(symbol_table)
-            code += l_value_code
-            code += pop_to_temp(0)  # expression result
-            code.append(f"\tsw $t0, {l_value_address}\t# assignment")
-            # Push expression result to stack
-            code += push_to_stack(0)
-        return code
+            emitter.emit(f"\tsw {value_register}, {address}\t# assignment")
+        if address_register is not None:
+            symbol_table.registers.release(address_register)
+        return value_register
 
 
 @dataclass
 class Call(Expression):
-    pass
+    def compute_register_need(self) -> int:
+        # Parameters are evaluated and pushed one at a time.
+        return max([1] + [p.register_need() for p in self.actual_parameters])
+
+    def compute_side_effects(self) -> bool:
+        return True
 
 
 @dataclass
@@ -527,18 +800,32 @@ class FunctionCall(Call):
     function_identifier: Identifier
     actual_parameters: List[Expression]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        for parameter in self.actual_parameters:
+            parameter.resolve_names(symbol_table)
+        self.function_identifier.resolve(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
         function_decl = self._find_function_decl(symbol_table)
         if function_decl.is_method:
             # For when we call object method without this.
             return generate_call(
-                symbol_table, function_decl, self.actual_parameters, is_method=True
+                symbol_table,
+                emitter,
+                function_decl,
+                self.actual_parameters,
+                is_method=True,
             )
         return generate_call(
-            symbol_table, function_decl, self.actual_parameters, is_method=False
+            symbol_table,
+            emitter,
+            function_decl,
+            self.actual_parameters,
+            is_method=False,
         )
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return self._find_function_decl(symbol_table).return_type
 
     def _find_function_decl(self, symbol_table: SymbolTable) -> FunctionDeclaration:
@@ -549,49 +836,64 @@ class FunctionCall(Call):
 
 def generate_call(
     symbol_table: SymbolTable,
+    emitter: Emitter,
     function_decl: FunctionDeclaration,
     actual_parameters: List[Expression],
     is_method: bool = False,
     class_expression: Optional[Expression] = None,
-):
-    code = [f"\t# Code for {'method' if is_method else 'function'} call."]
+) -> str:
+    emitter.emit(f"\t# Code for {'method' if is_method else 'function'} call.")
+    registers = symbol_table.registers
     return_type = function_decl.return_type
-    return_size = calc_variable_size(return_type)
     function_label = function_decl.label
+    saved_registers = save_live_registers(symbol_table, emitter)
     parameter_bytes = 0
     for parameter in actual_parameters:
         parameter_bytes += calc_variable_size(parameter.evaluate_type(symbol_table))
     for parameter in reversed(actual_parameters):
-        code += parameter.generate_code(symbol_table)
+        parameter.generate_code(symbol_table, emitter)
     if not is_method:
         if function_decl not in STANDARD_LIBRARY_FUNCTIONS:  # No this for standards.
-            code += [f"\tsubu $sp, $sp, 4\t# Make space for 'this'. It won't be used."]
-    elif is_method and class_expression is not None:
-        code += class_expression.generate_code(symbol_table)
-    elif is_method:
-        # When we call object method without this. We add it implicitly.
-        code += ThisExpression().generate_code(symbol_table)
-    code += [f"\tjal {function_label}"]
+            emitter.emit(
+                f"\tsubu $sp, $sp, 4\t# Make space for 'this'. It won't be used."
+            )
+        emitter.emit(f"\tjal {function_label}")
+    else:
+        if class_expression is None:
+            # When we call object method without this. We add it implicitly.
+            class_expression = ThisExpression()
+        object_register = class_expression.generate_value(symbol_table, emitter)
+        # Dynamic dispatch through the vtable of the object.
+        emitter.emit_lines(push_register(object_register))
+        method_register = destination_register(symbol_table, object_register)
+        emitter.emit_lines(
+            [
+                f"\tlw {method_register}, 0({object_register})\t# Load vtable pointer to {method_register}.",
+                f"\tlw {method_register}, {function_decl.vtable_offset}({method_register})\t# Load address of {function_decl.identifier.name} to {method_register}.",
+                f"\tjalr {method_register}",
+            ]
+        )
+        registers.release(method_register)
     if function_decl not in STANDARD_LIBRARY_FUNCTIONS:  # No this for standards.
-        code.append(
+        emitter.emit(
             f"\taddiu $sp, $sp, {parameter_bytes + 4}\t# Cleanse stack of function parameters."
         )
     else:
         # Did not push this for standards.
-        code.append(
+        emitter.emit(
             f"\taddiu $sp, $sp, {parameter_bytes}\t# Cleanse stack of function parameters."
         )
+    restore_live_registers(emitter, saved_registers)
     # Return value is in $v0 for non double return types. For double it's in $f0.
     if return_type == PrimitiveTypes.DOUBLE:
-        code += push_double_to_stack(DOUBLE_RETURN_REGISTER_NUMBER)
+        result_register = registers.allocate(is_double=True)
+        emitter.emit(f"\tmov.d {result_register}, {DOUBLE_RETURN_REGISTER}")
     else:
         # Warning: We do this even for void functions.
-        code += [
-            f"\tsubu $sp, $sp, {return_size}\t# Make space for function return value.",
-            f"\tsw $v0, {return_size}($sp)\t# Copy return value to stack.",
-        ]
-    code.append(f"\t# End of Code for {'method' if is_method else 'function'} call.")
-    return code
+        result_register = registers.allocate()
+        emitter.emit(f"\tmove {result_register}, {RETURN_REGISTER}")
+    emitter.emit(f"\t# End of Code for {'method' if is_method else 'function'} call.")
+    return result_register
 
 
 @dataclass
@@ -600,49 +902,69 @@ class MethodCall(Call):
     method_identifier: Identifier
     actual_parameters: List[Expression]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = []
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.class_expression.resolve_names(symbol_table)
+        for parameter in self.actual_parameters:
+            parameter.resolve_names(symbol_table)
+        if not self.class_expression.evaluate_type(symbol_table).is_array():
+            self.method_identifier.declaration = self._find_method_decl(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_register_need(self) -> int:
+        return max(
+            self.class_expression.register_need(), super().compute_register_need()
+        )
+
+    def compute_side_effects(self) -> bool:
+        if (
+            self.method_identifier.name == "length"
+            and self.method_identifier.declaration is None
+        ):
+            # Length of array.
+            return self.class_expression.has_side_effects()
+        return True
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
         left_type = self.class_expression.evaluate_type(symbol_table)
         if left_type.is_array():
             assert self.method_identifier.name == "length"
-            array_expression = self.class_expression
-            code += array_expression.generate_code(
-                symbol_table
-            )  # array pointer in stack now
-            code += pop_to_temp(0)  # array pointer in stack now
-            code += ["\tlw $t1, 0($t0)\t# Move array length to $t1"]
-            code += push_to_stack(1)
-            return code
+            array_register = self.class_expression.generate_value(symbol_table, emitter)
+            register = destination_register(symbol_table, array_register)
+            emitter.emit(f"\tlw {register}, 0({array_register})\t# Load array length")
+            return register
         method_decl = self._find_method_decl(symbol_table)
-        call_code = generate_call(
+        return generate_call(
             symbol_table,
+            emitter,
             method_decl,
             self.actual_parameters,
             is_method=True,
             class_expression=self.class_expression,
         )
-        code += call_code
-        return code
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         left_type = self.class_expression.evaluate_type(symbol_table)
         if left_type.is_array():
             assert self.method_identifier.name == "length"
             return Type(PrimitiveTypes.INT.value)
         return self._find_method_decl(symbol_table).return_type
 
-    def _find_class_decl(self, symbol_table: SymbolTable) -> ClassDeclaration:
+    def _find_class_decl(
+        self, symbol_table: SymbolTable
+    ) -> Union[ClassDeclaration, InterfaceDeclaration]:
         class_type = self.class_expression.evaluate_type(symbol_table)
         assert isinstance(class_type, NamedType)
         class_decl = symbol_table.get_global_scope().lookup(class_type.name)
-        assert isinstance(class_decl, ClassDeclaration)
+        assert isinstance(class_decl, (ClassDeclaration, InterfaceDeclaration))
         return class_decl
 
     def _find_method_decl(self, symbol_table: SymbolTable) -> FunctionDeclaration:
-        class_decl = self._find_class_decl(symbol_table)
-        method_decl = class_decl.find_method_declaration(
-            symbol_table, self.method_identifier
-        )
+        method_decl = self.method_identifier.declaration
+        if method_decl is None:
+            class_decl = self._find_class_decl(symbol_table)
+            method_decl = class_decl.find_method_declaration(
+                symbol_table, self.method_identifier
+            )
         assert isinstance(method_decl, FunctionDeclaration)
         return method_decl
 
@@ -651,22 +973,31 @@ class MethodCall(Call):
 class InitiateClass(Expression):
     class_identifier: Identifier
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.class_identifier.resolve(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
         class_decl = self.class_identifier.find_declaration(symbol_table)
         assert isinstance(class_decl, ClassDeclaration)
         object_size = class_decl.calculate_size(symbol_table)
-        code = [f"\t# Code for object of type {self.class_identifier.name} initiation:"]
-        code += [
-            f"\tli $a0, {object_size}\t# Load object size to $a0.",
-            "\tli $v0, 9\t# rsbrk.",
-            "\tsyscall\t# Object pointer is now in $v0.",
-            "\tsub $sp, $sp, 4\t# Make space for object pointer.",
-            "\tsw $v0, 4($sp)\t# Save object pointer to stack.",
-            f"\t# End of code for object of type {self.class_identifier.name} initiation. Object pointer is now on top of stack.",
-        ]
-        return code
+        register = symbol_table.registers.allocate()
+        emitter.emit(
+            f"\t# Code for object of type {self.class_identifier.name} initiation:"
+        )
+        emitter.emit_lines(
+            [
+                f"\tli $a0, {object_size}\t# Load object size to $a0.",
+                "\tli $v0, 9\t# rsbrk.",
+                "\tsyscall\t# Object pointer is now in $v0.",
+                f"\tla {register}, {class_decl.vtable_label}\t# Load vtable address to {register}.",
+                f"\tsw {register}, 0($v0)\t# Store vtable pointer at the start of the object.",
+                f"\tmove {register}, $v0\t# Copy object pointer to {register}.",
+            ]
+        )
+        return register
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return NamedType(self.class_identifier)
 
 
@@ -675,25 +1006,33 @@ class InitiateArray(Expression):
     length_expression: Expression
     element_type: Type
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.length_expression.resolve_names(symbol_table)
+        self.annotate_type(symbol_table)
+
+    def compute_register_need(self) -> int:
+        return self.length_expression.register_need()
+
+    def compute_side_effects(self) -> bool:
+        return self.length_expression.has_side_effects()
+
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
         type_size = calc_variable_size(self.element_type)
-        code = []
-        code += self.length_expression.generate_code(symbol_table)
-        code += pop_to_temp(0)  # now array size is in t0
-        code += [
-            "\tmove $a0, $t0\t# Move array length to $a0",
-            f"\tsll $a0, $a0, {int(math.sqrt(type_size))}\t# Size of array",
-            f"\taddi $a0, $a0, {ARRAY_LENGTH_SIZE}\t# Extra {ARRAY_LENGTH_SIZE} bytes for length of array",
-            "\tli $v0, 9\t# rsbrk",
-            "\tsyscall",
-            "\tsw $t0 0($v0)\t# Copy array length to the start of array",
-            # "\taddi $v0, $v0, 4\t# move array pointer after length",
-            "\tsub $sp, $sp, 4\t# Make space for array pointer",
-            "\tsw $v0, 4($sp)\t# Save array pointer to stack",
-        ]
-        return code
+        length_register = self.length_expression.generate_value(symbol_table, emitter)
+        emitter.emit_lines(
+            [
+                f"\tsll $a0, {length_register}, {int(math.log2(type_size))}\t# Size of array",
+                f"\taddi $a0, $a0, {ARRAY_LENGTH_SIZE}\t# Extra {ARRAY_LENGTH_SIZE} bytes for length of array",
+                "\tli $v0, 9\t# rsbrk",
+                "\tsyscall",
+                f"\tsw {length_register}, 0($v0)\t# Copy array length to the start of array",
+            ]
+        )
+        register = destination_register(symbol_table, length_register)
+        emitter.emit(f"\tmove {register}, $v0\t# Copy array pointer to {register}")
+        return register
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return ArrayType(self.element_type)
 
 
@@ -702,48 +1041,47 @@ class Constant(Expression):
     constant_type: Type
     value: Union[bool, str, int, float]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        size = calc_variable_size(self.constant_type)
-        code = [
-            f"\t# Code for constant {self.value}",
-            f"\tsubu $sp, $sp, {size}\t# decrement sp to make space for constant {self.value}",
-        ]
+    def generate_value(self, symbol_table: SymbolTable, emitter: Emitter) -> str:
         if self.constant_type == PrimitiveTypes.DOUBLE:
+            register = symbol_table.registers.allocate(is_double=True)
             self.value = self.value.lower()
             if self.value[-1] == ".":
                 self.value += "0"
             if ".e" in self.value:
                 index = self.value.find(".e") + 1
                 self.value = self.value[:index] + "0" + self.value[index:]
-            code += [
-                f"\tli.d $f0, {self.value}\t# load constant value to $f12",
-                f"\ts.d $f0, 0($sp)\t# load constant value from $f12 to 0($sp)",
-            ]
-        elif self.constant_type == PrimitiveTypes.BOOL:
-            code += [
-                f"\tli $t0, {1 if self.value == 'true' else 0}\t# load constant value to $t0",
-                f"\tsw $t0, {size}($sp)\t# load constant value from $t0 to {size}($sp)",
-            ]
+            emitter.emit(f"\tli.d {register}, {self.value}\t# load constant value")
+            return register
+        register = symbol_table.registers.allocate()
+        if self.constant_type == PrimitiveTypes.BOOL:
+            emitter.emit(
+                f"\tli {register}, {1 if self.value == 'true' else 0}\t# load constant value {self.value}"
+            )
         elif self.constant_type == PrimitiveTypes.STRING:
             name = f"str_{symbol_table.get_string_cost_count()}"
-            code += [
-                "\t.data",
-                f"{name}:",
-                f"\t.asciiz {self.value}",
-                ".text",
-                f"\tla $t0, {name}\t# Load address",
-                f"\tsw $t0, {size}($sp)\t# Load address from $t0 to {size}($sp)",
-            ]
+            emitter.emit_lines(
+                [
+                    "\t.data",
+                    f"{name}:",
+                    f"\t.asciiz {self.value}",
+                    ".text",
+                    f"\tla {register}, {name}\t# Load address",
+                ]
+            )
         elif self.constant_type == PrimitiveTypes.NULL:
-            # Do nothing. Right?
-            code += []
+            emitter.emit(f"\tli {register}, 0\t# load null")
         else:
-            code += [
-                f"\tli $t0, {self.value}\t# load constant value to $t0",
-                f"\tsw $t0, {size}($sp)\t# load constant value from $to to {size}($sp)",
-            ]
-        code.append(f"\t# End of code for constant {self.value}")
-        return code
+            emitter.emit(f"\tli {register}, {self.value}\t# load constant value")
+        return register
+
+    def generate_branch(
+        self, symbol_table: SymbolTable, emitter: Emitter, label: str, branch_if: bool
+    ):
+        if self.constant_type == PrimitiveTypes.BOOL:
+            if (self.value == "true") == branch_if:
+                emitter.emit(f"\tj {label}")
+        else:
+            super().generate_branch(symbol_table, emitter, label, branch_if)
 
-    def evaluate_type(self, symbol_table: SymbolTable) -> Type:
+    def compute_type(self, symbol_table: SymbolTable) -> Type:
         return self.constant_type
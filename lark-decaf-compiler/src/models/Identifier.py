@@ -17,7 +17,12 @@ class Identifier(Node):
     declaration: Optional[Declaration] = None
     new: bool = False
 
+    def resolve(self, symbol_table: SymbolTable):
+        self.declaration = symbol_table.get_current_scope().lookup(self.name)
+
     def find_declaration(self, symbol_table: SymbolTable) -> Declaration:
+        if self.declaration is not None:
+            return self.declaration
         return symbol_table.get_current_scope().lookup(self.name)
 
     def evaluate_type(self, symbol_table: SymbolTable) -> Type:
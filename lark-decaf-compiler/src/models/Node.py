@@ -6,12 +6,20 @@ from typing import List, TYPE_CHECKING
 if TYPE_CHECKING:
     from .SymbolTable import SymbolTable
     from .Declaration import Declaration
+    from ..emitter import Emitter
 
 
 @dataclass
 class Node:
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        return []
+    def resolve_names(self, symbol_table: SymbolTable):
+        """
+        Binds every identifier that refers to a declaration to it. Runs before code generation and
+        walks the scopes the same way generate_code does, so code generation never has to.
+        """
+        pass
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        pass
 
 
 # This model is not used anywhere. At least not yet!
@@ -1,14 +1,14 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, Optional, TYPE_CHECKING, Union
+from typing import Callable, List, Optional, TYPE_CHECKING, Union
 
+from ..registers import is_double_register
 from ..utils import (
     generate_clean_param_code,
     calc_variable_size,
-    pop_to_temp,
-    pop_double_to_femp,
-    DOUBLE_RETURN_REGISTER_NUMBER,
+    DOUBLE_RETURN_REGISTER,
+    RETURN_REGISTER,
 )
 from .Declaration import VariableDeclaration
 from .Node import Node
@@ -17,6 +17,7 @@ from .Type import PrimitiveTypes
 if TYPE_CHECKING:
     from .SymbolTable import SymbolTable
     from .Expression import Expression
+    from ..emitter import Emitter
 
 
 @dataclass
@@ -29,40 +30,43 @@ class StatementBlock(Statement):
     variable_declarations: List[VariableDeclaration]
     statements: List[Statement]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
         statement_block_scope = symbol_table.enter_new_scope()
-        code = []
         for var_decl in self.variable_declarations:
-            code += var_decl.generate_code(symbol_table)
+            var_decl.resolve_names(symbol_table)
         for statement in self.statements:
-            code += statement.generate_code(symbol_table)
+            statement.resolve_names(symbol_table)
+        symbol_table.set_current_scope(statement_block_scope.parent_scope)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        statement_block_scope = symbol_table.enter_new_scope()
+        for var_decl in self.variable_declarations:
+            var_decl.generate_code(symbol_table, emitter)
+        for statement in self.statements:
+            statement.generate_code(symbol_table, emitter)
             if isinstance(statement, ReturnStatement):
                 break
         # Pop variables in order to correct local offset
         freed_space = symbol_table.pop_variables_till_block(
             symbol_table.get_current_scope(), statement_block_scope
         )
-        code.append(f"\taddiu $sp, $sp, {freed_space} # Freed space")
+        emitter.emit(f"\taddiu $sp, $sp, {freed_space} # Freed space")
         # Clean block scope cause we are out of the block
         symbol_table.set_current_scope(statement_block_scope.parent_scope)
-        return code
 
 
 @dataclass
 class OptionalExpressionStatement(Statement):
     expression: Optional[Expression] = None
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = []
+    def resolve_names(self, symbol_table: SymbolTable):
         if self.expression is not None:
-            code += self.expression.generate_code(symbol_table)
-            # I hope this is right.
-            expr_type = self.expression.evaluate_type(symbol_table)
-            if expr_type == PrimitiveTypes.DOUBLE:
-                code += pop_double_to_femp(0)
-            else:
-                code += pop_to_temp(0)
-        return code
+            self.expression.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
+        if self.expression is not None:
+            register = self.expression.generate_value(symbol_table, emitter)
+            symbol_table.registers.release(register)
 
 
 @dataclass
@@ -77,76 +81,106 @@ class IfStatement(Statement):
     start_else_label: str = "UNSPECIFIED"
     end_else_label: str = "UNSPECIFIED"
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = []
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.condition_expression.resolve_names(symbol_table)
+        self.body_statement.resolve_names(symbol_table)
+        if self.else_body_statement is not None:
+            self.else_body_statement.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         if self.else_body_statement is None:
             self.if_number = symbol_table.get_current_if_number()
             self.end_if_label = f"end_if_{self.if_number}"
-            code += self.condition_expression.generate_code(symbol_table)
-            code += pop_to_temp(1)
-            code.append(f"beqz $t1, {self.end_if_label}")
-            code += self.body_statement.generate_code(symbol_table)
-            code.append(f"{self.end_if_label}:")
+            self.condition_expression.generate_branch(
+                symbol_table, emitter, self.end_if_label, False
+            )
+            self.body_statement.generate_code(symbol_table, emitter)
+            emitter.emit(f"{self.end_if_label}:")
 
         else:
             self.else_number = symbol_table.get_current_else_number()
             self.start_else_label = f"else_{self.else_number}"
             self.end_else_label = f"end_else_{self.else_number}"
-            code += self.condition_expression.generate_code(symbol_table)
-            code += pop_to_temp(1)
-            code.append(f"beqz $t1, {self.start_else_label}")
-            code += self.body_statement.generate_code(symbol_table)
-            code.append(f"j {self.end_else_label}")
-            code.append(f"{self.start_else_label}:")
-            code += self.else_body_statement.generate_code(symbol_table)
-            code.append(f"{self.end_else_label}:")
-
-        return code
+            self.condition_expression.generate_branch(
+                symbol_table, emitter, self.start_else_label, False
+            )
+            self.body_statement.generate_code(symbol_table, emitter)
+            emitter.emit(f"j {self.end_else_label}")
+            emitter.emit(f"{self.start_else_label}:")
+            self.else_body_statement.generate_code(symbol_table, emitter)
+            emitter.emit(f"{self.end_else_label}:")
 
 
 @dataclass
 class ReturnStatement(Statement):
     return_expression: Optional[Expression]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        if self.return_expression is not None:
+            self.return_expression.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         """
         If return_type is double it will be in $f0, otherwise in $v0.
         """
-        code = []
         if self.return_expression is not None:
-            code += self.return_expression.generate_code(symbol_table)
-            return_type = self.return_expression.evaluate_type(symbol_table)
-            if return_type == PrimitiveTypes.DOUBLE:
-                code += pop_double_to_femp(DOUBLE_RETURN_REGISTER_NUMBER)
+            register = self.return_expression.generate_value(symbol_table, emitter)
+            if is_double_register(register):
+                emitter.emit(
+                    f"\tmov.d {DOUBLE_RETURN_REGISTER}, {register}\t# Copy return value to {DOUBLE_RETURN_REGISTER}"
+                )
             else:
-                code += pop_to_temp(0)
-                code += ["\tmove $v0, $t0\t# Copy return value to $v0"]
-        return code
+                emitter.emit(
+                    f"\tmove {RETURN_REGISTER}, {register}\t# Copy return value to {RETURN_REGISTER}"
+                )
+            symbol_table.registers.release(register)
 
 
 @dataclass
 class PrintStatement(Statement):
     args: List[Expression]
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def resolve_names(self, symbol_table: SymbolTable):
+        for expression in self.args:
+            expression.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         # We assume the output of expressions are saved in stack
-        code = []
         for expression in self.args:
-            code += expression.generate_code(symbol_table)
+            expression.generate_code(symbol_table, emitter)
             expr_type = expression.evaluate_type(symbol_table)
             size = calc_variable_size(expr_type)
             if expr_type.name == PrimitiveTypes.INT.value:
-                code.append(f"\tjal _PrintInt")
+                emitter.emit(f"\tjal _PrintInt")
             elif expr_type.name == PrimitiveTypes.STRING.value:
-                code.append(f"\tjal _PrintString")
+                emitter.emit(f"\tjal _PrintString")
             elif expr_type.name == PrimitiveTypes.BOOL.value:
-                code.append(f"\tjal _PrintBool")
+                emitter.emit(f"\tjal _PrintBool")
             elif expr_type.name == PrimitiveTypes.DOUBLE.value:
-                # code.append(f"\tjal _PrintDouble")
-                code.append(f"\tjal _SimplePrintDouble")
-            code.append(generate_clean_param_code(size))
-        code.append(f"\tjal _PrintNewLine")
-        return code
+                # emitter.emit(f"\tjal _PrintDouble")
+                emitter.emit(f"\tjal _SimplePrintDouble")
+            emitter.emit(generate_clean_param_code(size))
+        emitter.emit(f"\tjal _PrintNewLine")
+
+
+def generate_loop(
+    symbol_table: SymbolTable,
+    emitter: Emitter,
+    condition: Expression,
+    start_label: str,
+    end_label: str,
+    generate_body: Callable[[], None],
+):
+    """
+    Emits a loop in rotated form: the condition is tested once before the loop, and then at the
+    bottom of every iteration, branching back to the start of the body. So every iteration takes
+    one branch instead of a test at the top and a jump back. break jumps to end_label.
+    """
+    condition.generate_branch(symbol_table, emitter, end_label, False)
+    emitter.emit(f"{start_label}:")
+    generate_body()
+    condition.generate_branch(symbol_table, emitter, start_label, True)
+    emitter.emit(f"{end_label}:")
 
 
 @dataclass
@@ -157,21 +191,24 @@ class WhileStatement(Statement):
     start_label: str = "UNSPECIFIED"
     end_label: str = "UNSPECIFIED"
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = []
+    def resolve_names(self, symbol_table: SymbolTable):
+        self.condition_expression.resolve_names(symbol_table)
+        self.body_statement.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         symbol_table.enter_loop(self)
         self.while_number = symbol_table.get_current_while_number()
         self.start_label = "while_" + str(self.while_number)
         self.end_label = "end_while_" + str(self.while_number)
-        code.append(f"{self.start_label}:")
-        code += self.condition_expression.generate_code(symbol_table)
-        code.append(f"\tlw $t1, 4($sp)\t#load expression value from stack to t1")
-        code += pop_to_temp(1)
-        code.append(f"\tbeqz $t1,{self.end_label}")
-        code += self.body_statement.generate_code(symbol_table)
-        code.append(f"{self.end_label}:")
+        generate_loop(
+            symbol_table,
+            emitter,
+            self.condition_expression,
+            self.start_label,
+            self.end_label,
+            lambda: self.body_statement.generate_code(symbol_table, emitter),
+        )
         symbol_table.exit_loop()
-        return code
 
 
 @dataclass
@@ -184,28 +221,39 @@ class ForStatement(Statement):
     start_label: str = "UNSPECIFIED"
     end_label: str = "UNSPECIFIED"
 
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
-        code = []
+    def resolve_names(self, symbol_table: SymbolTable):
+        if self.initialization_expression is not None:
+            self.initialization_expression.resolve_names(symbol_table)
+        self.condition_expression.resolve_names(symbol_table)
+        self.body_statement.resolve_names(symbol_table)
+        if self.update_expression is not None:
+            self.update_expression.resolve_names(symbol_table)
+
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         symbol_table.enter_loop(self)
         self.for_number = symbol_table.get_current_for_number()
         self.start_label = "for_" + str(self.for_number)
         self.end_label = "end_for_" + str(self.for_number)
         if self.initialization_expression is not None:
-            code += self.initialization_expression.generate_code(symbol_table)
-            code += pop_to_temp(0)
-        code.append(f"{self.start_label}:")
-        code += self.condition_expression.generate_code(symbol_table)
-        code += pop_to_temp(1)
-        code.append(f"\tbeqz $t1,{self.end_label}")
-        code += self.body_statement.generate_code(symbol_table)
-        if self.update_expression is not None:
-            code += self.update_expression.generate_code(symbol_table)
-            code += pop_to_temp(0)
-        code.append(f"\tj {self.start_label}\t# back to start of for")
-        code.append(f"{self.end_label}:")
-
+            register = self.initialization_expression.generate_value(
+                symbol_table, emitter
+            )
+            symbol_table.registers.release(register)
+        generate_loop(
+            symbol_table,
+            emitter,
+            self.condition_expression,
+            self.start_label,
+            self.end_label,
+            lambda: self.generate_body(symbol_table, emitter),
+        )
         symbol_table.exit_loop()
-        return code
+
+    def generate_body(self, symbol_table: SymbolTable, emitter: Emitter):
+        self.body_statement.generate_code(symbol_table, emitter)
+        if self.update_expression is not None:
+            register = self.update_expression.generate_value(symbol_table, emitter)
+            symbol_table.registers.release(register)
 
 
 LoopStatement = Union[WhileStatement, ForStatement]
@@ -213,7 +261,7 @@ LoopStatement = Union[WhileStatement, ForStatement]
 
 @dataclass
 class BreakStatement(Statement):
-    def generate_code(self, symbol_table: SymbolTable) -> List[str]:
+    def generate_code(self, symbol_table: SymbolTable, emitter: Emitter):
         current_loop_statement = symbol_table.get_current_loop_statement()
         end_label = current_loop_statement.end_label
-        return [f"j {end_label}"]
+        emitter.emit(f"j {end_label}")
@@ -2,11 +2,17 @@ from __future__ import annotations
 
 from typing import Dict, Optional, List, TYPE_CHECKING
 
-from ..utils import calc_variable_size
+from ..registers import Registers
+from ..utils import calc_variable_size, VTABLE_SLOT_SIZE
 
 if TYPE_CHECKING:
     from .Statement import LoopStatement
-    from .Declaration import Declaration, ClassDeclaration, VariableDeclaration
+    from .Declaration import (
+        Declaration,
+        ClassDeclaration,
+        FunctionDeclaration,
+        VariableDeclaration,
+    )
     from .Identifier import Identifier
 
 
@@ -41,6 +47,9 @@ class Scope:
     def add_declaration(self, declaration: Declaration):
         self.name_declaration_map[declaration.identifier.name] = declaration
 
+    def add_members(self, members_by_name: Dict[str, Declaration]):
+        self.name_declaration_map.update(members_by_name)
+
     def find_which_class_we_are_in(self) -> ClassDeclaration:
         if self.owner_class_declaration is not None:
             return self.owner_class_declaration
@@ -66,6 +75,15 @@ class SymbolTable:
         # init global scope
         self.global_scope = Scope()
         self.current_scope = self.global_scope
+        # Per instance, so a failed compilation does not leak loops into the next one.
+        self.exterior_loop_statements = []
+        # Prototypes of all interfaces. Their index decides their slot before the vtables.
+        self.interface_methods: List[FunctionDeclaration] = []
+        self.registers = Registers()
+
+    def add_interface_method(self, prototype: FunctionDeclaration):
+        self.interface_methods.append(prototype)
+        prototype.vtable_offset = -VTABLE_SLOT_SIZE * len(self.interface_methods)
 
     def enter_loop(self, loop_statement: LoopStatement):
         self.exterior_loop_statements.append(loop_statement)
@@ -142,6 +160,9 @@ class SymbolTable:
             return popped_size_till_now
         for decl in scope.name_declaration_map.values():
             assert isinstance(decl, VariableDeclaration)
+            if decl.register is not None:
+                # Lives in a register, it has no stack slot.
+                continue
             # Pop variables
             size = calc_variable_size(decl.variable_type)
             self.decrement_local_offset(size)
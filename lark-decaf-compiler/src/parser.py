@@ -1,7 +1,13 @@
-from lark import Lark
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
 
-decaf_parser = Lark(
-    grammar=r"""
+import lark
+from lark import Lark, Transformer
+
+decaf_grammar = r"""
 program: (decl)+ -> finalize
 
 decl: variable_decl -> pass_up_first_element
@@ -36,10 +42,10 @@ fields_decl: (field)* -> pass_up
 field: variable_decl -> pass_up_first_element
     | function_decl -> pass_up_first_element
 
-interface_decl: "interface" new_identifier "{" (prototype)* "}"
+interface_decl: "interface" new_identifier "{" (prototype)* "}" -> new_interface
 
-prototype: type new_identifier "(" formals ")" ";"
-    | "void" new_identifier "(" formals ")" ";"
+prototype: type new_identifier "(" formals ")" ";" -> new_prototype
+    | "void" new_identifier "(" formals ")" ";" -> new_void_prototype
 
 stmt_block: "{" (variable_decl)* (stmt)* "}" -> statement_block
 
@@ -69,11 +75,11 @@ print_stmt : "Print" "(" expr ("," expr)* ")" ";" -> print_statement
 // For operator precedence we write the grammar as follows. From low precedence to high precedence.
 // Like this: expr_n: expr_n+1 op expr_n
 
-expr: expr1 "||" expr -> logical_or
+expr: expr1 "||" expr -> or_operation
     | assignment -> pass_up_first_element
     | expr1 -> pass_up_first_element
 
-expr1: expr2 "&&" expr1 -> logical_and
+expr1: expr2 "&&" expr1 -> and_operation
     | expr2 -> pass_up_first_element
 
 expr2: expr3 "==" expr2 -> equals_operation
@@ -148,10 +154,8 @@ constant: INTEGER -> int_const
 
 NULL.5: "null"
 
-PRIM.2: "int"
-    | "double"
-    | "bool"
-    | "string"
+// Word bounded, so keywords and identifiers that start with a type name (interface) still lex.
+PRIM.2: /(int|double|bool|string)\b/
 
 BOOL.2: "true"
     | "false"
@@ -170,7 +174,101 @@ MULTILINE_COMMENT : /\/\*(\*(?!\/)|[^*])*\*\//
 
 %import common.WS
 %ignore WS
-""",
-    start="program",
-    parser="lalr",
+"""
+
+# Building the LALR tables from the grammar text dominates the start up time of the compiler,
+# so the analysed grammar is serialized to disk and reused by later runs.
+# The cache file name is keyed by the grammar and the installed Lark version, so any change
+# to either of them simply misses the cache and rebuilds it.
+# Loading the cache unpickles it, so it lives in a directory of the user's own and is only loaded
+# when the user owns both the directory and the file.
+PARSER_CACHE_DIRECTORY = os.environ.get("DECAF_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "decaf-compiler",
 )
+
+
+def parser_cache_path(grammar: str = decaf_grammar) -> str:
+    key = hashlib.sha256((grammar + lark.__version__).encode()).hexdigest()
+    return os.path.join(PARSER_CACHE_DIRECTORY, f"decaf_parser_{key[:32]}.lark")
+
+
+def owned_by_user(status: os.stat_result) -> bool:
+    return status.st_uid == os.getuid()
+
+
+def load_cached_parser(
+    cache_path: str, transformer: Optional[Transformer] = None
+) -> Optional[Lark]:
+    try:
+        if not owned_by_user(os.stat(os.path.dirname(cache_path))):
+            logging.warning(f"Ignoring parser cache {cache_path}: directory not ours")
+            return None
+        with open(cache_path, "rb") as cache_file:
+            if not owned_by_user(os.fstat(cache_file.fileno())):
+                logging.warning(f"Ignoring parser cache {cache_path}: file not ours")
+                return None
+            # Lark.load takes no transformer in lark 0.9. _load is what Lark(cache=...) uses itself.
+            return Lark.__new__(Lark)._load(cache_file, transformer)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # Corrupt or incompatible cache file. The caller rebuilds it.
+        logging.warning(f"Ignoring broken parser cache {cache_path}: {e}")
+    return None
+
+
+def write_parser_cache(parser: Lark, cache_path: str):
+    temp_path = None
+    try:
+        os.makedirs(PARSER_CACHE_DIRECTORY, mode=0o700, exist_ok=True)
+        if not owned_by_user(os.stat(PARSER_CACHE_DIRECTORY)):
+            logging.warning(
+                f"Not writing parser cache {cache_path}: directory not ours"
+            )
+            return
+        # Write to a temporary file first so concurrent compilers never read a half written cache.
+        fd, temp_path = tempfile.mkstemp(dir=PARSER_CACHE_DIRECTORY, suffix=".tmp")
+        with os.fdopen(fd, "wb") as temp_file:
+            parser.save(temp_file)
+        os.replace(temp_path, cache_path)
+        temp_path = None
+    except OSError as e:
+        logging.warning(f"Could not write parser cache {cache_path}: {e}")
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def build_parser(
+    grammar: str = decaf_grammar,
+    use_cache: bool = True,
+    transformer: Optional[Transformer] = None,
+) -> Lark:
+    """
+    With a transformer, its callbacks run as the LALR parser reduces rules, so parse() directly
+    returns the transformed result and no parse tree is ever built.
+    """
+    if not use_cache:
+        return Lark(
+            grammar=grammar, start="program", parser="lalr", transformer=transformer
+        )
+    cache_path = parser_cache_path(grammar)
+    parser = load_cached_parser(cache_path, transformer)
+    if parser is None:
+        parser = Lark(grammar=grammar, start="program", parser="lalr")
+        # The cache is always written without a transformer, so every parser can share it.
+        write_parser_cache(parser, cache_path)
+        if transformer is not None:
+            parser = load_cached_parser(cache_path, transformer) or Lark(
+                grammar=grammar, start="program", parser="lalr", transformer=transformer
+            )
+    return parser
+
+
+USE_PARSER_CACHE = "DECAF_NO_PARSER_CACHE" not in os.environ
+
+decaf_parser = build_parser(use_cache=USE_PARSER_CACHE)
@@ -0,0 +1,610 @@
+"""
+Peephole optimization of the generated assembly. A window slides over the instructions of every
+function and the rules of a rule table rewrite what they match, until no rule matches any more.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .emitter import Emitter
+from .registers import DOUBLE_REGISTERS, INT_REGISTERS
+
+REGISTER_PATTERN = re.compile(r"\$[a-z0-9]+")
+LABEL_PATTERN = re.compile(r"^\s*([\w.$]+):")
+
+# Instructions that do not write a register operand.
+NO_DESTINATION = {
+    "sw",
+    "sb",
+    "s.d",
+    "j",
+    "b",
+    "jr",
+    "jal",
+    "jalr",
+    "beqz",
+    "bnez",
+    "beq",
+    "bne",
+    "blt",
+    "bgt",
+    "ble",
+    "bge",
+    "bltz",
+    "bgez",
+    "blez",
+    "bgtz",
+    "bc1t",
+    "bc1f",
+    "c.eq.d",
+    "c.lt.d",
+    "c.le.d",
+    "syscall",
+    "nop",
+}
+JUMPS = {"j", "b"}
+BRANCHES = {
+    "beqz",
+    "bnez",
+    "beq",
+    "bne",
+    "blt",
+    "bgt",
+    "ble",
+    "bge",
+    "bltz",
+    "bgez",
+    "blez",
+    "bgtz",
+    "bc1t",
+    "bc1f",
+}
+CALLS = {"jal", "jalr"}
+MOVES = {"move", "mov.d"}
+STACK_ADJUSTMENTS = {"addu": 1, "addiu": 1, "addi": 1, "subu": -1, "sub": -1}
+INVERTED_BRANCHES = {
+    "beqz": "bnez",
+    "bnez": "beqz",
+    "beq": "bne",
+    "bne": "beq",
+    "blt": "bge",
+    "bge": "blt",
+    "bgt": "ble",
+    "ble": "bgt",
+    "bltz": "bgez",
+    "bgez": "bltz",
+    "bgtz": "blez",
+    "blez": "bgtz",
+    "bc1t": "bc1f",
+    "bc1f": "bc1t",
+}
+# Register forms with an immediate form, and the sign the immediate gets.
+IMMEDIATE_FORMS = {
+    "add": ("addi", 1),
+    "addu": ("addiu", 1),
+    "sub": ("addi", -1),
+    "subu": ("addiu", -1),
+    "slt": ("slti", 1),
+    "and": ("andi", 1),
+    "or": ("ori", 1),
+    "xor": ("xori", 1),
+    "mul": ("mul", 1),
+    "seq": ("seq", 1),
+    "sne": ("sne", 1),
+    "sle": ("sle", 1),
+    "sgt": ("sgt", 1),
+    "sge": ("sge", 1),
+}
+COMMUTATIVE = {"add", "addu", "and", "or", "xor", "mul", "seq", "sne"}
+# Branches that compare two registers, with the branch that compares them the other way around,
+# and the branch that compares the first one with zero.
+SWAPPED_BRANCHES = {
+    "blt": "bgt",
+    "bgt": "blt",
+    "ble": "bge",
+    "bge": "ble",
+    "beq": "beq",
+    "bne": "bne",
+}
+ZERO_BRANCHES = {
+    "blt": "bltz",
+    "bgt": "bgtz",
+    "ble": "blez",
+    "bge": "bgez",
+    "beq": "beqz",
+    "bne": "bnez",
+}
+# andi, ori and xori zero extend their immediate.
+UNSIGNED_IMMEDIATES = {"andi", "ori", "xori"}
+TEMPORARY_REGISTERS = set(INT_REGISTERS) | set(DOUBLE_REGISTERS)
+
+
+@dataclass
+class Instruction:
+    opcode: str
+    operands: List[str]
+    comment: str = ""
+
+    @classmethod
+    def parse(cls, line: str) -> Optional["Instruction"]:
+        text = line.strip()
+        if not text or text.startswith("#") or text.startswith("."):
+            return None
+        if LABEL_PATTERN.match(text):
+            return None
+        text, _, comment = text.partition("#")
+        opcode, _, operands = text.strip().partition(" ")
+        return cls(
+            opcode,
+            [operand.strip() for operand in operands.split(",") if operand.strip()],
+            comment.strip(),
+        )
+
+    def render(self) -> str:
+        line = f"\t{self.opcode} {', '.join(self.operands)}"
+        if self.comment:
+            line += f"\t# {self.comment}"
+        return line
+
+    def destination(self) -> Optional[str]:
+        if self.opcode in NO_DESTINATION or not self.operands:
+            return None
+        if self.opcode == "div" and len(self.operands) == 2:
+            return None
+        if self.opcode in ("mtc1", "mtc1.d"):
+            return self.operands[1]
+        return self.operands[0]
+
+    def has_single_destination(self) -> bool:
+        """
+        Whether the first operand is the only register the instruction writes.
+        """
+        return self.destination() is not None and self.opcode not in (
+            "mtc1",
+            "mtc1.d",
+            "mfc1.d",
+        )
+
+    def source_operand_indices(self) -> List[int]:
+        if self.destination() is None:
+            return list(range(len(self.operands)))
+        if self.opcode in ("mtc1", "mtc1.d"):
+            return [0]
+        return list(range(1, len(self.operands)))
+
+    def reads(self) -> Set[str]:
+        registers = set()
+        for index in self.source_operand_indices():
+            registers.update(REGISTER_PATTERN.findall(self.operands[index]))
+        if self.opcode == "syscall":
+            registers.update(("$v0", "$a0", "$f12"))
+        return registers
+
+    def replace_source(self, register: str, replacement: str) -> "Instruction":
+        pattern = re.compile(re.escape(register) + r"(?![0-9])")
+        operands = list(self.operands)
+        for index in self.source_operand_indices():
+            operands[index] = pattern.sub(replacement, operands[index])
+        return Instruction(self.opcode, operands, self.comment)
+
+    def with_destination(self, register: str) -> "Instruction":
+        return Instruction(self.opcode, [register] + self.operands[1:], self.comment)
+
+    def stack_adjustment(self) -> Optional[int]:
+        """
+        How many bytes the instruction adds to $sp, if it only moves $sp by a constant.
+        """
+        if (
+            self.opcode in STACK_ADJUSTMENTS
+            and len(self.operands) == 3
+            and self.operands[0] == "$sp"
+            and self.operands[1] == "$sp"
+            and re.fullmatch(r"-?\d+", self.operands[2])
+        ):
+            return STACK_ADJUSTMENTS[self.opcode] * int(self.operands[2])
+        return None
+
+
+@dataclass
+class Line:
+    text: Optional[str]
+    instruction: Optional[Instruction] = None
+    label: Optional[str] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "Line":
+        label = LABEL_PATTERN.match(text)
+        return cls(text, Instruction.parse(text), label.group(1) if label else None)
+
+    def is_deleted(self) -> bool:
+        return self.text is None
+
+    def is_transparent(self) -> bool:
+        """
+        Comments and empty lines may sit inside a window. Labels and directives may not.
+        """
+        if self.is_deleted():
+            return True
+        text = self.text.strip()
+        return self.instruction is None and (not text or text.startswith("#"))
+
+
+class Code:
+    """
+    Lines of one function. Rewrites only replace or delete lines, so line indices stay valid
+    until compact is called.
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self.lines = [Line.parse(line) for line in lines]
+        self.label_indices: Dict[str, int] = dict()
+        self.compact()
+
+    def compact(self):
+        self.lines = [line for line in self.lines if not line.is_deleted()]
+        self.label_indices = {
+            line.label: index
+            for index, line in enumerate(self.lines)
+            if line.label is not None
+        }
+
+    def window(self, start: int, size: int) -> Optional[List[int]]:
+        """
+        Indices of size instructions starting at line start, if nothing but comments is between them.
+        """
+        indices = []
+        index = start
+        while len(indices) < size:
+            if index >= len(self.lines):
+                return None
+            line = self.lines[index]
+            if line.instruction is not None:
+                indices.append(index)
+            elif not line.is_transparent():
+                return None
+            index += 1
+        return indices
+
+    def labels_after(self, index: int) -> Set[str]:
+        """
+        Labels between line index and the next instruction.
+        """
+        labels = set()
+        index += 1
+        while index < len(self.lines) and self.lines[index].instruction is None:
+            if self.lines[index].label is not None:
+                labels.add(self.lines[index].label)
+            index += 1
+        return labels
+
+    def is_dead(self, register: str, index: int) -> bool:
+        """
+        Whether the value register has after line index is never read. Follows jumps and both ways
+        of branches. Only temporaries are dead at calls and returns, the code generator saves
+        live temporaries before calls.
+        """
+        if register not in TEMPORARY_REGISTERS:
+            return False
+        work = [index + 1]
+        last = self.lines[index].instruction
+        if last is not None and last.opcode in BRANCHES:
+            target = self.label_indices.get(last.operands[-1])
+            if target is None:
+                return False
+            work.append(target)
+        visited = set()
+        while work:
+            position = work.pop()
+            while True:
+                if position in visited:
+                    break
+                if position >= len(self.lines):
+                    # We do not know what follows this code.
+                    return False
+                visited.add(position)
+                instruction = self.lines[position].instruction
+                position += 1
+                if instruction is None:
+                    continue
+                if register in instruction.reads():
+                    return False
+                if (
+                    instruction.destination() == register
+                    or instruction.opcode in CALLS
+                    or instruction.opcode == "jr"
+                ):
+                    break
+                if instruction.opcode in JUMPS or instruction.opcode in BRANCHES:
+                    target = self.label_indices.get(instruction.operands[-1])
+                    if target is None:
+                        return False
+                    if instruction.opcode in JUMPS:
+                        position = target
+                    else:
+                        work.append(target)
+        return True
+
+
+@dataclass
+class Window:
+    code: Code
+    indices: List[int]
+
+    @property
+    def instructions(self) -> List[Instruction]:
+        return [self.code.lines[index].instruction for index in self.indices]
+
+    def is_dead_after(self, register: str) -> bool:
+        return self.code.is_dead(register, self.indices[-1])
+
+    def labels_after(self) -> Set[str]:
+        return self.code.labels_after(self.indices[-1])
+
+    def replace(self, instructions: List[Instruction]):
+        for position, index in enumerate(self.indices):
+            line = self.code.lines[index]
+            if position < len(instructions):
+                self.code.lines[index] = Line(
+                    instructions[position].render(), instructions[position]
+                )
+            else:
+                line.text = None
+                line.instruction = None
+
+
+@dataclass
+class PeepholeRule:
+    """
+    rewrite gets a window of size consecutive instructions and returns what to replace them with,
+    at most as many instructions, or None if the rule does not match.
+    """
+
+    name: str
+    size: int
+    rewrite: Callable[[Window], Optional[List[Instruction]]]
+
+
+def remove_self_move(window: Window) -> Optional[List[Instruction]]:
+    (move,) = window.instructions
+    if move.opcode in MOVES and move.operands[0] == move.operands[1]:
+        return []
+    return None
+
+
+def merge_stack_adjustments(window: Window) -> Optional[List[Instruction]]:
+    first, second = window.instructions
+    first_amount = first.stack_adjustment()
+    second_amount = second.stack_adjustment()
+    if first_amount is None or second_amount is None:
+        return None
+    amount = first_amount + second_amount
+    if amount == 0:
+        return []
+    return [Instruction("addiu", ["$sp", "$sp", str(amount)], first.comment)]
+
+
+def remove_zero_stack_adjustment(window: Window) -> Optional[List[Instruction]]:
+    (adjustment,) = window.instructions
+    if adjustment.stack_adjustment() == 0:
+        return []
+    return None
+
+
+def remove_push_pop(window: Window) -> Optional[List[Instruction]]:
+    """
+    A push right before a pop of the same size is a move.
+    """
+    push, store, load, pop = window.instructions
+    size = push.stack_adjustment()
+    if size is None or size >= 0 or pop.stack_adjustment() != -size:
+        return None
+    pairs = {"sw": ("lw", "move"), "s.d": ("l.d", "mov.d")}
+    if store.opcode not in pairs or load.opcode != pairs[store.opcode][0]:
+        return None
+    if store.operands[1] != "4($sp)" or load.operands[1] != "4($sp)":
+        return None
+    if store.operands[0] == load.operands[0]:
+        return []
+    return [Instruction(pairs[store.opcode][1], [load.operands[0], store.operands[0]])]
+
+
+def forward_store_to_load(window: Window) -> Optional[List[Instruction]]:
+    """
+    A load right after a store to the same address gets the value from the stored register.
+    """
+    store, load = window.instructions
+    pairs = {"sw": ("lw", "move"), "s.d": ("l.d", "mov.d")}
+    if store.opcode not in pairs or load.opcode != pairs[store.opcode][0]:
+        return None
+    if store.operands[1] != load.operands[1]:
+        return None
+    if store.operands[0] == load.operands[0]:
+        return [store]
+    return [
+        store,
+        Instruction(pairs[store.opcode][1], [load.operands[0], store.operands[0]]),
+    ]
+
+
+def coalesce_move(window: Window) -> Optional[List[Instruction]]:
+    """
+    Computes a value straight into the register it is moved to, if the temporary is not needed
+    after the move.
+    """
+    instruction, move = window.instructions
+    if move.opcode not in MOVES or not instruction.has_single_destination():
+        return None
+    temporary = move.operands[1]
+    if instruction.destination() != temporary or move.operands[0] == temporary:
+        return None
+    if instruction.opcode in MOVES and instruction.opcode != move.opcode:
+        return None
+    if not window.is_dead_after(temporary):
+        return None
+    return [instruction.with_destination(move.operands[0])]
+
+
+def forward_copy(window: Window) -> Optional[List[Instruction]]:
+    """
+    Reads the source of a move instead of its copy, if the copy is not needed afterwards.
+    """
+    move, instruction = window.instructions
+    if move.opcode not in MOVES:
+        return None
+    copy, source = move.operands
+    if copy not in instruction.reads() or copy == source:
+        return None
+    if instruction.opcode in ("mtc1.d", "mfc1.d"):
+        return None
+    if instruction.destination() != copy and not window.is_dead_after(copy):
+        return None
+    return [instruction.replace_source(copy, source)]
+
+
+def fold_immediate(window: Window) -> Optional[List[Instruction]]:
+    """
+    Uses the immediate form of an instruction instead of loading the constant to a register.
+    """
+    load, instruction = window.instructions
+    if load.opcode != "li" or instruction.opcode not in IMMEDIATE_FORMS:
+        return None
+    if len(instruction.operands) != 3:
+        return None
+    temporary = load.operands[0]
+    destination, first, second = instruction.operands
+    if second != temporary:
+        if first != temporary or instruction.opcode not in COMMUTATIVE:
+            return None
+        first, second = second, first
+    if not first.startswith("$") or first == temporary:
+        return None
+    if not re.fullmatch(r"-?\d+", load.operands[1]):
+        return None
+    opcode, sign = IMMEDIATE_FORMS[instruction.opcode]
+    value = sign * int(load.operands[1])
+    if opcode in UNSIGNED_IMMEDIATES:
+        if not 0 <= value <= 0xFFFF:
+            return None
+    elif not -0x8000 <= value <= 0x7FFF:
+        return None
+    if destination != temporary and not window.is_dead_after(temporary):
+        return None
+    return [Instruction(opcode, [destination, first, str(value)], instruction.comment)]
+
+
+def fold_branch_immediate(window: Window) -> Optional[List[Instruction]]:
+    """
+    Compares with a constant directly instead of loading it to a register first.
+    """
+    load, branch = window.instructions
+    if load.opcode != "li" or branch.opcode not in SWAPPED_BRANCHES:
+        return None
+    temporary = load.operands[0]
+    opcode = branch.opcode
+    first, second, label = branch.operands
+    if second != temporary:
+        if first != temporary:
+            return None
+        first, second, opcode = second, first, SWAPPED_BRANCHES[opcode]
+    if not first.startswith("$") or first == temporary:
+        return None
+    if not re.fullmatch(r"-?\d+", load.operands[1]):
+        return None
+    if not window.is_dead_after(temporary):
+        return None
+    if int(load.operands[1]) == 0:
+        return [Instruction(ZERO_BRANCHES[opcode], [first, label], branch.comment)]
+    return [Instruction(opcode, [first, load.operands[1], label], branch.comment)]
+
+
+def invert_branch_over_jump(window: Window) -> Optional[List[Instruction]]:
+    """
+    A branch that only skips a jump is the opposite branch to where the jump goes.
+    """
+    branch, jump = window.instructions
+    if branch.opcode not in INVERTED_BRANCHES or jump.opcode not in JUMPS:
+        return None
+    if branch.operands[-1] not in window.labels_after():
+        return None
+    return [
+        Instruction(
+            INVERTED_BRANCHES[branch.opcode],
+            branch.operands[:-1] + jump.operands,
+            branch.comment,
+        )
+    ]
+
+
+def remove_jump_to_next(window: Window) -> Optional[List[Instruction]]:
+    (jump,) = window.instructions
+    if jump.opcode not in JUMPS and jump.opcode not in ("beqz", "bnez"):
+        return None
+    if jump.operands[-1] in window.labels_after():
+        return []
+    return None
+
+
+PEEPHOLE_RULES = [
+    PeepholeRule("self-move", 1, remove_self_move),
+    PeepholeRule("zero-stack-adjustment", 1, remove_zero_stack_adjustment),
+    PeepholeRule("merge-stack-adjustments", 2, merge_stack_adjustments),
+    PeepholeRule("push-pop", 4, remove_push_pop),
+    PeepholeRule("store-load", 2, forward_store_to_load),
+    PeepholeRule("coalesce-move", 2, coalesce_move),
+    PeepholeRule("forward-copy", 2, forward_copy),
+    PeepholeRule("fold-immediate", 2, fold_immediate),
+    PeepholeRule("fold-branch-immediate", 2, fold_branch_immediate),
+    PeepholeRule("branch-over-jump", 2, invert_branch_over_jump),
+    PeepholeRule("jump-to-next", 1, remove_jump_to_next),
+]
+
+
+@dataclass
+class PeepholeOptimizer:
+    rules: List[PeepholeRule] = field(default_factory=lambda: list(PEEPHOLE_RULES))
+    # How many times every rule rewrote something.
+    hits: Counter = field(default_factory=Counter)
+
+    def optimize(self, lines: Iterable[str]) -> List[str]:
+        code = Code(lines)
+        changed = bool(self.rules)
+        while changed:
+            changed = False
+            for rule in self.rules:
+                for start in range(len(code.lines)):
+                    if code.lines[start].instruction is None:
+                        continue
+                    indices = code.window(start, rule.size)
+                    if indices is None:
+                        continue
+                    window = Window(code, indices)
+                    replacement = rule.rewrite(window)
+                    if replacement is not None:
+                        window.replace(replacement)
+                        self.hits[rule.name] += 1
+                        changed = True
+                code.compact()
+        return [line.text for line in code.lines]
+
+
+class PeepholeEmitter(Emitter):
+    """
+    Optimizes the code one function at a time (everything up to a return) and passes it on to
+    target, so the output is still streamed.
+    """
+
+    def __init__(self, target: Emitter, optimizer: PeepholeOptimizer):
+        self.target = target
+        self.optimizer = optimizer
+        self.buffer: List[str] = []
+
+    def emit(self, line: str):
+        self.buffer.append(line)
+        instruction = Instruction.parse(line)
+        if instruction is not None and instruction.opcode == "jr":
+            self.flush()
+
+    def flush(self):
+        self.target.emit_lines(self.optimizer.optimize(self.buffer))
+        self.buffer = []
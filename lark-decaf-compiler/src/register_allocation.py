@@ -0,0 +1,141 @@
+"""
+Keeps local variables and parameters of functions in saved registers, using linear scan allocation
+over live ranges computed from the statement tree.
+"""
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+from .models.Declaration import FunctionDeclaration, VariableDeclaration
+from .models.Expression import Expression
+from .models.Identifier import Identifier
+from .models.Node import Node
+from .models.Statement import ForStatement, WhileStatement
+from .models.Type import PrimitiveTypes
+
+SAVED_REGISTERS = [f"$s{number}" for number in range(8)]
+# A use inside a loop is weighted as this many uses outside of it.
+LOOP_WEIGHT = 10
+# Memory accesses a register adds: saving and restoring it, and loading a parameter into it.
+# Variables that are not used more than that stay in memory.
+LOCAL_REGISTER_COST = 3
+PARAMETER_REGISTER_COST = 4
+
+
+@dataclass
+class LiveRange:
+    """
+    Positions are numbered per statement (and per condition, initialization and update expression),
+    so variables used by the same statement always have overlapping live ranges.
+    """
+
+    variable: VariableDeclaration
+    start: int
+    end: int
+    weight: int = 0
+    register: Optional[str] = None
+
+    def is_worth_a_register(self) -> bool:
+        if self.variable.is_function_parameter:
+            return self.weight > PARAMETER_REGISTER_COST
+        return self.weight > LOCAL_REGISTER_COST
+
+
+class LiveRangeBuilder:
+    def __init__(self, function_decl: FunctionDeclaration):
+        self.position = 0
+        self.loop_depth = 0
+        self.candidates: Dict[int, VariableDeclaration] = dict()
+        self.live_ranges: Dict[int, LiveRange] = dict()
+        self.loops: List[Tuple[int, int]] = []
+        for param in function_decl.formal_parameters:
+            self.add_candidate(param)
+            if id(param) in self.candidates:
+                # Parameters are live from the start of the function.
+                self.live_ranges[id(param)] = LiveRange(param, 0, 0)
+        self.visit(function_decl.body)
+
+    def add_candidate(self, var_decl: VariableDeclaration):
+        # Doubles stay in memory, $s registers only hold 4 bytes.
+        if var_decl.variable_type != PrimitiveTypes.DOUBLE:
+            self.candidates[id(var_decl)] = var_decl
+
+    def use(self, var_decl: VariableDeclaration):
+        live_range = self.live_ranges.get(id(var_decl))
+        if live_range is None:
+            live_range = LiveRange(var_decl, self.position, self.position)
+            self.live_ranges[id(var_decl)] = live_range
+        live_range.end = self.position
+        live_range.weight += LOOP_WEIGHT ** self.loop_depth
+
+    def visit(self, node: Node, inside_expression: bool = False):
+        if isinstance(node, Identifier):
+            if id(node.declaration) in self.candidates:
+                self.use(node.declaration)
+            return
+        if isinstance(node, VariableDeclaration):
+            self.add_candidate(node)
+            return
+        if not inside_expression:
+            self.position += 1
+        start = self.position
+        is_loop = isinstance(node, (WhileStatement, ForStatement))
+        self.loop_depth += is_loop
+        for field in fields(node):
+            value = getattr(node, field.name)
+            for child in value if isinstance(value, list) else [value]:
+                if isinstance(child, Node):
+                    self.visit(
+                        child, inside_expression or isinstance(node, Expression),
+                    )
+        if is_loop:
+            self.loop_depth -= 1
+            self.loops.append((start, self.position))
+
+    def build(self) -> List[LiveRange]:
+        live_ranges = list(self.live_ranges.values())
+        # Values flow around the back edge of a loop, so a variable used in a loop lives through all of it.
+        for live_range in live_ranges:
+            for start, end in self.loops:
+                if live_range.start <= end and start <= live_range.end:
+                    live_range.start = min(live_range.start, start)
+                    live_range.end = max(live_range.end, end)
+        return live_ranges
+
+
+def linear_scan(live_ranges: List[LiveRange], registers: List[str]):
+    """
+    Poletto and Sarkar's linear scan. When registers run out, the live range with the lowest
+    weight stays in memory, so variables used in loops keep their registers.
+    """
+    free_registers = list(registers)
+    active: List[LiveRange] = []
+    for live_range in sorted(live_ranges, key=lambda r: r.start):
+        if not live_range.is_worth_a_register():
+            continue
+        for expired in [r for r in active if r.end < live_range.start]:
+            active.remove(expired)
+            free_registers.append(expired.register)
+        if free_registers:
+            free_registers.sort(key=registers.index)
+            live_range.register = free_registers.pop(0)
+            active.append(live_range)
+            continue
+        spilled = min(active, key=lambda r: r.weight)
+        if spilled.weight < live_range.weight:
+            live_range.register = spilled.register
+            spilled.register = None
+            active.remove(spilled)
+            active.append(live_range)
+
+
+def allocate_variable_registers(function_decl: FunctionDeclaration) -> List[str]:
+    """
+    Sets the register of the local variables and parameters of the function that get one.
+    Returns the saved registers the function uses.
+    """
+    live_ranges = LiveRangeBuilder(function_decl).build()
+    linear_scan(live_ranges, SAVED_REGISTERS)
+    for live_range in live_ranges:
+        live_range.variable.register = live_range.register
+    used_registers = {r.register for r in live_ranges if r.register is not None}
+    return [register for register in SAVED_REGISTERS if register in used_registers]
@@ -0,0 +1,71 @@
+from typing import List
+
+# $t registers hold int, bool, string and pointer values. Double values are kept in the even
+# $f registers from $f4 up. $f0 and $f2 are left for return values, as in the MIPS calling convention.
+INT_REGISTERS = [f"$t{number}" for number in range(10)]
+DOUBLE_REGISTERS = [f"$f{number}" for number in range(4, 32, 2)]
+# A node is only evaluated with at least this many registers of each kind free, so an operator can
+# always hold both of its operands (see generate_operands in Expression.py).
+MINIMUM_FREE_REGISTERS = 2
+
+
+def is_double_register(register: str) -> bool:
+    return register.startswith("$f")
+
+
+class RegisterPool:
+    def __init__(self, registers: List[str]):
+        # Free registers are taken from the end, so allocation goes in the order given.
+        self.free_registers = list(reversed(registers))
+        self.used_registers: List[str] = []
+
+    def allocate(self) -> str:
+        if not self.free_registers:
+            raise RuntimeError("Out of registers while evaluating an expression.")
+        register = self.free_registers.pop()
+        self.used_registers.append(register)
+        return register
+
+    def release(self, register: str):
+        self.used_registers.remove(register)
+        self.free_registers.append(register)
+
+    def free_count(self) -> int:
+        return len(self.free_registers)
+
+
+class Registers:
+    """
+    Temporary registers used while evaluating expressions. An expression allocates a register for its
+    result, and whoever uses the result releases it. Between statements every register is free.
+    """
+
+    def __init__(self):
+        self.int_registers = RegisterPool(INT_REGISTERS)
+        self.double_registers = RegisterPool(DOUBLE_REGISTERS)
+
+    def allocate(self, is_double: bool = False) -> str:
+        if is_double:
+            return self.double_registers.allocate()
+        return self.int_registers.allocate()
+
+    def release(self, register: str):
+        if not self.is_temporary(register):
+            # Registers of variables are only borrowed by expressions.
+            return
+        if is_double_register(register):
+            self.double_registers.release(register)
+        else:
+            self.int_registers.release(register)
+
+    def is_temporary(self, register: str) -> bool:
+        return register in INT_REGISTERS or register in DOUBLE_REGISTERS
+
+    def free_count(self) -> int:
+        return min(self.int_registers.free_count(), self.double_registers.free_count())
+
+    def live_registers(self) -> List[str]:
+        """
+        Registers holding values that are still needed, in the order they were allocated.
+        """
+        return self.int_registers.used_registers + self.double_registers.used_registers
@@ -1,7 +1,10 @@
+from typing import Dict, Iterable, Tuple
+
 from .models.Type import Type, PrimitiveTypes
 
-standard_library_functions = """
-_PrintInt:
+# The runtime, one routine per label. A program is linked with the routines it refers to only.
+RUNTIME_ROUTINES: Dict[str, str] = {
+    "_PrintInt": """_PrintInt:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -15,42 +18,42 @@ _PrintInt:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-_SimplePrintDouble:
+""",
+    "_SimplePrintDouble": """_SimplePrintDouble:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
         addiu   $fp, $sp, 8
         
         li      $v0, 3
-        l.d     $f12, 0($fp)    # load double value to $f12
+        l.d     $f12, 4($fp)    # load double value to $f12
         syscall
         
         move    $sp, $fp
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-_PrintDoubleWithoutFourDecimal:
+""",
+    "_PrintDoubleWithoutFourDecimal": """_PrintDoubleWithoutFourDecimal:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
         addiu   $fp, $sp, 8
         li      $v0, 3
-        l.d     $f12, 0($fp)    # load double value to $f12
+        l.d     $f12, 4($fp)    # load double value to $f12
         syscall
         move    $sp, $fp
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-        
-_PrintDouble:
+""",
+    "_PrintDouble": """_PrintDouble:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
         addiu   $fp, $sp, 8
 
-        l.d     $f12, 0($fp)    # load double value to $f12
+        l.d     $f12, 4($fp)    # load double value to $f12
         
         cvt.w.d  $f0,$f12
         mfc1 $a0, $f0
@@ -79,9 +82,8 @@ _PrintDouble:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-
-_PrintString:
+""",
+    "_PrintString": """_PrintString:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -95,9 +97,8 @@ _PrintString:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-
-_PrintNewLine:
+""",
+    "_PrintNewLine": """_PrintNewLine:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -111,9 +112,8 @@ _PrintNewLine:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-
-_PrintBool:
+""",
+    "_PrintBool": """_PrintBool:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -133,9 +133,8 @@ end:    move    $sp, $fp
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-
-_Alloc:
+""",
+    "_Alloc": """_Alloc:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -147,9 +146,8 @@ _Alloc:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-
-_StringEqual:
+""",
+    "_StringEqual": """_StringEqual:
         subu    $sp, $sp, 8     # decrement sp to make space to save ra, fp
         sw      $fp, 8($sp)     # save fp
         sw      $ra, 4($sp)     # save ra
@@ -199,14 +197,12 @@ end1:   move    $sp, $fp        # pop callee frame off stack
         lw      $ra, -4($fp)    # restore saved ra
         lw      $fp, 0($fp)     # restore saved fp
         jr      $ra             # return from function
-
-
-_Halt:
+""",
+    "_Halt": """_Halt:
         li      $v0, 10
         syscall
-
-
-_ReadInteger:
+""",
+    "_ReadInteger": """_ReadInteger:
         subu    $sp, $sp, 8     # decrement sp to make space to save ra, fp
         sw      $fp, 8($sp)     # save fp
         sw      $ra, 4($sp)     # save ra
@@ -218,9 +214,8 @@ _ReadInteger:
         lw      $ra, -4($fp)    # restore saved ra
         lw      $fp, 0($fp)     # restore saved fp
         jr      $ra
-
-
-_ReadLine:
+""",
+    "_ReadLine": """_ReadLine:
         subu    $sp, $sp, 8     # decrement sp to make space to save ra, fp
         sw      $fp, 8($sp)     # save fp
         sw      $ra, 4($sp)     # save ra
@@ -254,8 +249,8 @@ eloop4: addi    $t1, -1         # add \0 at the end.
         lw      $ra, -4($fp)    # restore saved ra
         lw      $fp, 0($fp)     # restore saved fp
         jr      $ra
-
-_ITOD:
+""",
+    "_ITOD": """_ITOD:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -269,14 +264,14 @@ _ITOD:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-_DTOI:
+""",
+    "_DTOI": """_DTOI:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
         addiu   $fp, $sp, 8
 
-        l.d $f0,0($fp)     #move top stack to f0
+        l.d $f0,4($fp)     #move top stack to f0
         li.d $f6, 0.5 # round to nearest integer
         add.d $f0, $f0, $f6
         cvt.w.d $f0,$f0
@@ -286,8 +281,8 @@ _DTOI:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-_ITOB:
+""",
+    "_ITOB": """_ITOB:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -306,8 +301,8 @@ _ITOB:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
-
-_BTOI:
+""",
+    "_BTOI": """_BTOI:
         subu    $sp, $sp, 8
         sw      $fp, 8($sp)
         sw      $ra, 4($sp)
@@ -319,15 +314,53 @@ _BTOI:
         lw      $ra, -4($fp)
         lw      $fp, 0($fp)
         jr      $ra
+""",
+}
+
+# Data of the runtime, one line per label.
+RUNTIME_DATA: Dict[str, str] = {
+    "TRUE": 'TRUE:.asciiz "true"',
+    "FALSE": 'FALSE:.asciiz "false"',
+    "NEWLINE": 'NEWLINE:.asciiz "\\n"',
+    "DOT": 'DOT: .asciiz "."',
+    "CONST10000": "CONST10000: .double -10000.0",
+}
+
+# Labels every routine refers to, besides its own.
+RUNTIME_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    "_PrintDouble": ("DOT", "CONST10000"),
+    "_PrintNewLine": ("NEWLINE",),
+    "_PrintBool": ("TRUE", "FALSE"),
+}
+
+RUNTIME_SYMBOLS = set(RUNTIME_ROUTINES) | set(RUNTIME_DATA)
+
+
+def link_runtime(referenced: Iterable[str]) -> str:
+    """
+    Code and data of the runtime labels in referenced and of the labels they depend on, in the
+    order of the whole runtime. Labels that are not part of the runtime are ignored.
+    """
+    linked = set()
+    pending = [label for label in referenced if label in RUNTIME_SYMBOLS]
+    while pending:
+        label = pending.pop()
+        if label not in linked:
+            linked.add(label)
+            pending += RUNTIME_DEPENDENCIES.get(label, ())
+    code = "\n".join(
+        routine for label, routine in RUNTIME_ROUTINES.items() if label in linked
+    )
+    data = "".join(
+        line + "\n" for label, line in RUNTIME_DATA.items() if label in linked
+    )
+    if data:
+        code += "\n.data\n" + data
+    return "\n" + code + "\n"
 
-.data
-TRUE:.asciiz "true"
-FALSE:.asciiz "false"
-NEWLINE:.asciiz "\\n"
-DOT: .asciiz "."
-CONST10000: .double -10000.0
 
-"""
+# The whole runtime, for programs linked with all of it.
+standard_library_functions = link_runtime(RUNTIME_SYMBOLS)
 
 
 # For standard library functions. Not anything else.
@@ -1,8 +1,13 @@
 from typing import List
 
 from .models.Type import Type, PrimitiveTypes
+from .registers import is_double_register
 
 ARRAY_LENGTH_SIZE = 4
+# Every object starts with a pointer to the vtable of its class.
+VTABLE_POINTER_SIZE = 4
+# A vtable holds one method address per slot.
+VTABLE_SLOT_SIZE = 4
 
 
 def calc_variable_size(variable_type: Type):
@@ -18,42 +23,36 @@ def generate_clean_param_code(params_size: int) -> str:
     return f"\taddu $sp,$sp,{params_size}\t# clean parameters"
 
 
-def pop_to_temp(t_num: int = 0, size: int = 4) -> List[str]:
-    code = [
-        f"\tlw $t{t_num},{size}($sp)\t#copy top stack to t{t_num}",
-        f"\taddu $sp,$sp,{size}\t# move sp higher cause of pop",
-    ]
-    return code
-
-
-def push_to_stack(t_num: int = 0, size: int = 4) -> List[str]:
-    code = [
-        f"\tsubu $sp,$sp,{size}\t# move sp down cause of push",
-        f"\tsw $t{t_num},{size}($sp)\t#copy t{t_num} to stack",
-    ]
-    return code
-
-
-# To load and save double, pointer must point to the end of double.
+# Every stack slot is addressed 4 bytes above $sp, so after a push the value starts at 4($sp).
+# This holds for doubles too: they take the 8 bytes from 4($sp) up to 12($sp).
 
 
-def pop_double_to_femp(f_num: int = 0, size: int = 8) -> List[str]:
-    code = [
-        f"\tl.d $f{f_num},0($sp)# move top stack to f{f_num}",
-        f"\taddu $sp,$sp,{size}\t# move sp higher cause of pop",
+def push_register(register: str) -> List[str]:
+    if is_double_register(register):
+        return [
+            "\tsubu $sp,$sp,8\t# move sp down cause of push",
+            f"\ts.d {register},4($sp)\t# copy {register} to stack",
+        ]
+    return [
+        "\tsubu $sp,$sp,4\t# move sp down cause of push",
+        f"\tsw {register},4($sp)\t# copy {register} to stack",
     ]
-    return code
 
 
-def push_double_to_stack(f_num: int = 0, size: int = 8) -> List[str]:
-    code = [
-        f"\tsubu $sp,$sp,{size}\t# move sp down cause of push",
-        f"\ts.d $f{f_num},0($sp)\t# copy f{f_num} to stack",
+def pop_register(register: str) -> List[str]:
+    if is_double_register(register):
+        return [
+            f"\tl.d {register},4($sp)\t# copy top stack to {register}",
+            "\taddu $sp,$sp,8\t# move sp higher cause of pop",
+        ]
+    return [
+        f"\tlw {register},4($sp)\t# copy top stack to {register}",
+        "\taddu $sp,$sp,4\t# move sp higher cause of pop",
     ]
-    return code
 
 
 RETURN_ADDRESS = "-4($fp)"
 THIS_ADDRESS = "4($fp)"
 PREV_FP = "$fp"
-DOUBLE_RETURN_REGISTER_NUMBER = 0
+RETURN_REGISTER = "$v0"
+DOUBLE_RETURN_REGISTER = "$f0"